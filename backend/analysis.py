@@ -1,143 +1,311 @@
 import numpy as np
 import pandas as pd
 import math
+import metrics
 
 # --- CONSTANTES GLOBAIS ---
 GRID_SIZE_GPS = 0.00025 
 
+# --- PIRÂMIDE DA GRELHA ---
+# O nível L agrupa 2^L x 2^L células da grelha de base (chaves >> L): o mapa usa células
+# maiores quando o zoom diminui, para que cada círculo ocupe mais ou menos os mesmos pixels.
+# A partir de GRID_BASE_ZOOM usa-se a grelha de base; cada zoom a menos sobe um nível.
+GRID_BASE_ZOOM = 15
+GRID_MAX_LEVEL = 6
+# A área visível pedida é alargada até múltiplos deste número de células do nível: vistas
+# quase iguais (outra janela, outro navegador) caem na mesma chave de cache.
+VIEW_SNAP_CELLS = 8
+
+# --- REGRAS DE CLASSIFICAÇÃO ---
+# Avaliadas em ordem: o ponto recebe o status da primeira regra que casar
+# (sinal <= signal_dbm_max OU perda > packet_loss_above). Sem regra: 'good'.
+STATUS_RULES = [
+    {'status': 'critical', 'signal_dbm_max': -85, 'packet_loss_above': 3},
+    {'status': 'attention', 'signal_dbm_max': -70, 'packet_loss_above': None},
+]
+DEFAULT_STATUS = 'good'
+STATUS_CATEGORIES = [rule['status'] for rule in STATUS_RULES] + [DEFAULT_STATUS]
+
 # --- FUNÇÕES DE ANÁLISE ---
+def _rule_matches(rule, signal, packet_loss):
+    matched = False
+    if rule['signal_dbm_max'] is not None:
+        matched = matched | (signal <= rule['signal_dbm_max'])
+    if rule['packet_loss_above'] is not None:
+        matched = matched | (packet_loss > rule['packet_loss_above'])
+    return matched
+
 def classify_point_status(row):
     """Função única e centralizada para classificar um ponto."""
-    if row['signal_dbm'] <= -85 or row['packet_loss_percent'] > 3:
-        return 'critical'
-    if row['signal_dbm'] <= -70:
-        return 'attention'
-    return 'good'
+    for rule in STATUS_RULES:
+        if _rule_matches(rule, row['signal_dbm'], row['packet_loss_percent']):
+            return rule['status']
+    return DEFAULT_STATUS
 
-def create_grid_zones(points_df, status):
-    if points_df.empty: return []
-    df = points_df.copy()
-    df['grid_lat'] = (df['lat'] // GRID_SIZE_GPS)
-    df['grid_lon'] = (df['lng'] // GRID_SIZE_GPS)
-    df['grid_id'] = df['grid_lat'].astype(str) + '_' + df['grid_lon'].astype(str)
+def classify_status_array(signal, packet_loss):
+    """Versão vetorizada de classify_point_status: devolve um Categorical (códigos int8)."""
+    signal = np.asarray(signal, dtype=float)
+    packet_loss = np.asarray(packet_loss, dtype=float)
+    conditions = [np.broadcast_to(_rule_matches(rule, signal, packet_loss), signal.shape) for rule in STATUS_RULES]
+    codes = np.select(conditions, np.arange(len(STATUS_RULES)), default=len(STATUS_RULES)).astype(np.int8)
+    return pd.Categorical.from_codes(codes, categories=STATUS_CATEGORIES)
+
+@metrics.timed('analysis.classify_points')
+def classify_points(df):
+    """Retorna uma cópia do DataFrame com a coluna 'status' calculada."""
+    df_copy = df.copy()
+    if df_copy.empty:
+        df_copy['status'] = pd.Categorical([], categories=STATUS_CATEGORIES)
+        return df_copy
+    df_copy['status'] = classify_status_array(df_copy['signal_dbm'], df_copy['packet_loss_percent'])
+    return df_copy
+
+def ensure_classified(df):
+    """Classifica os pontos apenas se o DataFrame ainda não tiver a coluna 'status'."""
+    return df.copy() if 'status' in df.columns else classify_points(df)
+
+def grid_keys(lat, lon):
+    """Chaves inteiras da célula da grelha para arrays de latitude/longitude."""
+    grid_lat = (np.asarray(lat, dtype=float) // GRID_SIZE_GPS).astype(np.int64)
+    grid_lon = (np.asarray(lon, dtype=float) // GRID_SIZE_GPS).astype(np.int64)
+    return grid_lat, grid_lon
+
+def format_grid_id(grid_lat, grid_lon, level=0):
+    """'grid_lat_grid_lon' na grelha de base; nos níveis acima, com o sufixo '@nível'."""
+    return f'{grid_lat}_{grid_lon}@{level}' if level else f'{grid_lat}_{grid_lon}'
+
+def parse_grid_id(grid_id):
+    """Converte o grid_id de volta para (grid_lat, grid_lon, nível) (ValueError se inválido)."""
+    keys, _, level = grid_id.partition('@')
+    grid_lat, grid_lon = keys.rsplit('_', 1)
+    level = int(level) if level else 0
+    if not 0 <= level <= GRID_MAX_LEVEL:
+        raise ValueError(f"Nível da grelha inválido: {level}")
+    return int(grid_lat), int(grid_lon), level
+
+def grid_level_for_zoom(zoom):
+    """Nível da pirâmide usado no zoom do mapa."""
+    return min(max(math.ceil(GRID_BASE_ZOOM - zoom), 0), GRID_MAX_LEVEL)
+
+def grid_view(zoom=None, bbox=None, area=None):
+    """Nível da grelha e faixa de chaves (da grelha de base) da área visível do mapa.
+
+    bbox: (oeste, sul, leste, norte) em graus. area: retângulo no mesmo formato fora do qual
+    não há pontos (a área do mapa filtrado); o bbox é recortado a ele, para que todas as vistas
+    que cobrem a área inteira tenham os mesmos bounds. Retorna {'level', 'bounds'}, com bounds =
+    (lat_min, lat_max, lon_min, lon_max) alinhados às células do nível, ou None sem bbox.
+    Levanta ValueError se o zoom ou o bbox forem inválidos.
+    """
+    if zoom is not None and not math.isfinite(zoom):
+        raise ValueError(f"Zoom inválido: {zoom}")
+    level = grid_level_for_zoom(zoom) if zoom is not None else 0
+    if bbox is None:
+        return {'level': level, 'bounds': None}
+    if len(bbox) != 4 or not all(math.isfinite(value) for value in bbox):
+        raise ValueError(f"bbox inválido: {bbox}")
+    west, south, east, north = bbox
+    if west > east or south > north:
+        raise ValueError(f"bbox inválido: {bbox}")
+    if area is not None:
+        clipped = (max(west, area[0]), max(south, area[1]), min(east, area[2]), min(north, area[3]))
+        # Sem interseção, a vista não tem zonas de qualquer forma: fica o bbox pedido.
+        if clipped[0] <= clipped[2] and clipped[1] <= clipped[3]:
+            west, south, east, north = clipped
+    block = VIEW_SNAP_CELLS << level
+    (lat_min, lon_min), (lat_max, lon_max) = [
+        (int(key_lat), int(key_lon)) for key_lat, key_lon in zip(*grid_keys([south, north], [west, east]))
+    ]
+    bounds = (lat_min // block * block, (lat_max // block + 1) * block - 1,
+              lon_min // block * block, (lon_max // block + 1) * block - 1)
+    return {'level': level, 'bounds': bounds}
+
+def in_grid_bounds(grid_lat, grid_lon, bounds):
+    """Máscara das chaves (da grelha de base) dentro de bounds (ver grid_view)."""
+    lat_min, lat_max, lon_min, lon_max = bounds
+    return (grid_lat >= lat_min) & (grid_lat <= lat_max) & (grid_lon >= lon_min) & (grid_lon <= lon_max)
+
+def aggregate_grid_cells(points_df, level=0):
+    """Agrega os pontos por célula do nível: contagem e somas de lat/lon (para o centroide)."""
+    grid_lat, grid_lon = grid_keys(points_df['lat'], points_df['lng'])
+    grid_lat, grid_lon = grid_lat >> level, grid_lon >> level
+    cells = pd.DataFrame({'grid_lat': grid_lat, 'grid_lon': grid_lon, 'lat': points_df['lat'].to_numpy(), 'lng': points_df['lng'].to_numpy()})
+    return cells.groupby(['grid_lat', 'grid_lon'], sort=True).agg(
+        point_count=('lat', 'size'), sum_lat=('lat', 'sum'), sum_lon=('lng', 'sum')
+    ).reset_index()
+
+def zone_style(point_count, status):
+    """Raio e opacidade dos círculos do mapa, calculados para todas as células de uma vez."""
+    point_count = np.asarray(point_count)
+    if status == 'good':
+        return np.full(point_count.shape, 7), np.full(point_count.shape, 0.15)
+    radius = np.select([point_count == 1, point_count < 5], [10, 15], default=20)
+    if status == 'attention':
+        opacity = np.interp(point_count, [1, 10], [0.5, 0.9])
+    elif status == 'critical':
+        opacity = np.interp(point_count, [1, 10], [0.6, 1.0])
+    else:
+        opacity = np.full(point_count.shape, 0.4)
+    return radius, np.round(opacity, 2)
+
+def build_zone_features(cells, status, level=0):
+    """Monta as features GeoJSON a partir das células agregadas (no nível `level`)."""
+    if cells.empty: return []
+    counts = cells['point_count'].to_numpy()
+    radius, opacity = zone_style(counts, status)
+    centroid_lng = cells['sum_lon'].to_numpy() / counts
+    centroid_lat = cells['sum_lat'].to_numpy() / counts
     zones = []
-    for grid_id, group in df.groupby('grid_id'):
-        point_count = len(group)
-        if status == 'good':
-            radius, opacity = 7, 0.15
-        else:
-            if point_count == 1: radius = 10
-            elif point_count < 5: radius = 15
-            else: radius = 20
-            opacity = 0.4
-            if status == 'attention':
-                base_opacity = 0.5
-                opacity = np.interp(point_count, [1, 10], [base_opacity, 0.9]) if point_count > 1 else base_opacity
-            elif status == 'critical':
-                base_opacity = 0.6
-                opacity = np.interp(point_count, [1, 10], [base_opacity, 1.0]) if point_count > 1 else base_opacity
-        point_details = []
-        for index, row in group.iterrows():
-            timestamp = pd.to_datetime(row['timestamp'])
-            formatted_time = timestamp.strftime('%d/%m/%Y %H:%M:%S')
-            point_details.append({ 'id': row['tablet_android_id'], 'time': formatted_time, 'ssid': row['current_ssid'] })
-        centroid = [group['lng'].mean(), group['lat'].mean()]
-        feature = {
+    for grid_lat, grid_lon, count, r, o, lng, lat in zip(cells['grid_lat'], cells['grid_lon'], counts, radius, opacity, centroid_lng, centroid_lat):
+        zones.append({
             "type": "Feature",
-            "properties": { "status": status, "point_count": point_count, "radius": radius, "opacity": round(opacity, 2), "point_details": point_details },
-            "geometry": { "type": "Point", "coordinates": centroid }
-        }
-        zones.append(feature)
+            "properties": { "grid_id": format_grid_id(grid_lat, grid_lon, level), "status": status, "point_count": int(count), "radius": int(r), "opacity": float(o) },
+            "geometry": { "type": "Point", "coordinates": [float(lng), float(lat)] }
+        })
     return zones
 
-def generate_map_data(df):
+def create_grid_zones(points_df, status, level=0):
+    if points_df.empty: return []
+    return build_zone_features(aggregate_grid_cells(points_df, level), status, level)
+
+@metrics.timed('analysis.get_zone_points')
+def get_zone_points(df, grid_id, status=None, page=1, page_size=50):
+    """Detalhes (tablet, hora, SSID) dos pontos de uma célula da grelha, paginados."""
+    grid_lat, grid_lon, level = parse_grid_id(grid_id)
+    result = {'grid_id': grid_id, 'status': status, 'page': page, 'page_size': page_size, 'total': 0, 'points': []}
+    if df.empty: return result
+    lat_keys, lon_keys = grid_keys(df['latitude'], df['longitude'])
+    cell_df = df[((lat_keys >> level) == grid_lat) & ((lon_keys >> level) == grid_lon)]
+    if status:
+        cell_df = ensure_classified(cell_df)
+        cell_df = cell_df[cell_df['status'] == status]
+    page_df = cell_df.iloc[(page - 1) * page_size:page * page_size]
+    result['total'] = len(cell_df)
+    result['points'] = [
+        { 'id': str(tablet), 'time': time, 'ssid': str(ssid) }
+        for tablet, time, ssid in zip(page_df['tablet_android_id'], page_df['timestamp'].dt.strftime('%d/%m/%Y %H:%M:%S'), page_df['current_ssid'])
+    ]
+    return result
+
+@metrics.timed('analysis.generate_map_data')
+def generate_map_data(df, view=None):
+    """Zonas do mapa por status. view (ver grid_view): nível da grelha e área visível."""
     if df.empty: return {'critical_zones': [], 'attention_zones': [], 'good_zones': []}
-    df_copy = df.copy()
-    df_copy['status'] = df_copy.apply(classify_point_status, axis=1)
+    level = view['level'] if view else 0
+    if view and view['bounds']:
+        df = df[in_grid_bounds(*grid_keys(df['latitude'], df['longitude']), view['bounds'])]
+    df_copy = ensure_classified(df)
     df_copy.rename(columns={'latitude': 'lat', 'longitude': 'lng'}, inplace=True)
     critical_df, attention_df, good_df = [df_copy[df_copy['status'] == s] for s in ['critical', 'attention', 'good']]
     return {
-        'critical_zones': create_grid_zones(critical_df, 'critical'),
-        'attention_zones': create_grid_zones(attention_df, 'attention'),
-        'good_zones': create_grid_zones(good_df, 'good')
+        'critical_zones': create_grid_zones(critical_df, 'critical', level),
+        'attention_zones': create_grid_zones(attention_df, 'attention', level),
+        'good_zones': create_grid_zones(good_df, 'good', level)
+    }
+
+@metrics.timed('analysis.generate_map_data_from_cells')
+def generate_map_data_from_cells(cells, level=0):
+    """Mesmo resultado de generate_map_data, a partir de células já agregadas por status
+    no nível `level` (colunas status, grid_lat, grid_lon, point_count, sum_lat, sum_lon)."""
+    return {
+        f'{status}_zones': build_zone_features(cells[cells['status'] == status], status, level)
+        for status in ['critical', 'attention', 'good']
     }
 
 # --- LÓGICA DO GRÁFICO (CORRIGIDA) ---
+# Vizinhos "para frente" na vizinhança de 8: cada par de células adjacentes é unido uma única vez.
+FORWARD_NEIGHBORS = ((0, 1), (1, -1), (1, 0), (1, 1))
+
+def label_grid_clusters(grid_lat, grid_lon):
+    """Rotula as manchas de células vizinhas (componentes conexas) com union-find, em O(N).
+
+    Os rótulos seguem a ordem da primeira célula de cada mancha na entrada.
+    """
+    cells = list(zip(grid_lat.tolist(), grid_lon.tolist()))
+    position = {cell: i for i, cell in enumerate(cells)}
+    parent = list(range(len(cells)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, (lat, lon) in enumerate(cells):
+        for d_lat, d_lon in FORWARD_NEIGHBORS:
+            j = position.get((lat + d_lat, lon + d_lon))
+            if j is None: continue
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    roots = [find(i) for i in range(len(cells))]
+    return pd.factorize(np.asarray(roots))[0]
+
+def aggregate_status_cells(df):
+    """Agrega pontos classificados por (status, célula): contagem e somas de lat/lon."""
+    grid_lat, grid_lon = grid_keys(df['latitude'], df['longitude'])
+    points = pd.DataFrame({
+        'status': np.asarray(df['status'], dtype=object),
+        'grid_lat': grid_lat,
+        'grid_lon': grid_lon,
+        'sum_lat': df['latitude'].to_numpy(dtype=float),
+        'sum_lon': df['longitude'].to_numpy(dtype=float),
+    })
+    return points.groupby(['grid_lat', 'grid_lon', 'status'], sort=True).agg(
+        point_count=('sum_lat', 'size'), sum_lat=('sum_lat', 'sum'), sum_lon=('sum_lon', 'sum')
+    ).reset_index()
+
+@metrics.timed('analysis.get_top_problem_locations')
 def get_top_problem_locations(df):
     if df.empty: return []
     
-    df_copy = df.copy()
-    df_copy['status'] = df_copy.apply(classify_point_status, axis=1)
-    problem_points = df_copy[df_copy['status'].isin(['critical', 'attention'])].copy()
+    df_copy = ensure_classified(df)
+    problem_points = df_copy[df_copy['status'].isin(['critical', 'attention'])]
     if problem_points.empty: return []
+    return get_top_problem_locations_from_cells(aggregate_status_cells(problem_points))
 
-    problem_points['grid_lat'] = (problem_points['latitude'] // GRID_SIZE_GPS).astype(int)
-    problem_points['grid_lon'] = (problem_points['longitude'] // GRID_SIZE_GPS).astype(int)
-    
-    counts = problem_points.groupby(['grid_lat', 'grid_lon', 'status']).size().unstack(fill_value=0)
-    if 'critical' not in counts.columns: counts['critical'] = 0
-    if 'attention' not in counts.columns: counts['attention'] = 0
-    counts['total_problems'] = counts['critical'] + counts['attention']
-    counts.reset_index(inplace=True)
-
-    visited = set()
-    clusters = []
-    grid_coords = set(zip(counts['grid_lat'], counts['grid_lon']))
-
-    for index, grid in counts.iterrows():
-        lat, lon = grid['grid_lat'], grid['grid_lon']
-        if (lat, lon) in visited:
-            continue
-        current_cluster_coords = set()
-        q = [(lat, lon)]
-        visited.add((lat, lon))
-        while q:
-            current_lat, current_lon = q.pop(0)
-            current_cluster_coords.add((current_lat, current_lon))
-            for i in range(-1, 2):
-                for j in range(-1, 2):
-                    if i == 0 and j == 0: continue
-                    neighbor = (current_lat + i, current_lon + j)
-                    if neighbor in grid_coords and neighbor not in visited:
-                        visited.add(neighbor)
-                        q.append(neighbor)
-        clusters.append(current_cluster_coords)
-
-    clustered_data = []
-    for i, cluster_coords in enumerate(clusters):
-        cluster_df = counts[counts.set_index(['grid_lat', 'grid_lon']).index.isin(cluster_coords)]
-        
-        critical_count = cluster_df['critical'].sum()
-        attention_count = cluster_df['attention'].sum()
-        
-        # --- CORREÇÃO APLICADA AQUI ---
-        # 1. Pega TODOS os pontos originais que pertencem a este cluster
-        cluster_points = problem_points[problem_points.set_index(['grid_lat', 'grid_lon']).index.isin(cluster_coords)]
-        
-        # 2. Calcula o centroide (média) das coordenadas desses pontos
-        avg_lat = cluster_points['latitude'].mean()
-        avg_lon = cluster_points['longitude'].mean()
-        # --- FIM DA CORREÇÃO ---
-
-        clustered_data.append({
-            'grid_id': f'{i+1}',
-            'critical_count': int(critical_count),
-            'attention_count': int(attention_count),
-            'total_problems': int(critical_count + attention_count),
-            'lat': avg_lat, # Usa a latitude média
-            'lon': avg_lon  # Usa a longitude média
-        })
+@metrics.timed('analysis.get_top_problem_locations_from_cells')
+def get_top_problem_locations_from_cells(cells):
+    """Top 10 manchas de problemas a partir de células agregadas por status
+    (colunas status, grid_lat, grid_lon, point_count, sum_lat, sum_lon)."""
+    problems = cells[cells['status'].isin(['critical', 'attention'])]
+    if problems.empty: return []
+    status = problems['status'].to_numpy()
+    counts = problems['point_count'].to_numpy()
+    cells = pd.DataFrame({
+        'grid_lat': problems['grid_lat'].to_numpy(),
+        'grid_lon': problems['grid_lon'].to_numpy(),
+        'critical': np.where(status == 'critical', counts, 0),
+        'attention': np.where(status == 'attention', counts, 0),
+        'sum_lat': problems['sum_lat'].to_numpy(),
+        'sum_lon': problems['sum_lon'].to_numpy(),
+    }).groupby(['grid_lat', 'grid_lon'], sort=True).sum().reset_index()
+    cells['cluster'] = label_grid_clusters(cells['grid_lat'].to_numpy(), cells['grid_lon'].to_numpy())
 
-    final_top_10 = sorted(clustered_data, key=lambda x: x['total_problems'], reverse=True)[:10]
-    
-    return final_top_10
+    clusters = cells.groupby('cluster', sort=True)[['critical', 'attention', 'sum_lat', 'sum_lon']].sum()
+    clusters['total_problems'] = clusters['critical'] + clusters['attention']
+    # Ordenação estável: em caso de empate prevalece a ordem das manchas.
+    order = np.argsort(-clusters['total_problems'].to_numpy(), kind='stable')[:10]
+    top = clusters.iloc[order]
+
+    return [
+        {
+            'grid_id': f'{cluster + 1}',
+            'critical_count': int(row.critical),
+            'attention_count': int(row.attention),
+            'total_problems': int(row.total_problems),
+            'lat': row.sum_lat / row.total_problems, # Centroide dos pontos da mancha
+            'lon': row.sum_lon / row.total_problems
+        }
+        for cluster, row in zip(top.index, top.itertuples())
+    ]
 
 # --- FUNÇÃO DE KPIs ---
+@metrics.timed('analysis.calculate_kpis')
 def calculate_kpis(df):
     if df.empty:
         return { 'total_measurements': 0, 'critical_percentage': 0, 'disconnections': 0, 'worst_tablet': 'N/A' }
-    df_copy = df.copy()
-    df_copy['status'] = df_copy.apply(classify_point_status, axis=1)
+    df_copy = ensure_classified(df)
     total_measurements = len(df_copy)
     critical_count = df_copy[df_copy['status'] == 'critical'].shape[0]
     critical_percentage = (critical_count / total_measurements) * 100 if total_measurements > 0 else 0
@@ -145,7 +313,8 @@ def calculate_kpis(df):
     worst_tablet = 'N/A'
     problem_points = df_copy[df_copy['status'].isin(['critical', 'attention'])]
     if not problem_points.empty:
-        tablet_counts = problem_points['tablet_android_id'].value_counts()
+        # astype(str): no snapshot a coluna é categórica; mantém o desempate pela ordem de aparição
+        tablet_counts = problem_points['tablet_android_id'].astype(str).value_counts()
         if not tablet_counts.empty:
             worst_tablet = tablet_counts.index[0]
     return {
@@ -153,4 +322,26 @@ def calculate_kpis(df):
         'critical_percentage': round(critical_percentage, 1),
         'disconnections': disconnections,
         'worst_tablet': worst_tablet
+    }
+
+@metrics.timed('analysis.calculate_kpis_from_summary')
+def calculate_kpis_from_summary(summary):
+    """Mesmo resultado de calculate_kpis, a partir de contagens agregadas
+    (colunas status, ssid_class, tablet_android_id, point_count)."""
+    total_measurements = int(summary['point_count'].sum()) if not summary.empty else 0
+    if total_measurements == 0:
+        return { 'total_measurements': 0, 'critical_percentage': 0, 'disconnections': 0, 'worst_tablet': 'N/A' }
+    critical_count = int(summary.loc[summary['status'] == 'critical', 'point_count'].sum())
+    critical_percentage = (critical_count / total_measurements) * 100
+    disconnections = int(summary.loc[summary['ssid_class'] == 'disconnected', 'point_count'].sum())
+    worst_tablet = 'N/A'
+    problem_counts = summary[summary['status'].isin(['critical', 'attention'])].groupby('tablet_android_id')['point_count'].sum()
+    if not problem_counts.empty:
+        # Empate: o menor ID vence (as contagens agregadas não guardam a ordem de chegada).
+        worst_tablet = problem_counts.idxmax()
+    return {
+        'total_measurements': total_measurements,
+        'critical_percentage': round(critical_percentage, 1),
+        'disconnections': disconnections,
+        'worst_tablet': worst_tablet
     }
\ No newline at end of file
@@ -1,9 +1,22 @@
-from flask import Flask, jsonify, request, render_template, send_file
+from flask import Flask, jsonify, request, render_template, send_file, url_for, Response, stream_with_context
 from flask_cors import CORS
 import database
 import analysis
-import pandas as pd
-import io
+import snapshot
+import rollup
+import tempfile
+import functools
+import hashlib
+import json
+import gzip
+import export
+import events
+import workers
+import tiles
+import cache
+import metrics
+import datetime
+import threading
 # Adicionado para o Waitress
 from waitress import serve
 
@@ -11,154 +24,458 @@ app = Flask(__name__, template_folder='templates', static_folder='static')
 CORS(app)
 
 # --- CONFIGURAÇÕES GLOBAIS ---
-BUFFER_GPS = 0.005
-TMUT_CENTER_LAT = -3.525506
-TMUT_CENTER_LON = -38.797690
-OPERATIONAL_SSID = "2G_6qmzayp"
-MAPS_CONFIG = {
-    'patio': { 'lat_top': -3.543, 'lat_bottom': -3.556, 'lon_left': -38.822, 'lon_right': -38.802 },
-    'tmut': { 'lat_top': TMUT_CENTER_LAT + BUFFER_GPS, 'lat_bottom': TMUT_CENTER_LAT - BUFFER_GPS, 'lon_left': TMUT_CENTER_LON - BUFFER_GPS, 'lon_right': TMUT_CENTER_LON + BUFFER_GPS }
-}
+from config import OPERATIONAL_SSID, MAPS_CONFIG
+# Threads do waitress: as conexões de /api/stream ficam abertas e ocupam uma thread cada, e
+# cada pedido à espera do pool também. Sobram sempre threads livres para '/' e os estáticos.
+SERVER_THREADS = (events.MAX_CLIENTS + workers.ANALYSIS_WORKERS + workers.ANALYSIS_QUEUE
+                  + workers.EXPORT_WORKERS + workers.EXPORT_QUEUE + 8)
 
 # --- FUNÇÃO HELPER ---
 def get_filtered_data(map_name=None, start_date=None, end_date=None, ssid_filter=None, tablet_id=None):
-    df = database.get_all_raw_points()
-    if df.empty: return df
-    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-    df.dropna(subset=['timestamp'], inplace=True)
-    if tablet_id:
-        df = df[df['tablet_android_id'] == tablet_id]
-    if start_date and end_date:
-        start = pd.to_datetime(start_date)
-        end = pd.to_datetime(end_date).replace(hour=23, minute=59, second=59)
-        df = df[(df['timestamp'] >= start) & (df['timestamp'] <= end)]
-    if ssid_filter:
-        if ssid_filter == 'main_network': df = df[df['current_ssid'] == OPERATIONAL_SSID]
-        elif ssid_filter == 'disconnected': df = df[df['current_ssid'] == 'disconnected']
-        elif ssid_filter == 'other_networks': df = df[~df['current_ssid'].isin([OPERATIONAL_SSID, 'disconnected'])]
-    if map_name and map_name in MAPS_CONFIG:
-        bounds = MAPS_CONFIG[map_name]
-        df = df[(df['latitude'].between(bounds['lat_bottom'], bounds['lat_top'])) & (df['longitude'].between(bounds['lon_left'], bounds['lon_right']))]
-    return df.copy()
+    bounds = MAPS_CONFIG.get(map_name) if map_name else None
+    with metrics.stage('snapshot.refresh'):
+        frame = snapshot.refresh()
+    with metrics.stage('snapshot.filter'):
+        df = snapshot.filter_points(frame, bounds, start_date, end_date, ssid_filter, tablet_id, OPERATIONAL_SSID)
+    metrics.rows('snapshot.filter', len(df))
+    return df
+
+def get_since_version():
+    """Cursor `since_version` da query string (None se ausente). Levanta ValueError se inválido."""
+    since_version = request.args.get('since_version', None)
+    return int(since_version) if since_version not in (None, '') else None
+
+def map_area(map_name):
+    """Retângulo (oeste, sul, leste, norte) da área do mapa, ou None para um mapa desconhecido."""
+    bounds = MAPS_CONFIG.get(map_name)
+    return bounds and (bounds['lon_left'], bounds['lat_bottom'], bounds['lon_right'], bounds['lat_top'])
+
+def get_map_view(map_name):
+    """Vista do mapa (analysis.grid_view) a partir de `zoom` e `bbox` (oeste,sul,leste,norte)
+    da query string, recortada à área do mapa; None se nenhum dos dois vier. Levanta
+    ValueError se inválidos."""
+    zoom = request.args.get('zoom', '')
+    bbox = request.args.get('bbox', '')
+    if not zoom and not bbox:
+        return None
+    return analysis.grid_view(float(zoom) if zoom else None, [float(value) for value in bbox.split(',')] if bbox else None, map_area(map_name))
+
+def get_dashboard_filters():
+    """Lê da query string os filtros comuns às rotas do dashboard."""
+    return {
+        'map_name': request.args.get('map', 'patio'),
+        'start_date': request.args.get('start_date', None),
+        'end_date': request.args.get('end_date', None),
+        'ssid_filter': request.args.get('ssid_filter', 'main_network'),
+        'tablet_id': request.args.get('tablet_id', None),
+    }
+
+# --- CÁLCULO DOS DADOS DO DASHBOARD ---
+# Usam a tabela de agregados (grid_rollup) quando ela está em dia com a grelha e as
+# regras atuais; caso contrário, caem para os pontos brutos do snapshot. Os resultados
+# ficam no cache LRU por (tipo, versão dos dados, filtros).
+# O mapa leva a versão dos dados ('version') como cursor. Com since_version, só vêm as zonas
+# alteradas desde essa versão ('full': False); sem cursor válido, vêm todas ('full': True).
+# Com uma vista (zoom/bbox), só vêm as células do nível da pirâmide e da área visível: o
+# tamanho da resposta depende da tela, não do volume de dados.
+def versioned_map_data(map_data, version, full):
+    return {**map_data, 'version': version, 'full': full}
+
+def _map_data(filters, version, since_version, view=None):
+    level = view['level'] if view else 0
+    if since_version is not None and rollup.accepts_cursor(since_version):
+        cells = rollup.get_changed_grid_cells(since_version, **filters, view=view)
+        return versioned_map_data(analysis.generate_map_data_from_cells(cells, level), version, False)
+    if rollup.is_current():
+        return versioned_map_data(analysis.generate_map_data_from_cells(rollup.get_grid_cells(**filters, view=view), level), version, True)
+    return versioned_map_data(analysis.generate_map_data(get_filtered_data(**filters), view), version, True)
+
+def _critical_points(filters):
+    if rollup.is_current():
+        return analysis.get_top_problem_locations_from_cells(rollup.get_grid_cells(**filters))
+    return analysis.get_top_problem_locations(get_filtered_data(**filters))
+
+def _kpis(filters):
+    if rollup.is_current():
+        return analysis.calculate_kpis_from_summary(rollup.get_kpi_summary(**filters))
+    return analysis.calculate_kpis(get_filtered_data(**filters))
+
+def _dashboard(filters, version, with_map=True):
+    """KPIs, gráfico e (com with_map) o mapa da área inteira, a partir de uma única consulta/classificação."""
+    if rollup.is_current():
+        cells = rollup.get_grid_cells(**filters)
+        dashboard = {
+            'kpis': analysis.calculate_kpis_from_summary(rollup.get_kpi_summary(**filters)),
+            'critical_points': analysis.get_top_problem_locations_from_cells(cells)
+        }
+        if with_map:
+            dashboard['map_data'] = versioned_map_data(analysis.generate_map_data_from_cells(cells), version, True)
+        return dashboard
+    df_classified = analysis.classify_points(get_filtered_data(**filters))
+    dashboard = {
+        'kpis': analysis.calculate_kpis(df_classified),
+        'critical_points': analysis.get_top_problem_locations(df_classified)
+    }
+    if with_map:
+        dashboard['map_data'] = versioned_map_data(analysis.generate_map_data(df_classified), version, True)
+    return dashboard
+
+# Só o cálculo que de fato falta no cache vai para o pool de análise (workers): acertos
+# e pedidos iguais simultâneos não ocupam vaga na fila.
+def compute_map_data(filters, since_version=None, view=None):
+    version = database.get_data_version()
+    key = cache.make_key('map_data', version, filters, since_version, view and (view['level'], view['bounds']))
+    return cache.get_or_compute(key, lambda: workers.run(_map_data, filters, version, since_version, view))
+
+def compute_critical_points(filters):
+    key = cache.make_key('critical_points', database.get_data_version(), filters)
+    return cache.get_or_compute(key, lambda: workers.run(_critical_points, filters))
+
+def compute_kpis(filters):
+    key = cache.make_key('kpis', database.get_data_version(), filters)
+    return cache.get_or_compute(key, lambda: workers.run(_kpis, filters))
+
+def compute_dashboard(filters, since_version=None, view=None):
+    """KPIs, mapa e gráfico. Com uma vista do mapa ou um cursor aceito, o mapa vem à parte
+    (compute_map_data) e o resto fica em cache sem o mapa da área inteira, que não seria usado."""
+    version = database.get_data_version()
+    if view is None and (since_version is None or not rollup.accepts_cursor(since_version)):
+        key = cache.make_key('dashboard', version, filters)
+        return cache.get_or_compute(key, lambda: workers.run(_dashboard, filters, version))
+    key = cache.make_key('dashboard_summary', version, filters)
+    summary = cache.get_or_compute(key, lambda: workers.run(_dashboard, filters, version, False))
+    return {**summary, 'map_data': compute_map_data(filters, since_version, view)}
+
+# --- AQUECIMENTO DO CACHE ---
+# A cada nova versão dos dados, as vistas padrão das telas da sala de operação
+# (Pátio e TMUT, rede principal, hoje e ontem — o frontend abre em ontem) são
+# calculadas em segundo plano, antes de os navegadores pedirem.
+WARMUP_MAPS = ['patio', 'tmut']
+WARMUP_DAYS_AGO = [0, 1]
+# Zoom inicial de cada mapa no frontend (patioView/tmutView em map-view.js). A área visível
+# pedida (com margem) cobre o mapa inteiro e é recortada a ele: a vista aquecida é a mesma.
+WARMUP_ZOOM = {'patio': 16, 'tmut': 15.5}
+
+def default_map_view(map_name):
+    return analysis.grid_view(WARMUP_ZOOM[map_name], map_area(map_name), map_area(map_name))
+
+def default_view_filters():
+    today = datetime.date.today()
+    return [
+        {'map_name': map_name, 'start_date': day, 'end_date': day, 'ssid_filter': 'main_network', 'tablet_id': None}
+        for map_name in WARMUP_MAPS
+        for day in [(today - datetime.timedelta(days=days_ago)).isoformat() for days_ago in WARMUP_DAYS_AGO]
+    ]
+
+def warm_default_views():
+    for filters in default_view_filters():
+        try:
+            compute_dashboard(filters, view=default_map_view(filters['map_name']))
+        except (workers.Saturated, TimeoutError):
+            return
+        except Exception as e:
+            print(f"Erro ao pré-calcular a vista padrão {filters}: {e}")
+
+def start_warmup(version=None):
+    threading.Thread(target=warm_default_views, name='cache-warmup', daemon=True).start()
+
+# --- CACHE HTTP (ETag / gzip) ---
+# O ETag depende só da versão dos dados publicada pelo ETL e dos filtros normalizados:
+# se nada mudou, o navegador recebe 304 sem que nenhum dado seja lido ou analisado.
+GZIP_MIN_BYTES = 1024
+
+def make_data_etag(version):
+    params = sorted({**get_dashboard_filters(), **request.args.to_dict()}.items())
+    key = json.dumps([request.path, version, rollup.ROLLUP_SIGNATURE, params], default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def versioned_by_data(route_function):
+    """Responde 304 quando o cliente já tem a resposta para a versão atual dos dados."""
+    @functools.wraps(route_function)
+    def wrapper(*args, **kwargs):
+        version = database.get_data_version()
+        etag = make_data_etag(version)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = app.make_response(route_function(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+def json_response(value):
+    with metrics.stage('jsonify'):
+        return jsonify(value)
+
+@app.after_request
+def gzip_json_response(response):
+    """Comprime respostas JSON grandes quando o cliente aceita gzip."""
+    if (response.status_code != 200 or response.direct_passthrough or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+    with metrics.stage('gzip'):
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+# --- MÉTRICAS DOS PEDIDOS ---
+# Cada pedido é medido do início até o fim do envio da resposta (inclusive o streaming
+# das exportações em CSV), com as etapas percorridas. As conexões de /api/stream ficam de
+# fora: duram o tempo que o navegador estiver aberto.
+UNMEASURED_ENDPOINTS = {'stream_route'}
+
+@app.before_request
+def start_request_metrics():
+    if request.endpoint in UNMEASURED_ENDPOINTS:
+        metrics.end_trace()
+    else:
+        metrics.start_trace()
+
+@app.after_request
+def finish_request_metrics(response):
+    trace = metrics.current_trace()
+    if trace is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'not_found'
+    method = request.method
+    params = request.args.to_dict()
+
+    def finish():
+        metrics.finish_request(trace, route, method, response.status_code, response.content_length, params)
+        metrics.end_trace()
+    # Arquivos (send_file) vão direto ao servidor, sem passar pelos callbacks de fechamento.
+    if response.direct_passthrough:
+        finish()
+    else:
+        response.call_on_close(finish)
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_route():
+    """Métricas no formato de texto do Prometheus (servidor e, se houver, o ETL)."""
+    cache_stats = cache.stats()
+    text = metrics.render('dashboard', {
+        'cache_hits_total': ('counter', "Acertos do cache de resultados.", cache_stats['hits']),
+        'cache_misses_total': ('counter', "Faltas do cache de resultados.", cache_stats['misses']),
+        'cache_bytes': ('gauge', "Tamanho estimado do cache de resultados.", cache_stats['bytes']),
+        'cache_entries': ('gauge', "Entradas no cache de resultados.", cache_stats['entries']),
+        'data_version': ('gauge', "Versão dos dados publicada pelo ETL.", database.get_data_version()),
+    })
+    return Response(text + metrics.read_textfile(metrics.ETL_METRICS_PATH), mimetype='text/plain; version=0.0.4')
 
 # --- ROTA PRINCIPAL ---
 @app.route('/')
 def index():
     return render_template('index.html')
 
+# --- TILES DO MAPA ---
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.png')
+def tile_route(z, x, y):
+    """Serve os tiles do arquivo MBTiles, com cache imutável no navegador."""
+    tile = tiles.get_tile(z, x, y)
+    if tile is None:
+        return "Tile não encontrado.", 404
+    data, etag = tile
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(data, mimetype=tiles.tile_mimetype(data))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={tiles.CACHE_MAX_AGE_SECONDS}, immutable'
+    return response
+
 # --- ROTAS DA API ---
+@app.route('/api/dashboard', methods=['GET'])
+@versioned_by_data
+def dashboard_route():
+    """Filtra e classifica uma única vez e devolve KPIs, mapa e gráfico juntos."""
+    filters = get_dashboard_filters()
+    try:
+        since_version = get_since_version()
+        view = get_map_view(filters['map_name'])
+    except ValueError:
+        return "Erro: Parâmetros 'since_version', 'zoom' ou 'bbox' inválidos.", 400
+    return json_response(compute_dashboard(filters, since_version, view))
+
 @app.route('/api/map_data', methods=['GET'])
+@versioned_by_data
 def map_data_route():
-    map_name = request.args.get('map', 'patio')
-    start_date = request.args.get('start_date', None)
-    end_date = request.args.get('end_date', None)
-    ssid_filter = request.args.get('ssid_filter', 'main_network')
-    tablet_id = request.args.get('tablet_id', None)
-    df_filtered = get_filtered_data(map_name, start_date, end_date, ssid_filter, tablet_id)
-    zones_data = analysis.generate_map_data(df_filtered)
-    return jsonify(zones_data)
+    """Zonas do mapa; com `zoom` e `bbox`, só as do nível da grelha e da área visível."""
+    filters = get_dashboard_filters()
+    try:
+        since_version = get_since_version()
+        view = get_map_view(filters['map_name'])
+    except ValueError:
+        return "Erro: Parâmetros 'since_version', 'zoom' ou 'bbox' inválidos.", 400
+    return json_response(compute_map_data(filters, since_version, view))
 
 @app.route('/api/critical_points', methods=['GET'])
+@versioned_by_data
 def critical_points_route():
-    map_name = request.args.get('map', 'patio')
-    start_date = request.args.get('start_date', None)
-    end_date = request.args.get('end_date', None)
-    ssid_filter = request.args.get('ssid_filter', 'main_network')
-    tablet_id = request.args.get('tablet_id', None)
-    df_filtered = get_filtered_data(map_name, start_date, end_date, ssid_filter, tablet_id)
-    chart_data = analysis.get_top_problem_locations(df_filtered)
-    return jsonify(chart_data)
+    return json_response(compute_critical_points(get_dashboard_filters()))
 
 @app.route('/api/kpis', methods=['GET'])
+@versioned_by_data
 def kpis_route():
-    map_name = request.args.get('map', 'patio')
-    start_date = request.args.get('start_date', None)
-    end_date = request.args.get('end_date', None)
-    ssid_filter = request.args.get('ssid_filter', 'main_network')
-    tablet_id = request.args.get('tablet_id', None)
-    df_filtered = get_filtered_data(map_name, start_date, end_date, ssid_filter, tablet_id)
-    kpi_data = analysis.calculate_kpis(df_filtered)
-    return jsonify(kpi_data)
+    return json_response(compute_kpis(get_dashboard_filters()))
+
+@app.route('/api/zone_points', methods=['GET'])
+@versioned_by_data
+def zone_points_route():
+    """Detalhes dos pontos de uma zona do mapa, buscados sob demanda pelo popup."""
+    grid_id = request.args.get('grid', '')
+    status = request.args.get('status', None)
+    try:
+        analysis.parse_grid_id(grid_id)
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 50)), 1), 500)
+    except ValueError:
+        return "Erro: Parâmetros 'grid', 'page' ou 'page_size' inválidos.", 400
+    filters = get_dashboard_filters()
+    return json_response(workers.run(lambda: analysis.get_zone_points(get_filtered_data(**filters), grid_id, status, page, page_size)))
+
+@app.route('/api/stream', methods=['GET'])
+def stream_route():
+    """Server-sent events: avisa os clientes assim que o ETL grava uma nova versão dos dados."""
+    events.ensure_watcher()
+    if not events.subscribe():
+        return Response("Muitas conexões abertas; use a atualização periódica.", status=503, headers={'Retry-After': '60'})
+    response = Response(
+        events.iter_stream(), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # O servidor fecha a resposta mesmo quando o cliente sai antes do primeiro envio.
+    response.call_on_close(events.unsubscribe)
+    return response
 
 # --- ENDPOINT DE EXPORTAÇÃO (CORRIGIDO) ---
+def get_export_request():
+    """Lê e valida os filtros da exportação. Retorna (filtros, formato, erro)."""
+    filters = {
+        'start_date': request.args.get('start_date', None),
+        'end_date': request.args.get('end_date', None),
+        # --- NOVOS PARÂMETROS ADICIONADOS ---
+        'ssid_filter': request.args.get('ssid_filter', None),
+        'tablet_id': request.args.get('tablet_id', None),
+    }
+    # Formatos: xlsx (padrão), csv ou csv.gz
+    export_format = request.args.get('format', 'xlsx')
+
+    if not filters['start_date'] or not filters['end_date']:
+        return filters, export_format, ("Erro: As datas de início e fim são obrigatórias.", 400)
+    if export_format not in export.EXPORT_FORMATS:
+        return filters, export_format, ("Erro: Formato de exportação inválido (use xlsx, csv ou csv.gz).", 400)
+    if not export.has_rows(**filters):
+        return filters, export_format, ("Nenhum dado encontrado para os filtros selecionados.", 404)
+    return filters, export_format, None
+
+def export_file_name(filters, export_format):
+    return f"Relatorio_WiFi_{filters['start_date']}_a_{filters['end_date']}.{export_format}"
+
 @app.route('/api/export', methods=['GET'])
 def export_excel_route():
-    start_date = request.args.get('start_date', None)
-    end_date = request.args.get('end_date', None)
-    # --- NOVOS PARÂMETROS ADICIONADOS ---
-    ssid_filter = request.args.get('ssid_filter', None)
-    tablet_id = request.args.get('tablet_id', None)
-
-    if not start_date or not end_date:
-        return "Erro: As datas de início e fim são obrigatórias.", 400
-
-    # A função agora recebe TODOS os filtros
-    df = get_filtered_data(start_date=start_date, end_date=end_date, ssid_filter=ssid_filter, tablet_id=tablet_id)
-    if df.empty:
-        return "Nenhum dado encontrado para os filtros selecionados.", 404
-
-    def assign_area(row):
-        lat, lon = row['latitude'], row['longitude']
-        patio = MAPS_CONFIG['patio']
-        tmut = MAPS_CONFIG['tmut']
-        if (patio['lat_bottom'] <= lat <= patio['lat_top']) and (patio['lon_left'] <= lon <= patio['lon_right']):
-            return 'Pátio'
-        if (tmut['lat_bottom'] <= lat <= tmut['lat_top']) and (tmut['lon_left'] <= lon <= tmut['lon_right']):
-            return 'TMUT'
-        return 'Fora da Área'
-        
-    df['Área'] = df.apply(assign_area, axis=1)
-    df['Data'] = df['timestamp'].dt.strftime('%d/%m/%Y')
-    df['Hora'] = df['timestamp'].dt.strftime('%H:%M:%S')
-
-    column_mapping = {
-        'tablet_android_id': 'Tablet (Android ID)',
-        'signal_dbm': 'Sinal de Rede (dBm)',
-        'current_ssid': 'Rede Wi-Fi Conectada',
-        'packet_loss_percent': 'Perda de Pacotes (%)',
-        'latitude': 'Latitude',
-        'longitude': 'Longitude'
-    }
-    df_renamed = df.rename(columns=column_mapping)
-    
-    final_column_order = [
-        'Tablet (Android ID)', 'Data', 'Hora', 'Área', 'Sinal de Rede (dBm)',
-        'Rede Wi-Fi Conectada', 'Perda de Pacotes (%)', 'Latitude', 'Longitude'
-    ]
-    df_final = df_renamed[final_column_order]
-
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        for date_str, daily_data in df_final.groupby('Data'):
-            sheet_name_date = pd.to_datetime(date_str, format='%d/%m/%Y')
-            sheet_name = sheet_name_date.strftime('%d-%m-%Y')
-            sorted_daily_data = daily_data.sort_values(by=['Área', 'Rede Wi-Fi Conectada', 'Hora'])
-            sorted_daily_data.to_excel(writer, sheet_name=sheet_name, index=False)
-            worksheet = writer.sheets[sheet_name]
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                header_length = len(str(worksheet[f'{column_letter}1'].value))
-                max_length = header_length
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = (max_length + 2)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
+    filters, export_format, error = get_export_request()
+    if error:
+        return error
 
+    file_name = export_file_name(filters, export_format)
+    if export_format in ('csv', 'csv.gz'):
+        # CSV é enviado em streaming, direto do cursor do banco.
+        return Response(
+            stream_with_context(export.iter_csv(**filters, compress=export_format == 'csv.gz')),
+            mimetype=export.EXPORT_FORMATS[export_format],
+            headers={'Content-Disposition': f'attachment; filename={file_name}'}
+        )
+
+    # O .xlsx é montado num arquivo temporário em disco, não na memória, no pool de exportação.
+    # Se o pedido desistir por timeout, o arquivo só é fechado (e apagado) quando o worker acabar.
+    output = tempfile.TemporaryFile()
+    try:
+        workers.run(export.write_xlsx, output, **filters, pool=workers.EXPORT_POOL,
+                    timeout=workers.EXPORT_TIMEOUT_SECONDS, on_abandon=output.close)
+    except TimeoutError:
+        raise
+    except Exception:
+        output.close()
+        raise
+    size = output.tell()
     output.seek(0)
     
-    return send_file(
+    response = send_file(
         output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        mimetype=export.EXPORT_FORMATS['xlsx'],
         as_attachment=True,
-        download_name=f'Relatorio_WiFi_{start_date}_a_{end_date}.xlsx'
+        download_name=file_name
     )
+    response.content_length = size
+    return response
+
+# --- EXPORTAÇÕES ASSÍNCRONAS ---
+# Relatórios grandes viram jobs: o pedido volta logo com o id, o navegador consulta o
+# estado e baixa o arquivo pelo download_url quando ele fica pronto.
+def job_status(job):
+    status = {'job_id': job['id'], 'status': job['status'], 'file_name': job['file_name'], 'error': job['error']}
+    if job['status'] == 'done':
+        status['download_url'] = url_for('export_job_download_route', job_id=job['id'])
+    return status
+
+@app.route('/api/export/jobs', methods=['POST'])
+def export_job_create_route():
+    filters, export_format, error = get_export_request()
+    if error:
+        return error
+    job_id = workers.start_job(
+        lambda path: export.write_file(path, export_format, **filters),
+        export_file_name(filters, export_format), export.EXPORT_FORMATS[export_format]
+    )
+    response = jsonify(job_status(workers.get_job(job_id)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('export_job_route', job_id=job_id)
+    return response
+
+@app.route('/api/export/jobs/<job_id>', methods=['GET'])
+def export_job_route(job_id):
+    job = workers.get_job(job_id)
+    if job is None:
+        return "Exportação não encontrada (ou expirada).", 404
+    return jsonify(job_status(job))
+
+@app.route('/api/export/jobs/<job_id>/download', methods=['GET'])
+def export_job_download_route(job_id):
+    job = workers.get_job(job_id)
+    if job is None:
+        return "Exportação não encontrada (ou expirada).", 404
+    if job['status'] != 'done':
+        return "Exportação ainda não concluída.", 409
+    return send_file(job['path'], mimetype=job['mimetype'], as_attachment=True, download_name=job['file_name'])
+
+# --- POOL SATURADO / TEMPO ESGOTADO ---
+@app.errorhandler(workers.Saturated)
+def saturated_error(error):
+    return Response(
+        "Servidor ocupado. Tente novamente em instantes.", status=503,
+        headers={'Retry-After': str(workers.RETRY_AFTER_SECONDS)}
+    )
+
+@app.errorhandler(TimeoutError)
+def timeout_error(error):
+    return "O processamento excedeu o tempo limite. Tente um período menor.", 504
 
 # --- INICIALIZAÇÃO PARA PRODUÇÃO ---
 if __name__ == '__main__':
+    database.enable_wal()
+    database.ensure_schema()
+    database.ensure_indexes()
+    rollup.ensure_current()
+    events.on_new_version(start_warmup)
+    events.ensure_watcher()
+    start_warmup()
     print("Iniciando servidor de produção na porta 5000...")
-    serve(app, host='0.0.0.0', port=5000)
\ No newline at end of file
+    serve(app, host='0.0.0.0', port=5000, threads=SERVER_THREADS)
\ No newline at end of file
@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import database
+import metrics
+import process_data
+import rollup
+import synthetic_data
+
+# --- BENCHMARK DOS CAMINHOS CRÍTICOS DO BACKEND ---
+# Gera um banco sintético numa pasta temporária e mede: leitura/filtro do snapshot, cada
+# função de analysis.py, cada rota da API (inclusive a exportação) pelo cliente de teste
+# do Flask e o ETL num CSV que cresce. O resultado vai para um JSON que pode ser comparado
+# com o de uma versão anterior (--compare).
+DEFAULT_ROWS = 200_000
+DEFAULT_REPEAT = 3
+DEFAULT_OUTPUT = 'benchmark_results.json'
+# Aumento relativo do melhor tempo (min) a partir do qual um resultado conta como regressão.
+# Compara-se o mínimo, e não a mediana: é o valor menos afetado pela carga da máquina.
+REGRESSION_THRESHOLD = 0.20
+# Tempos abaixo disto (s) variam demais para serem comparados.
+MIN_COMPARABLE_SECONDS = 0.010
+ETL_STEPS = 3
+# Linhas da comparação entre a classificação vetorizada e a antiga, linha a linha (df.apply).
+CLASSIFY_ROWS = 1_000_000
+
+def measure(name, group, fn, repeat, setup=None):
+    """Executa fn `repeat` vezes (setup antes de cada uma, fora do tempo) e resume os tempos.
+    fn pode devolver um dicionário de informações extras (linhas, bytes) guardado no resultado."""
+    runs = []
+    extra = {}
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        extra = fn() or {}
+        runs.append(time.perf_counter() - start)
+    result = {
+        'name': name, 'group': group, 'runs': runs,
+        'min': min(runs), 'median': statistics.median(runs), 'mean': statistics.fmean(runs),
+        **extra,
+    }
+    print(f"  {name:<45} mediana {result['median'] * 1000:9.1f} ms  {extra if extra else ''}")
+    return result
+
+def ignore_result(fn):
+    """Para medir funções cujo retorno não é um dicionário de informações extras."""
+    def run():
+        fn()
+    return run
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def date_range(args):
+    start = pd.Timestamp(args.start_date)
+    return str(start.date()), str((start + pd.Timedelta(days=args.days - 1)).date())
+
+def benchmark_analysis(results, args):
+    # Importados aqui: app e snapshot leem database.DB_PATH já apontado para o banco sintético.
+    import analysis
+    import app
+    import snapshot
+
+    print("Snapshot e análises:")
+    start_date, end_date = date_range(args)
+    filters = {'map_name': 'patio', 'start_date': start_date, 'end_date': end_date, 'ssid_filter': 'main_network'}
+    results.append(measure('get_filtered_data (frio)', 'snapshot', lambda: {'rows': len(app.get_filtered_data(**filters))}, args.repeat, setup=snapshot.reset))
+    results.append(measure('get_filtered_data', 'snapshot', lambda: {'rows': len(app.get_filtered_data(**filters))}, args.repeat))
+
+    df = app.get_filtered_data(**filters)
+    classified = analysis.classify_points(df.copy())
+    cells = analysis.aggregate_status_cells(classified)
+    grid_lat, grid_lon = analysis.grid_keys(df['latitude'], df['longitude'])
+    grid_id = analysis.format_grid_id(int(pd.Series(grid_lat).mode()[0]), int(pd.Series(grid_lon).mode()[0]))
+    for name, fn in [
+        ('classify_points', lambda: analysis.classify_points(df.copy())),
+        ('generate_map_data', lambda: analysis.generate_map_data(df)),
+        ('generate_map_data_from_cells', lambda: analysis.generate_map_data_from_cells(cells)),
+        ('get_top_problem_locations', lambda: analysis.get_top_problem_locations(df)),
+        ('get_top_problem_locations_from_cells', lambda: analysis.get_top_problem_locations_from_cells(cells)),
+        ('calculate_kpis', lambda: analysis.calculate_kpis(df)),
+        ('get_zone_points', lambda: analysis.get_zone_points(df, grid_id, 'good')),
+    ]:
+        results.append(measure(name, 'analysis', ignore_result(fn), args.repeat))
+    return grid_id
+
+def benchmark_classification(results, args):
+    """classify_points contra a classificação linha a linha (uma só execução: leva segundos)."""
+    import analysis
+
+    print(f"Classificação ({args.classify_rows} linhas):")
+    rng = np.random.default_rng(args.seed)
+    df = pd.DataFrame({
+        'signal_dbm': rng.integers(-110, -30, args.classify_rows),
+        'packet_loss_percent': rng.choice([0.0, 1.0, 2.0, 3.0, 5.0, 20.0, 100.0], args.classify_rows),
+    })
+    vectorized = measure('classify_points', 'classification', ignore_result(lambda: analysis.classify_points(df)), args.repeat)
+    row_wise = measure('classify_point_status (df.apply)', 'classification', ignore_result(lambda: df.apply(analysis.classify_point_status, axis=1)), 1)
+    vectorized['rows'] = row_wise['rows'] = args.classify_rows
+    vectorized['speedup'] = row_wise['min'] / vectorized['min']
+    print(f"  classify_points é {vectorized['speedup']:.0f}x mais rápida que df.apply.")
+    results += [vectorized, row_wise]
+
+def benchmark_routes(results, args, grid_id):
+    import app
+    import cache
+
+    print("Rotas da API:")
+    start_date, end_date = date_range(args)
+    one_day = f'start_date={end_date}&end_date={end_date}'
+    all_days = f'start_date={start_date}&end_date={end_date}'
+    client = app.app.test_client()
+    headers = {'Accept-Encoding': 'gzip'}
+
+    def get(url):
+        response = client.get(url, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url}: HTTP {response.status_code}")
+        return {'bytes': len(response.get_data())}
+
+    routes = [
+        ('/api/dashboard (1 dia)', f'/api/dashboard?map=patio&{one_day}'),
+        ('/api/dashboard', f'/api/dashboard?map=patio&{all_days}'),
+        ('/api/dashboard (todas as redes)', f'/api/dashboard?map=patio&{all_days}&ssid_filter=all'),
+        ('/api/map_data', f'/api/map_data?map=patio&{all_days}'),
+        ('/api/critical_points', f'/api/critical_points?map=patio&{all_days}'),
+        ('/api/kpis', f'/api/kpis?map=patio&{all_days}'),
+    ]
+    for name, url in routes:
+        results.append(measure(f'{name} (sem cache)', 'routes', lambda: get(url), args.repeat, setup=cache.clear))
+        results.append(measure(f'{name} (em cache)', 'routes', lambda: get(url), args.repeat))
+    results.append(measure('/api/zone_points', 'routes', lambda: get(f'/api/zone_points?map=patio&{all_days}&grid={grid_id}&status=good'), args.repeat))
+
+    print("Exportação:")
+    for export_format in ('xlsx', 'csv', 'csv.gz'):
+        results.append(measure(f'/api/export ({export_format}, 1 dia)', 'export', lambda: get(f'/api/export?{one_day}&format={export_format}'), args.repeat))
+
+def benchmark_etl(results, args, work_dir):
+    """ETL incremental: grava um CSV inicial e vai acrescentando blocos, processando a cada passo."""
+    print("ETL (CSV crescente):")
+    process_data.DB_PATH = os.path.join(work_dir, 'etl.db')
+    process_data.CSV_PATH = os.path.join(work_dir, 'raw_data.csv')
+    # Estado antigo do ETL (linha processada): um arquivo de produção não pode decidir o que é lido.
+    process_data.STATE_FILE_PATH = os.path.join(work_dir, '.last_processed_line')
+    step_rows = max(1, args.etl_rows // (args.etl_steps + 1))
+    chunks = synthetic_data.generate_chunks(args.etl_rows, args.seed, args.start_date, args.days, chunk_rows=step_rows)
+
+    def run_step(label, append):
+        rows = synthetic_data.write_csv(process_data.CSV_PATH, [next(chunks)], append=append)
+        result = measure(label, 'etl', process_data.process_log_data, 1)
+        result['rows'] = rows
+        result['csv_bytes'] = os.path.getsize(process_data.CSV_PATH)
+        results.append(result)
+
+    run_step('process_log_data (carga inicial)', append=False)
+    for step in range(1, args.etl_steps + 1):
+        run_step(f'process_log_data (incremento {step})', append=True)
+
+def compare(results, previous_path, threshold=REGRESSION_THRESHOLD):
+    """Compara os melhores tempos com um resultado anterior. Retorna a lista de regressões."""
+    with open(previous_path) as f:
+        previous = {(r['group'], r['name']): r for r in json.load(f)['results']}
+    regressions = []
+    print(f"Comparação com '{previous_path}':")
+    for result in results:
+        before = previous.get((result['group'], result['name']))
+        if not before or max(before['min'], result['min']) < MIN_COMPARABLE_SECONDS:
+            continue
+        change = result['min'] / before['min'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  <-- REGRESSÃO'
+            regressions.append({'name': result['name'], 'group': result['group'], 'before': before['min'], 'after': result['min'], 'change': change})
+        print(f"  {result['name']:<45} {before['min'] * 1000:9.1f} -> {result['min'] * 1000:9.1f} ms ({change:+.0%}){flag}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mede os caminhos críticos do backend com dados sintéticos.")
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="Linhas do banco sintético.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start-date', default=synthetic_data.DEFAULT_START_DATE)
+    parser.add_argument('--days', type=int, default=synthetic_data.DEFAULT_DAYS)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Execuções de cada medição.")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Arquivo JSON com os resultados.")
+    parser.add_argument('--compare', help="JSON de uma execução anterior: aponta as regressões e sai com código 1.")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help="Aumento relativo que conta como regressão (0.2 = 20%%).")
+    parser.add_argument('--etl-rows', type=int, help="Linhas do teste de ETL (padrão: --rows).")
+    parser.add_argument('--etl-steps', type=int, default=ETL_STEPS, help="Incrementos do CSV no teste de ETL.")
+    parser.add_argument('--skip-etl', action='store_true')
+    parser.add_argument('--classify-rows', type=int, default=CLASSIFY_ROWS, help="Linhas da comparação da classificação (0 desativa).")
+    args = parser.parse_args()
+    args.etl_rows = args.etl_rows or args.rows
+
+    work_dir = tempfile.mkdtemp(prefix='dashboard-bench-')
+    results = []
+    try:
+        print(f"Gerando {args.rows} linhas sintéticas em '{work_dir}'...")
+        database.DB_PATH = os.path.join(work_dir, 'dashboard.db')
+        metrics.SLOW_LOG_PATH = os.path.join(work_dir, 'slow_requests.log')
+        metrics.ETL_METRICS_PATH = os.path.join(work_dir, 'etl_metrics.prom')
+        rollup.ARCHIVE_DIR = os.path.join(work_dir, 'archive')
+        results.append(measure('write_database', 'setup', lambda: {'rows': synthetic_data.write_database(
+            database.DB_PATH, synthetic_data.generate_chunks(args.rows, args.seed, args.start_date, args.days))}, 1))
+        grid_id = benchmark_analysis(results, args)
+        if args.classify_rows:
+            benchmark_classification(results, args)
+        benchmark_routes(results, args, grid_id)
+        if not args.skip_etl:
+            benchmark_etl(results, args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'rows': args.rows, 'seed': args.seed, 'days': args.days, 'repeat': args.repeat,
+            'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+    report['regressions'] = regressions
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados gravados em '{args.output}'.")
+    if regressions:
+        print(f"{len(regressions)} regressões acima de {args.threshold:.0%}.")
+        sys.exit(1)
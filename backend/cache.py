@@ -0,0 +1,73 @@
+import json
+import threading
+from collections import OrderedDict
+
+# --- CACHE DE RESULTADOS (LRU) ---
+# Guarda os resultados já calculados do dashboard (mapa, gráfico, KPIs) por
+# (tipo, versão dos dados, filtros). Como a versão faz parte da chave, uma nova
+# gravação do ETL nunca devolve dados antigos: as entradas velhas só saem pelo LRU.
+MAX_BYTES = 256 * 1024 * 1024
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # chave -> (valor, tamanho estimado em bytes)
+_pending = {}             # chave -> cálculo em andamento (single-flight)
+_stats = {'bytes': 0, 'hits': 0, 'misses': 0}
+
+def make_key(kind, version, filters, *extra):
+    return (kind, version, tuple(sorted(filters.items())), extra)
+
+def estimate_size(value):
+    """Tamanho aproximado do resultado, pelo JSON que será enviado ao navegador."""
+    return len(json.dumps(value, default=str))
+
+def _store(key, value):
+    size = estimate_size(value)
+    if size > MAX_BYTES:
+        return
+    with _lock:
+        if key in _entries:
+            _stats['bytes'] -= _entries.pop(key)[1]
+        _entries[key] = (value, size)
+        _stats['bytes'] += size
+        while _stats['bytes'] > MAX_BYTES:
+            _, (_, evicted_size) = _entries.popitem(last=False)
+            _stats['bytes'] -= evicted_size
+
+def get_or_compute(key, compute):
+    """Retorna o resultado em cache ou executa compute() uma única vez, mesmo com pedidos simultâneos."""
+    with _lock:
+        if key in _entries:
+            _entries.move_to_end(key)
+            _stats['hits'] += 1
+            return _entries[key][0]
+        _stats['misses'] += 1
+        pending = _pending.get(key)
+        is_owner = pending is None
+        if is_owner:
+            pending = {'done': threading.Event(), 'value': None, 'error': None}
+            _pending[key] = pending
+    if not is_owner:
+        pending['done'].wait()
+        if pending['error'] is not None:
+            raise pending['error']
+        return pending['value']
+    try:
+        pending['value'] = compute()
+        _store(key, pending['value'])
+        return pending['value']
+    except Exception as e:
+        pending['error'] = e
+        raise
+    finally:
+        with _lock:
+            del _pending[key]
+        pending['done'].set()
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _stats['bytes'] = 0
+
+def stats():
+    with _lock:
+        return {**_stats, 'entries': len(_entries)}
@@ -0,0 +1,10 @@
+# --- CONFIGURAÇÕES GLOBAIS ---
+# Compartilhadas pelo servidor (app.py) e pelo ETL (process_data.py).
+BUFFER_GPS = 0.005
+TMUT_CENTER_LAT = -3.525506
+TMUT_CENTER_LON = -38.797690
+OPERATIONAL_SSID = "2G_6qmzayp"
+MAPS_CONFIG = {
+    'patio': { 'lat_top': -3.543, 'lat_bottom': -3.556, 'lon_left': -38.822, 'lon_right': -38.802 },
+    'tmut': { 'lat_top': TMUT_CENTER_LAT + BUFFER_GPS, 'lat_bottom': TMUT_CENTER_LAT - BUFFER_GPS, 'lon_left': TMUT_CENTER_LON - BUFFER_GPS, 'lon_right': TMUT_CENTER_LON + BUFFER_GPS }
+}
@@ -1,16 +1,291 @@
 import sqlite3
+import numpy as np
 import pandas as pd
 
 DB_PATH = 'db/dashboard.db'
+# Quanto tempo uma conexão espera por um lock de escrita antes de falhar.
+BUSY_TIMEOUT_SECONDS = 10
+
+# --- SCHEMA COMPACTO DE raw_points ---
+# Tablets e SSIDs ficam em tabelas de consulta e raw_points guarda só o id inteiro de cada um.
+# A hora é gravada em segundos desde 1970 (a hora local do coletor, sem fuso), as coordenadas
+# em micrograus e a perda de pacotes em centésimos de ponto percentual: só inteiros pequenos.
+COORD_SCALE = 1_000_000
+LOSS_SCALE = 100
+
+# Tabela de consulta -> coluna com o texto original.
+LOOKUP_TABLES = {'tablets': 'android_id', 'ssids': 'name'}
+
+RAW_POINTS_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS tablets (id INTEGER PRIMARY KEY, android_id TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS ssids (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS raw_points (
+    tablet_id INTEGER REFERENCES tablets (id),
+    timestamp INTEGER NOT NULL,
+    signal_dbm INTEGER,
+    packet_loss_e2 INTEGER,
+    latitude_e6 INTEGER,
+    longitude_e6 INTEGER,
+    ssid_id INTEGER REFERENCES ssids (id),
+    latency_ms INTEGER
+);
+"""
+
+# Conversão, feita no próprio SQLite, das linhas do schema antigo (textos e floats).
+MIGRATE_RAW_POINTS_SQL = """
+INSERT INTO raw_points (rowid, tablet_id, timestamp, signal_dbm, packet_loss_e2, latitude_e6, longitude_e6, ssid_id, latency_ms)
+SELECT l.rowid, t.id, CAST(strftime('%s', l.timestamp) AS INTEGER), CAST(ROUND(l.signal_dbm) AS INTEGER),
+       CAST(ROUND(l.packet_loss_percent * {loss_scale}) AS INTEGER),
+       CAST(ROUND(l.latitude * {coord_scale}) AS INTEGER), CAST(ROUND(l.longitude * {coord_scale}) AS INTEGER),
+       s.id, CAST(ROUND({latency}) AS INTEGER)
+FROM raw_points_legacy l
+LEFT JOIN tablets t ON t.android_id = l.tablet_android_id
+LEFT JOIN ssids s ON s.name = l.current_ssid
+WHERE strftime('%s', l.timestamp) IS NOT NULL
+ORDER BY l.rowid
+"""
+
+# Índices que sustentam os filtros do dashboard (data, tablet, SSID e área do mapa).
+RAW_POINTS_INDEXES = {
+    'idx_raw_points_timestamp': '(timestamp)',
+    'idx_raw_points_tablet_timestamp': '(tablet_id, timestamp)',
+    'idx_raw_points_ssid_timestamp': '(ssid_id, timestamp)',
+    'idx_raw_points_lat_lon': '(latitude_e6, longitude_e6)',
+}
+
+# Colunas lidas para montar os pontos decodificados (ver decode_raw_points).
+RAW_POINTS_READ_COLUMNS = ['row_id', 'tablet_id', 'timestamp', 'signal_dbm', 'packet_loss_e2', 'latitude_e6', 'longitude_e6', 'ssid_id', 'latency_ms']
+RAW_POINTS_SELECT_SQL = f"SELECT rowid AS {', '.join(RAW_POINTS_READ_COLUMNS)} FROM raw_points"
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_SECONDS)
     conn.row_factory = sqlite3.Row
     return conn
 
+def enable_wal():
+    """Ativa o modo WAL (persistente no arquivo): leitores e o ETL não se bloqueiam."""
+    conn = get_db_connection()
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    finally:
+        conn.close()
+
+def table_exists(conn, table_name):
+    """Verifica se uma tabela existe no banco de dados."""
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()
+    return row is not None
+
+def table_columns(conn, table_name):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})").fetchall()]
+
+def ensure_schema(conn=None):
+    """Cria as tabelas de raw_points, convertendo uma vez os bancos no schema antigo."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        # Só vale para bancos novos (ou no próximo VACUUM): o espaço dos dados apagados pela
+        # retenção é devolvido aos poucos com PRAGMA incremental_vacuum (ver retention.py).
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        if table_exists(conn, 'raw_points') and 'current_ssid' in table_columns(conn, 'raw_points'):
+            migrate_legacy_raw_points(conn)
+        conn.executescript(RAW_POINTS_SCHEMA_SQL)
+    finally:
+        if own_conn:
+            conn.close()
+
+def migrate_legacy_raw_points(conn):
+    """Converte raw_points do schema antigo (textos repetidos, hora em texto, floats) para o
+    compacto, numa única transação. Os rowids são mantidos; a versão dos dados é incrementada."""
+    print("Convertendo raw_points para o schema compacto (uma única vez)...")
+    legacy_columns = table_columns(conn, 'raw_points')
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("ALTER TABLE raw_points RENAME TO raw_points_legacy")
+        # Os índices antigos acompanham a tabela renomeada: saem com ela.
+        for index_name in RAW_POINTS_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+        # executescript faria commit: as instruções vão uma a uma, dentro da transação.
+        for statement in RAW_POINTS_SCHEMA_SQL.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+        conn.execute("INSERT OR IGNORE INTO tablets (android_id) SELECT DISTINCT tablet_android_id FROM raw_points_legacy WHERE tablet_android_id IS NOT NULL")
+        conn.execute("INSERT OR IGNORE INTO ssids (name) SELECT DISTINCT current_ssid FROM raw_points_legacy WHERE current_ssid IS NOT NULL")
+        # Bancos anteriores à coluna de latência não a têm.
+        latency = 'l.latency_ms' if 'latency_ms' in legacy_columns else 'NULL'
+        migrated = conn.execute(MIGRATE_RAW_POINTS_SQL.format(loss_scale=LOSS_SCALE, coord_scale=COORD_SCALE, latency=latency)).rowcount
+        conn.execute("DROP TABLE raw_points_legacy")
+        bump_data_version(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    ensure_indexes(conn)
+    # Devolve ao sistema de arquivos o espaço liberado pela tabela antiga.
+    conn.execute("VACUUM")
+    print(f"Conversão concluída: {migrated} linhas.")
+
+def ensure_indexes(conn=None):
+    """Cria os índices da tabela raw_points, caso ainda não existam."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        if not table_exists(conn, 'raw_points'):
+            return
+        for index_name, columns in RAW_POINTS_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON raw_points {columns}")
+        conn.commit()
+    finally:
+        if own_conn:
+            conn.close()
+
+def to_epoch_seconds(value):
+    """Data/hora (sem fuso) -> segundos desde 1970, como gravado em raw_points.timestamp."""
+    return int(pd.Timestamp(value).timestamp())
+
+def to_fixed_coord(value):
+    return int(round(value * COORD_SCALE))
+
+def build_filter_clause(bounds=None, start_date=None, end_date=None, ssid_filter=None, tablet_id=None, operational_ssid=None):
+    """Converte os filtros do dashboard numa cláusula WHERE parametrizada sobre raw_points."""
+    conditions = []
+    params = []
+    if tablet_id:
+        conditions.append("tablet_id = (SELECT id FROM tablets WHERE android_id = ?)")
+        params.append(tablet_id)
+    if start_date and end_date:
+        start = pd.to_datetime(start_date)
+        end = pd.to_datetime(end_date).replace(hour=23, minute=59, second=59)
+        conditions.append("timestamp BETWEEN ? AND ?")
+        params.extend([to_epoch_seconds(start), to_epoch_seconds(end)])
+    if ssid_filter == 'main_network':
+        conditions.append("ssid_id = (SELECT id FROM ssids WHERE name = ?)")
+        params.append(operational_ssid)
+    elif ssid_filter == 'disconnected':
+        conditions.append("ssid_id = (SELECT id FROM ssids WHERE name = 'disconnected')")
+    elif ssid_filter == 'other_networks':
+        conditions.append("(ssid_id IS NULL OR ssid_id NOT IN (SELECT id FROM ssids WHERE name IN (?, 'disconnected')))")
+        params.append(operational_ssid)
+    if bounds:
+        conditions.append("latitude_e6 BETWEEN ? AND ? AND longitude_e6 BETWEEN ? AND ?")
+        params.extend([to_fixed_coord(bounds[key]) for key in ('lat_bottom', 'lat_top', 'lon_left', 'lon_right')])
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where_sql, params
+
+# --- TABELAS DE CONSULTA (tablets, SSIDs) ---
+def get_lookup_ids(conn, table, names):
+    """{texto: id} para os textos informados, criando os que ainda não existem (sem commit)."""
+    column = LOOKUP_TABLES[table]
+    values = [value for value in pd.unique(pd.Series(names, dtype=object).dropna())]
+    conn.executemany(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", [(value,) for value in values])
+    # As tabelas de consulta são pequenas (dezenas de tablets, poucas centenas de redes).
+    return dict(conn.execute(f"SELECT {column}, id FROM {table}").fetchall())
+
+def decode_lookup(conn, table, ids):
+    """Converte uma coluna de ids numa Categorical com os textos da tabela de consulta."""
+    rows = conn.execute(f"SELECT id, {LOOKUP_TABLES[table]} FROM {table} ORDER BY id").fetchall()
+    categories = [name for _, name in rows]
+    ids = np.asarray(ids, dtype=float)
+    known = ~np.isnan(ids)
+    position = np.full((rows[-1][0] if rows else 0) + 1, -1, dtype=np.int32)
+    position[[row_id for row_id, _ in rows]] = np.arange(len(rows), dtype=np.int32)
+    codes = np.full(len(ids), -1, dtype=np.int32)
+    codes[known] = position[ids[known].astype(np.int64)]
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+def _whole_numbers(values):
+    """int64 se a coluna não tiver nulos; senão continua float, com NaN nos nulos."""
+    return values if np.isnan(values).any() else values.astype(np.int64)
+
+def decode_raw_points(conn, rows):
+    """Linhas lidas com RAW_POINTS_SELECT_SQL -> colunas prontas para a análise: tablet e SSID
+    categóricos, timestamp em datetime64, coordenadas em graus e perda em percentual."""
+    # Só há inteiros e NULLs: uma única matriz float (NULL -> NaN) evita o read_sql do pandas.
+    values = np.array(rows, dtype=float).reshape(len(rows), len(RAW_POINTS_READ_COLUMNS))
+    column = {name: values[:, i] for i, name in enumerate(RAW_POINTS_READ_COLUMNS)}
+    # As tabelas de consulta são lidas depois dos pontos: os ids já lidos estão sempre nelas.
+    return pd.DataFrame({
+        'row_id': column['row_id'].astype(np.int64),
+        'tablet_android_id': decode_lookup(conn, 'tablets', column['tablet_id']),
+        'timestamp': pd.to_datetime(column['timestamp'].astype(np.int64), unit='s'),
+        'signal_dbm': _whole_numbers(column['signal_dbm']),
+        'packet_loss_percent': column['packet_loss_e2'] / LOSS_SCALE,
+        'latitude': column['latitude_e6'] / COORD_SCALE,
+        'longitude': column['longitude_e6'] / COORD_SCALE,
+        'current_ssid': decode_lookup(conn, 'ssids', column['ssid_id']),
+        'latency_ms': _whole_numbers(column['latency_ms']),
+    })
+
+def _iter_decoded(conn, cursor, chunksize):
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            break
+        yield decode_raw_points(conn, rows)
+
+def read_raw_points(conn, where_sql="", params=(), chunksize=None):
+    """Pontos decodificados que atendem à cláusula WHERE (um gerador de blocos com chunksize)."""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f"{RAW_POINTS_SELECT_SQL} {where_sql} ORDER BY rowid", list(params))
+    if chunksize is None:
+        return decode_raw_points(conn, cursor.fetchall())
+    return _iter_decoded(conn, cursor, chunksize)
+
+# Contador incrementado cada vez que a retenção apaga pontos antigos de raw_points.
+RAW_POINTS_PURGES_KEY = 'raw_points_purges'
+
+def ensure_metadata_table(conn):
+    """Cria a tabela de metadados do ETL (versão dos dados, estado da ingestão)."""
+    conn.execute("CREATE TABLE IF NOT EXISTS etl_metadata (key TEXT PRIMARY KEY, value)")
+
+def get_counter(conn, key):
+    """Valor inteiro de um contador de etl_metadata (0 se ainda não existir)."""
+    if not table_exists(conn, 'etl_metadata'):
+        return 0
+    row = conn.execute("SELECT value FROM etl_metadata WHERE key = ?", (key,)).fetchone()
+    return int(row[0]) if row else 0
+
+def increment_counter(conn, key):
+    """Incrementa e retorna um contador de etl_metadata (sem commit)."""
+    ensure_metadata_table(conn)
+    conn.execute(
+        "INSERT INTO etl_metadata (key, value) VALUES (?, 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + 1", (key,)
+    )
+    return get_counter(conn, key)
+
+def get_data_version(conn=None):
+    """Retorna a versão atual dos dados, incrementada pelo ETL a cada lote gravado."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        return get_counter(conn, 'data_version')
+    finally:
+        if own_conn:
+            conn.close()
+
+def bump_data_version(conn):
+    """Incrementa e retorna a versão dos dados. Deve rodar na mesma transação que grava o lote."""
+    return increment_counter(conn, 'data_version')
+
+def get_max_rowid(conn):
+    """Retorna o maior rowid de raw_points (0 se a tabela estiver vazia ou não existir)."""
+    if not table_exists(conn, 'raw_points'):
+        return 0
+    row = conn.execute("SELECT MAX(rowid) FROM raw_points").fetchone()
+    return row[0] or 0
+
+def get_raw_points_after(conn, last_rowid, max_rowid):
+    """Busca os pontos brutos com rowid maior que o último já carregado (até max_rowid, para
+    que linhas gravadas durante a leitura fiquem para a próxima atualização)."""
+    return read_raw_points(conn, "WHERE rowid > ? AND rowid <= ?", [last_rowid, max_rowid])
+
 def get_all_raw_points():
     """Busca todos os pontos brutos da tabela raw_points."""
     conn = get_db_connection()
-    df = pd.read_sql_query("SELECT * FROM raw_points", conn)
+    df = read_raw_points(conn).drop(columns=['row_id'])
     conn.close()
-    return df
\ No newline at end of file
+    return df
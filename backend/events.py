@@ -0,0 +1,86 @@
+import json
+import sqlite3
+import threading
+import time
+import database
+
+# --- CANAL DE EVENTOS (SERVER-SENT EVENTS) ---
+# Uma única thread observa a versão dos dados publicada pelo ETL (que roda noutro
+# processo) e acorda todas as conexões de /api/stream quando ela muda.
+POLL_SECONDS = 1
+KEEPALIVE_SECONDS = 15
+# Cada conexão aberta ocupa uma thread do waitress; acima disto o cliente volta ao polling.
+MAX_CLIENTS = 24
+# Intervalo (ms) sugerido ao EventSource para se reconectar.
+RETRY_MILLISECONDS = 5000
+
+_condition = threading.Condition()
+_state = {'version': None, 'watcher': None, 'clients': 0}
+# Funções chamadas (na thread observadora) a cada nova versão, p. ex. o aquecimento do cache.
+_listeners = []
+
+def _watch_versions():
+    while True:
+        try:
+            version = database.get_data_version()
+        except sqlite3.Error:
+            version = None
+        changed = False
+        if version is not None:
+            with _condition:
+                if version != _state['version']:
+                    _state['version'] = version
+                    _condition.notify_all()
+                    changed = True
+        if changed:
+            for listener in list(_listeners):
+                listener(version)
+        time.sleep(POLL_SECONDS)
+
+def on_new_version(listener):
+    """Registra listener(versão), chamado sempre que o ETL publica uma nova versão."""
+    _listeners.append(listener)
+
+def ensure_watcher():
+    """Inicia (uma vez por processo) a thread que observa a versão dos dados."""
+    with _condition:
+        if _state['watcher'] is None:
+            _state['version'] = database.get_data_version()
+            _state['watcher'] = threading.Thread(target=_watch_versions, name='data-version-watcher', daemon=True)
+            _state['watcher'].start()
+
+def subscribe():
+    """Reserva uma vaga para um cliente do stream. Retorna False se estiver lotado."""
+    with _condition:
+        if _state['clients'] >= MAX_CLIENTS:
+            return False
+        _state['clients'] += 1
+        return True
+
+def unsubscribe():
+    with _condition:
+        _state['clients'] -= 1
+
+def wait_for_version(last_version, timeout):
+    """Espera a versão dos dados mudar (ou o timeout) e retorna a versão atual."""
+    with _condition:
+        _condition.wait_for(lambda: _state['version'] != last_version, timeout)
+        return _state['version']
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def iter_stream():
+    """Gera o stream de um cliente já inscrito: um evento 'version' a cada nova versão.
+    A vaga é libertada por quem inscreveu o cliente (ao fechar a resposta), mesmo que o
+    stream nunca chegue a ser percorrido."""
+    version = _state['version']
+    yield f"retry: {RETRY_MILLISECONDS}\n\n" + format_event('version', {'version': version})
+    while True:
+        current = wait_for_version(version, KEEPALIVE_SECONDS)
+        if current != version:
+            version = current
+            yield format_event('version', {'version': version})
+        else:
+            # Comentário SSE: mantém a conexão viva e deteta clientes que saíram.
+            yield ": keepalive\n\n"
@@ -0,0 +1,189 @@
+import csv
+import io
+import zlib
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+import database
+import metrics
+from config import MAPS_CONFIG, OPERATIONAL_SSID
+
+# --- EXPORTAÇÃO EM STREAMING ---
+# Lê os pontos por cursor, dia a dia e em blocos, sem montar o período inteiro em memória.
+FETCH_ROWS = 5000
+
+# Rótulos da coluna 'Área', na ordem em que são testados; o resto é 'Fora da Área'.
+EXPORT_AREAS = [('Pátio', 'patio'), ('TMUT', 'tmut')]
+OUTSIDE_AREA = 'Fora da Área'
+
+# Formatos aceitos e o respectivo mimetype.
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'csv.gz': 'application/gzip',
+}
+
+EXPORT_HEADERS = [
+    'Tablet (Android ID)', 'Data', 'Hora', 'Área', 'Sinal de Rede (dBm)',
+    'Rede Wi-Fi Conectada', 'Perda de Pacotes (%)', 'Latitude', 'Longitude'
+]
+
+def assign_area(lat, lon):
+    """Rótulo da área de cada ponto, calculado com máscaras vetorizadas."""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    conditions = []
+    for _, map_name in EXPORT_AREAS:
+        bounds = MAPS_CONFIG[map_name]
+        conditions.append((lat >= bounds['lat_bottom']) & (lat <= bounds['lat_top']) & (lon >= bounds['lon_left']) & (lon <= bounds['lon_right']))
+    return np.select(conditions, [label for label, _ in EXPORT_AREAS], default=OUTSIDE_AREA)
+
+# Os pontos vêm de raw_points (colunas compactas) com os textos das tabelas de consulta.
+POINTS_FROM_SQL = (
+    "FROM raw_points LEFT JOIN tablets ON tablets.id = raw_points.tablet_id "
+    "LEFT JOIN ssids ON ssids.id = raw_points.ssid_id"
+)
+SECONDS_PER_DAY = 86400
+
+def _area_order_sql():
+    """Expressão SQL que ordena os pontos pelo rótulo da área (mesma ordem alfabética do relatório)."""
+    labels = sorted([label for label, _ in EXPORT_AREAS] + [OUTSIDE_AREA])
+    cases = []
+    for label, map_name in EXPORT_AREAS:
+        lat_bottom, lat_top, lon_left, lon_right = [database.to_fixed_coord(MAPS_CONFIG[map_name][key]) for key in ('lat_bottom', 'lat_top', 'lon_left', 'lon_right')]
+        cases.append(
+            f"WHEN latitude_e6 BETWEEN {lat_bottom} AND {lat_top} "
+            f"AND longitude_e6 BETWEEN {lon_left} AND {lon_right} THEN {labels.index(label)}"
+        )
+    return f"CASE {' '.join(cases)} ELSE {labels.index(OUTSIDE_AREA)} END"
+
+def _day_clause(where_sql):
+    condition = "timestamp BETWEEN ? AND ?"
+    return f"{where_sql} AND {condition}" if where_sql else f"WHERE {condition}"
+
+def _day_params(params, day):
+    start = database.to_epoch_seconds(day)
+    return params + [start, start + SECONDS_PER_DAY - 1]
+
+def get_export_days(conn, where_sql, params):
+    """Dias ('AAAA-MM-DD') com dados no período filtrado, em ordem."""
+    rows = conn.execute(f"SELECT DISTINCT timestamp / {SECONDS_PER_DAY} FROM raw_points {where_sql} ORDER BY 1", params).fetchall()
+    return [day.strftime('%Y-%m-%d') for day in pd.to_datetime([row[0] * SECONDS_PER_DAY for row in rows], unit='s')]
+
+def iter_day_rows(conn, where_sql, params, day):
+    """Gera blocos (listas de linhas) de um dia, já ordenados por área, rede e hora."""
+    # Hora e valores em ponto fixo já saem formatados do SQLite. Os pontos sem SSID ficam no fim
+    # de cada área, como no sort_values do pandas.
+    cursor = conn.execute(
+        f"SELECT tablets.android_id, printf('%02d:%02d:%02d', timestamp % {SECONDS_PER_DAY} / 3600, timestamp % 3600 / 60, timestamp % 60), "
+        f"latitude_e6 / {float(database.COORD_SCALE)}, longitude_e6 / {float(database.COORD_SCALE)}, signal_dbm, ssids.name, "
+        f"packet_loss_e2 / {float(database.LOSS_SCALE)} "
+        f"{POINTS_FROM_SQL} {_day_clause(where_sql)} "
+        f"ORDER BY {_area_order_sql()}, ssids.name IS NULL, ssids.name, timestamp % {SECONDS_PER_DAY}",
+        _day_params(params, day)
+    )
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        areas = assign_area([row[2] for row in rows], [row[3] for row in rows])
+        data = f"{day[8:10]}/{day[5:7]}/{day[0:4]}"
+        yield [
+            [tablet, data, time_of_day, str(area), signal, ssid, loss, lat, lon]
+            for (tablet, time_of_day, lat, lon, signal, ssid, loss), area in zip(rows, areas)
+        ]
+
+def day_column_widths(conn, where_sql, params, day):
+    """Largura de cada coluna da aba do dia, a partir do maior texto (calculado no SQLite)."""
+    lengths = conn.execute(
+        f"SELECT MAX(LENGTH(tablets.android_id)), MAX(LENGTH(CAST(signal_dbm AS TEXT))), MAX(LENGTH(ssids.name)), "
+        f"MAX(LENGTH(CAST(packet_loss_e2 / {float(database.LOSS_SCALE)} AS TEXT))), "
+        f"MAX(LENGTH(CAST(latitude_e6 / {float(database.COORD_SCALE)} AS TEXT))), MAX(LENGTH(CAST(longitude_e6 / {float(database.COORD_SCALE)} AS TEXT))) "
+        f"{POINTS_FROM_SQL} {_day_clause(where_sql)}",
+        _day_params(params, day)
+    ).fetchone()
+    tablet, signal, ssid, loss, lat, lon = [length or 0 for length in lengths]
+    area = max(len(label) for label in [OUTSIDE_AREA] + [label for label, _ in EXPORT_AREAS])
+    values = [tablet, 10, 8, area, signal, ssid, loss, lat, lon]
+    return [max(len(header), value) + 2 for header, value in zip(EXPORT_HEADERS, values)]
+
+def build_filters(start_date, end_date, ssid_filter, tablet_id):
+    return database.build_filter_clause(None, start_date, end_date, ssid_filter, tablet_id, OPERATIONAL_SSID)
+
+def has_rows(start_date, end_date, ssid_filter=None, tablet_id=None):
+    where_sql, params = build_filters(start_date, end_date, ssid_filter, tablet_id)
+    conn = database.get_db_connection()
+    try:
+        return conn.execute(f"SELECT 1 FROM raw_points {where_sql} LIMIT 1", params).fetchone() is not None
+    finally:
+        conn.close()
+
+@metrics.timed('export.write_xlsx')
+def write_xlsx(fileobj, start_date, end_date, ssid_filter=None, tablet_id=None):
+    """Grava o relatório .xlsx (uma aba por dia) em modo write-only do openpyxl."""
+    where_sql, params = build_filters(start_date, end_date, ssid_filter, tablet_id)
+    conn = database.get_db_connection()
+    total_rows = 0
+    try:
+        workbook = Workbook(write_only=True)
+        for day in get_export_days(conn, where_sql, params):
+            worksheet = workbook.create_sheet(title=f"{day[8:10]}-{day[5:7]}-{day[0:4]}")
+            for i, width in enumerate(day_column_widths(conn, where_sql, params, day), start=1):
+                worksheet.column_dimensions[get_column_letter(i)].width = width
+            header_cells = []
+            for header in EXPORT_HEADERS:
+                cell = WriteOnlyCell(worksheet, value=header)
+                cell.font = Font(bold=True)
+                header_cells.append(cell)
+            worksheet.append(header_cells)
+            for rows in iter_day_rows(conn, where_sql, params, day):
+                for row in rows:
+                    worksheet.append(row)
+                total_rows += len(rows)
+        workbook.save(fileobj)
+        metrics.rows('export.write_xlsx', total_rows)
+    finally:
+        conn.close()
+
+def iter_csv(start_date, end_date, ssid_filter=None, tablet_id=None, compress=False):
+    """Gera o relatório em CSV (UTF-8 com BOM, para o Excel), opcionalmente em gzip, bloco a bloco."""
+    where_sql, params = build_filters(start_date, end_date, ssid_filter, tablet_id)
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(text):
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor else data
+
+    conn = database.get_db_connection()
+    total_rows = 0
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_HEADERS)
+        yield encode('\ufeff' + buffer.getvalue())
+        for day in get_export_days(conn, where_sql, params):
+            for rows in iter_day_rows(conn, where_sql, params, day):
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(rows)
+                total_rows += len(rows)
+                chunk = encode(buffer.getvalue())
+                if chunk:
+                    yield chunk
+        if compressor:
+            yield compressor.flush()
+        metrics.rows('export.iter_csv', total_rows)
+    finally:
+        conn.close()
+
+def write_file(path, export_format, start_date, end_date, ssid_filter=None, tablet_id=None):
+    """Grava o relatório no formato pedido num arquivo em disco (exportações assíncronas)."""
+    with open(path, 'wb') as f:
+        if export_format == 'xlsx':
+            write_xlsx(f, start_date, end_date, ssid_filter, tablet_id)
+        else:
+            for chunk in iter_csv(start_date, end_date, ssid_filter, tablet_id, compress=export_format == 'csv.gz'):
+                f.write(chunk)
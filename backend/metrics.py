@@ -0,0 +1,197 @@
+import bisect
+import contextlib
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+
+# --- MÉTRICAS E TEMPOS POR ETAPA ---
+# Histogramas agregados em memória (exportados em texto Prometheus por /api/metrics) e,
+# para cada pedido, a lista das etapas percorridas (leitura, análise, JSON...), usada
+# no log de pedidos lentos. As etapas rodadas nos pools (workers) contam no pedido que
+# as originou.
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROWS_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+BYTES_BUCKETS = (1_024, 10_240, 102_400, 1_048_576, 10_485_760, 104_857_600)
+
+# Famílias de métricas: sufixo -> (descrição, labels, buckets).
+METRICS = {
+    'request_seconds': ("Duração dos pedidos HTTP, até o fim do envio da resposta.", ('route', 'method', 'status'), SECONDS_BUCKETS),
+    'response_bytes': ("Tamanho das respostas HTTP (após o gzip).", ('route',), BYTES_BUCKETS),
+    'stage_seconds': ("Duração de cada etapa nomeada.", ('stage',), SECONDS_BUCKETS),
+    'stage_rows': ("Linhas lidas ou produzidas em cada etapa.", ('stage',), ROWS_BUCKETS),
+}
+
+# Pedidos mais lentos que isto vão para o log (None desativa o log).
+SLOW_REQUEST_SECONDS = 2.0
+SLOW_LOG_PATH = 'db/slow_requests.log'
+SLOW_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_LOG_BACKUPS = 3
+
+# Métricas do ETL (outro processo), gravadas em arquivo e anexadas a /api/metrics.
+ETL_METRICS_PATH = 'db/etl_metrics.prom'
+
+_lock = threading.Lock()
+_histograms = {}  # (sufixo, valores dos labels) -> {'buckets': [...], 'sum': float, 'count': int}
+_local = threading.local()
+_slow_log = {'logger': None}
+
+def observe(metric, value, *labels):
+    """Soma `value` ao histograma `metric` (um sufixo de METRICS) com os labels informados."""
+    buckets = METRICS[metric][2]
+    index = bisect.bisect_left(buckets, value)
+    key = (metric, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        if index < len(buckets):
+            histogram['buckets'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+# --- ETAPAS DO PEDIDO ---
+def start_trace():
+    """Começa o registo das etapas do pedido atual (thread atual)."""
+    _local.trace = {'started': time.perf_counter(), 'stages': []}
+    return _local.trace
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+def end_trace():
+    _local.trace = None
+
+def bind(fn):
+    """Envolve fn para que as etapas que ela registar noutra thread contem no pedido atual."""
+    trace = current_trace()
+    if trace is None:
+        return fn
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        previous = current_trace()
+        _local.trace = trace
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.trace = previous
+    return wrapper
+
+def _add_to_trace(entry):
+    trace = current_trace()
+    if trace is not None:
+        trace['stages'].append(entry)
+
+@contextlib.contextmanager
+def stage(name):
+    """Mede o bloco como a etapa `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe('stage_seconds', seconds, name)
+        _add_to_trace({'stage': name, 'seconds': seconds})
+
+def timed(name):
+    """Decorador: mede cada chamada da função como a etapa `name`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def rows(name, count):
+    """Regista o número de linhas tratadas pela etapa `name`."""
+    observe('stage_rows', count, name)
+    _add_to_trace({'stage': name, 'rows': int(count)})
+
+def stage_breakdown(trace):
+    """Soma as etapas do pedido por nome: {etapa: {'seconds', 'calls', 'rows'}}."""
+    breakdown = {}
+    for entry in trace['stages']:
+        item = breakdown.setdefault(entry['stage'], {})
+        if 'seconds' in entry:
+            item['seconds'] = round(item.get('seconds', 0.0) + entry['seconds'], 6)
+            item['calls'] = item.get('calls', 0) + 1
+        if 'rows' in entry:
+            item['rows'] = item.get('rows', 0) + entry['rows']
+    return breakdown
+
+def finish_request(trace, route, method, status, size, params):
+    """Fecha as métricas do pedido e, se ele foi lento, grava-o no log de pedidos lentos."""
+    seconds = time.perf_counter() - trace['started']
+    observe('request_seconds', seconds, route, method, str(status))
+    if size is not None:
+        observe('response_bytes', size, route)
+    if SLOW_REQUEST_SECONDS is not None and seconds >= SLOW_REQUEST_SECONDS:
+        log_slow_request({
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'route': route, 'method': method, 'status': status,
+            'seconds': round(seconds, 6), 'bytes': size, 'params': params, 'stages': stage_breakdown(trace),
+        })
+
+def log_slow_request(record):
+    with _lock:
+        logger = _slow_log['logger']
+        if logger is None:
+            logger = logging.getLogger('dashboard.slow_requests')
+            logger.propagate = False
+            handler = logging.handlers.RotatingFileHandler(SLOW_LOG_PATH, maxBytes=SLOW_LOG_MAX_BYTES, backupCount=SLOW_LOG_BACKUPS, encoding='utf-8')
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            _slow_log['logger'] = logger
+    logger.info(json.dumps(record, default=str))
+
+# --- FORMATO PROMETHEUS ---
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(prefix, extra=None):
+    """Texto no formato de exposição do Prometheus. extra: outras séries simples,
+    {nome: (tipo 'counter' ou 'gauge', descrição, valor)}."""
+    with _lock:
+        snapshot = {key: {**h, 'buckets': list(h['buckets'])} for key, h in _histograms.items()}
+    lines = []
+    for metric, (description, label_names, buckets) in METRICS.items():
+        series = sorted((labels, h) for (name, labels), h in snapshot.items() if name == metric)
+        if not series:
+            continue
+        name = f'{prefix}_{metric}'
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+        for labels, histogram in series:
+            cumulative = 0
+            for bound, count in zip(buckets, histogram['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(label_names, labels, [('le', _format_number(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(label_names, labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(label_names, labels)} {_format_number(histogram['sum'])}")
+            lines.append(f"{name}_count{_format_labels(label_names, labels)} {histogram['count']}")
+    for name, (kind, description, value) in (extra or {}).items():
+        lines += [f'# HELP {prefix}_{name} {description}', f'# TYPE {prefix}_{name} {kind}', f'{prefix}_{name} {_format_number(value)}']
+    return '\n'.join(lines) + '\n'
+
+def write_textfile(path, prefix):
+    """Grava as métricas deste processo num arquivo (troca atômica), para outro processo expor."""
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(render(prefix))
+    os.replace(temp_path, path)
+
+def read_textfile(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return ''
@@ -1,116 +1,305 @@
+import numpy as np
 import pandas as pd
 import sqlite3
 import os
+import io
+import hashlib
+import time
+import argparse
+import database
+import metrics
+import rollup
 
 # --- CONFIGURAÇÃO ---
 DB_PATH = 'db/dashboard.db'
-CSV_PATH = r'C:\APPS\Check Signal\data\raw_data.csv' 
+CSV_PATH = r'C:\APPS\Check Signal\data\raw_data.csv'
+# Estado legado (número de linhas). Só é lido uma vez, para migrar para o offset em bytes.
 STATE_FILE_PATH = 'db/.last_processed_line'
+# Tamanho máximo de cada bloco lido do CSV; cada bloco é gravado numa única transação.
+CHUNK_BYTES = 8 * 1024 * 1024
+# Bytes iniciais do CSV usados como "identidade" do arquivo, para detetar rotação.
+FINGERPRINT_BYTES = 4096
+# Intervalo entre verificações do CSV no modo contínuo (--watch).
+WATCH_INTERVAL_SECONDS = 5
+# Prefixo das métricas do ETL (as do servidor usam 'dashboard').
+ETL_METRICS_PREFIX = 'dashboard_etl'
+
+COLUMN_MAPPING = {
+    'sinal_avg_dbm': 'signal_dbm',
+    'latencia_avg_ms': 'latency_ms'
+    # As outras colunas já correspondem ou serão criadas
+}
+FINAL_COLUMNS = [
+    'tablet_android_id',
+    'timestamp',
+    'signal_dbm',
+    'packet_loss_percent',
+    'latitude',
+    'longitude',
+    'current_ssid',
+    'latency_ms'
+]
+# Colunas gravadas em raw_points (schema compacto, ver database.RAW_POINTS_SCHEMA_SQL).
+ENCODED_COLUMNS = ['tablet_id', 'timestamp', 'signal_dbm', 'packet_loss_e2', 'latitude_e6', 'longitude_e6', 'ssid_id', 'latency_ms']
+INSERT_RAW_POINTS_SQL = f"INSERT INTO raw_points ({', '.join(ENCODED_COLUMNS)}) VALUES ({', '.join('?' * len(ENCODED_COLUMNS))})"
 
 def get_last_processed_line():
-    """Lê o número da última linha processada do arquivo de estado."""
+    """Lê o número da última linha processada do arquivo de estado (legado)."""
     try:
         with open(STATE_FILE_PATH, 'r') as f:
             return int(f.read().strip())
     except (FileNotFoundError, ValueError):
         return 0
 
-def save_last_processed_line(line_count):
-    """Salva o número total de linhas processadas no arquivo de estado."""
-    with open(STATE_FILE_PATH, 'w') as f:
-        f.write(str(line_count))
+# --- ESTADO DA INGESTÃO (no banco, na mesma transação dos dados) ---
+def file_fingerprint(path, length):
+    """Hash dos primeiros `length` bytes do arquivo."""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(length)).hexdigest()
 
-def process_log_data():
-    print("Iniciando ETL: Lendo novos dados brutos...")
-    
-    try:
-        full_df = pd.read_csv(CSV_PATH)
-        total_lines_in_file = len(full_df)
-    except FileNotFoundError:
-        print(f"Erro: Arquivo '{CSV_PATH}' não encontrado. Verifique o caminho.")
-        return
+def load_state(conn):
+    """Retorna (offset, fingerprint, tamanho do fingerprint) gravados, ou None."""
+    if not database.table_exists(conn, 'etl_metadata'):
+        return None
+    rows = dict(conn.execute(
+        "SELECT key, value FROM etl_metadata WHERE key IN ('csv_offset', 'csv_fingerprint', 'csv_fingerprint_len')"
+    ).fetchall())
+    if 'csv_offset' not in rows:
+        return None
+    return int(rows['csv_offset']), rows.get('csv_fingerprint'), int(rows.get('csv_fingerprint_len') or 0)
 
-    last_line = get_last_processed_line()
-    new_data_df = full_df.iloc[last_line:].copy()
-    
-    if new_data_df.empty:
-        print("Nenhuma nova linha encontrada. Processamento finalizado.")
-        return
+def save_state(conn, offset, fingerprint, fingerprint_len):
+    """Grava o offset e a identidade do CSV (sem commit: roda na transação do lote)."""
+    database.ensure_metadata_table(conn)
+    conn.executemany(
+        "INSERT INTO etl_metadata (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        [('csv_offset', offset), ('csv_fingerprint', fingerprint), ('csv_fingerprint_len', fingerprint_len)]
+    )
 
-    print(f"Lendo {len(new_data_df)} novas linhas de dados.")
-    
-    try:
-        # --- 1. Renomeia as colunas do CSV para o padrão do nosso banco ---
-        column_mapping = {
-            'sinal_avg_dbm': 'signal_dbm',
-            'latencia_avg_ms': 'latency_ms'
-            # As outras colunas já correspondem ou serão criadas
-        }
-        new_data_df.rename(columns=column_mapping, inplace=True)
-
-        # --- 2. Combina as colunas 'data' e 'hora' para criar o 'timestamp' ---
-        # Garante que as colunas de data/hora sejam tratadas como strings
-        new_data_df['data'] = new_data_df['data'].astype(str)
-        new_data_df['hora'] = new_data_df['hora'].astype(str)
-        # O formato '%m-%d-%Y' corresponde a "08-25-2025"
-        new_data_df['timestamp'] = pd.to_datetime(new_data_df['data'] + ' ' + new_data_df['hora'], format='%m-%d-%Y %H:%M:%S')
-
-        # --- 3. Garante que os tipos de dados numéricos estão corretos ---
-        numeric_cols = ['signal_dbm', 'packet_loss_percent', 'latency_ms', 'latitude', 'longitude']
-        for col in numeric_cols:
-            new_data_df[col] = pd.to_numeric(new_data_df[col])
-            
-        # Garante que o SSID seja uma string e preenche valores vazios
-        new_data_df['current_ssid'].fillna('disconnected', inplace=True)
-        new_data_df['current_ssid'] = new_data_df['current_ssid'].astype(str)
-
-    except KeyError as e:
-        print(f"Erro de schema: Coluna '{e}' ausente ou com nome incorreto no CSV. Verifique o cabeçalho.")
-        return
-    except Exception as e:
-        print(f"Erro ao processar os dados: {e}")
-        return
+def legacy_line_offset(path, line_count):
+    """Converte o estado legado (linhas de dados processadas) num offset em bytes."""
+    with open(path, 'rb') as f:
+        f.readline()  # cabeçalho
+        for _ in range(line_count):
+            if not f.readline():
+                break
+        return f.tell()
+
+def resolve_start_offset(conn, path, file_size):
+    """Decide de onde continuar a leitura, detetando truncamento e rotação do CSV."""
+    state = load_state(conn)
+    if state is None:
+        legacy_lines = get_last_processed_line()
+        if legacy_lines:
+            print(f"Migrando estado legado: {legacy_lines} linhas já processadas.")
+            return legacy_line_offset(path, legacy_lines)
+        return 0
+    offset, fingerprint, fingerprint_len = state
+    if file_size < offset:
+        print("Arquivo CSV truncado desde a última execução. Reiniciando a leitura do início.")
+        return 0
+    if fingerprint and file_fingerprint(path, fingerprint_len) != fingerprint:
+        print("Arquivo CSV substituído (rotação) desde a última execução. Reiniciando a leitura do início.")
+        return 0
+    return offset
+
+def read_chunks(path, start_offset):
+    """Lê o CSV a partir do offset em blocos de linhas completas.
+
+    Gera (cabeçalho, bloco, offset_final). Uma última linha sem '\\n' (ainda a ser
+    escrita pelo coletor) fica para a próxima execução.
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        offset = max(start_offset, f.tell())
+        f.seek(offset)
+        pending = b''
+        while True:
+            data = f.read(CHUNK_BYTES)
+            if not data:
+                break
+            data = pending + data
+            cut = data.rfind(b'\n') + 1
+            if cut == 0:
+                pending = data
+                continue
+            block, pending = data[:cut], data[cut:]
+            offset += len(block)
+            yield header, block, offset
+
+# --- TRANSFORMAÇÃO ---
+def transform_chunk(new_data_df):
+    """Converte as linhas do CSV para as colunas e tipos da tabela raw_points."""
+    # --- 1. Renomeia as colunas do CSV para o padrão do nosso banco ---
+    new_data_df = new_data_df.rename(columns=COLUMN_MAPPING)
+
+    # --- 2. Combina as colunas 'data' e 'hora' para criar o 'timestamp' ---
+    # O formato '%m-%d-%Y' corresponde a "08-25-2025"
+    new_data_df['timestamp'] = pd.to_datetime(new_data_df['data'].astype(str) + ' ' + new_data_df['hora'].astype(str), format='%m-%d-%Y %H:%M:%S')
+
+    # --- 3. Garante que os tipos de dados numéricos estão corretos ---
+    numeric_cols = ['signal_dbm', 'packet_loss_percent', 'latency_ms', 'latitude', 'longitude']
+    for col in numeric_cols:
+        new_data_df[col] = pd.to_numeric(new_data_df[col])
+
+    # Garante que o SSID seja uma string e preenche valores vazios
+    new_data_df['current_ssid'] = new_data_df['current_ssid'].fillna('disconnected').astype(str)
 
     # --- 4. Seleciona apenas as colunas que o banco de dados espera ---
-    final_columns = [
-        'tablet_android_id',
-        'timestamp',
-        'signal_dbm',
-        'packet_loss_percent',
-        'latitude',
-        'longitude',
-        'current_ssid',
-        'latency_ms'
-    ]
-    df_to_save = new_data_df[final_columns]
+    return new_data_df[FINAL_COLUMNS]
+
+def _to_small_int(values, scale=1):
+    """Valores numéricos -> inteiros (em ponto fixo com `scale`), com None nos nulos."""
+    return (pd.to_numeric(values, errors='coerce') * scale).round().astype('Int64')
+
+def encode_rows(conn, df_to_save):
+    """Converte as linhas transformadas para as colunas compactas de raw_points, criando
+    as entradas de tablets e SSIDs que ainda não existem (sem commit)."""
+    tablet_ids = database.get_lookup_ids(conn, 'tablets', df_to_save['tablet_android_id'])
+    ssid_ids = database.get_lookup_ids(conn, 'ssids', df_to_save['current_ssid'])
+    return pd.DataFrame({
+        'tablet_id': df_to_save['tablet_android_id'].map(tablet_ids).astype('Int64'),
+        'timestamp': df_to_save['timestamp'].to_numpy(dtype='datetime64[s]').astype('int64'),
+        'signal_dbm': _to_small_int(df_to_save['signal_dbm']),
+        'packet_loss_e2': _to_small_int(df_to_save['packet_loss_percent'], database.LOSS_SCALE),
+        'latitude_e6': _to_small_int(df_to_save['latitude'], database.COORD_SCALE),
+        'longitude_e6': _to_small_int(df_to_save['longitude'], database.COORD_SCALE),
+        'ssid_id': df_to_save['current_ssid'].map(ssid_ids).astype('Int64'),
+        'latency_ms': _to_small_int(df_to_save['latency_ms']),
+    })[ENCODED_COLUMNS]
+
+@metrics.timed('etl.insert_rows')
+def insert_rows(conn, df_to_save):
+    """Grava linhas já transformadas (transform_chunk) em raw_points (sem commit). Retorna
+    as colunas compactas gravadas (encode_rows)."""
+    encoded = encode_rows(conn, df_to_save)
+    rows = zip(*[encoded[col].to_numpy(dtype=object, na_value=None) for col in ENCODED_COLUMNS])
+    conn.executemany(INSERT_RAW_POINTS_SQL, rows)
+    return encoded
+
+def stored_points(conn, encoded):
+    """As linhas de encode_rows como são lidas de volta de raw_points (database.read_raw_points):
+    sinal inteiro, coordenadas em milionésimos de grau e perda em centésimos."""
+    values = encoded[ENCODED_COLUMNS].to_numpy(dtype=float, na_value=np.nan)
+    row_ids = np.zeros((len(values), 1))
+    return database.decode_raw_points(conn, np.hstack([row_ids, values]))
+
+def insert_chunk(conn, df_to_save, end_offset, fingerprint, fingerprint_len):
+    """Grava o bloco, o rollup, a versão dos dados e o offset numa única transação."""
+    with conn:
+        encoded = insert_rows(conn, df_to_save)
+        version = database.bump_data_version(conn)
+        # O rollup soma os valores gravados, não os do CSV: os mesmos que rollup.rebuild e
+        # as rotas de pontos brutos leem.
+        rollup.apply_batch(conn, stored_points(conn, encoded), version)
+        save_state(conn, end_offset, fingerprint, fingerprint_len)
+
+def open_connection():
+    """Abre o banco em modo WAL: a ingestão não bloqueia as leituras do servidor web."""
+    conn = sqlite3.connect(DB_PATH, timeout=database.BUSY_TIMEOUT_SECONDS)
+    conn.execute("PRAGMA journal_mode=WAL")
+    database.ensure_schema(conn)
+    database.ensure_indexes(conn)
+    return conn
+
+def ingest_new_data(conn, verbose=True):
+    """Grava tudo o que foi acrescentado ao CSV desde o último offset. Retorna (nº de linhas
+    salvas, False se um bloco falhou e o resto ficou por gravar)."""
+    file_size = os.path.getsize(CSV_PATH)
+    start_offset = resolve_start_offset(conn, CSV_PATH, file_size)
+    total_saved = 0
+    complete = True
+    for header, block, end_offset in read_chunks(CSV_PATH, start_offset):
+        try:
+            with metrics.stage('etl.read_csv'):
+                new_data_df = pd.read_csv(io.BytesIO(header + block), dtype={'tablet_android_id': str, 'current_ssid': str, 'data': str, 'hora': str})
+            with metrics.stage('etl.transform'):
+                df_to_save = transform_chunk(new_data_df)
+            metrics.rows('etl.read_csv', len(new_data_df))
+        except KeyError as e:
+            print(f"Erro de schema: Coluna '{e}' ausente ou com nome incorreto no CSV. Verifique o cabeçalho.")
+            complete = False
+            break
+        except Exception as e:
+            print(f"Erro ao processar os dados: {e}")
+            complete = False
+            break
+
+        fingerprint_len = min(FINGERPRINT_BYTES, end_offset)
+        with metrics.stage('etl.commit_chunk'):
+            insert_chunk(conn, df_to_save, end_offset, file_fingerprint(CSV_PATH, fingerprint_len), fingerprint_len)
+        metrics.rows('etl.commit_chunk', len(df_to_save))
+        total_saved += len(df_to_save)
+        if verbose:
+            print(f"{len(df_to_save)} linhas de dados processadas e salvas com sucesso no banco de dados (offset {end_offset}).")
+    if total_saved:
+        # O ETL é outro processo: as métricas vão para um arquivo que o /api/metrics do servidor anexa.
+        metrics.write_textfile(metrics.ETL_METRICS_PATH, ETL_METRICS_PREFIX)
+    return total_saved, complete
+
+def process_log_data():
+    print("Iniciando ETL: Lendo novos dados brutos...")
+
+    if not os.path.exists(CSV_PATH):
+        print(f"Erro: Arquivo '{CSV_PATH}' não encontrado. Verifique o caminho.")
+        return
 
     conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        
-        # --- ATENÇÃO: Descomente este bloco APENAS NA PRIMEIRA EXECUÇÃO ---
-        # Este código adicionará a nova coluna 'latency_ms' à sua tabela.
-        # try:
-        #     conn.execute("ALTER TABLE raw_points ADD COLUMN latency_ms INTEGER;")
-        #     print("Coluna 'latency_ms' adicionada com sucesso à tabela 'raw_points'.")
-        # except sqlite3.OperationalError as e:
-        #     if "duplicate column name" in str(e):
-        #         print("Coluna 'latency_ms' já existe na tabela.")
-        #     else:
-        #         # Se for outro erro, exibe-o
-        #         raise e
-        
-        df_to_save.to_sql('raw_points', conn, if_exists='append', index=False)
-        print(f"{len(df_to_save)} linhas de dados processadas e salvas com sucesso no banco de dados.")
-
-        save_last_processed_line(total_lines_in_file)
-        print(f"Estado atualizado: {total_lines_in_file} linhas processadas no total.")
-        
+        conn = open_connection()
+        total_saved, _ = ingest_new_data(conn)
+        if total_saved == 0:
+            print("Nenhuma nova linha encontrada. Processamento finalizado.")
+        else:
+            print(f"Processamento finalizado: {total_saved} novas linhas salvas.")
     except sqlite3.Error as e:
         print(f"Erro no banco de dados: {e}")
     finally:
         if conn:
             conn.close()
 
+# --- MODO CONTÍNUO (--watch) ---
+def watch_log_data(interval_seconds=WATCH_INTERVAL_SECONDS):
+    """Fica a observar o CSV e grava micro-lotes sempre que ele cresce.
+
+    Cada micro-lote tem no máximo CHUNK_BYTES e é confirmado em até `interval_seconds`
+    depois de chegar ao arquivo; cada commit incrementa a versão dos dados lida pelo app.
+    """
+    print(f"ETL em modo contínuo: verificando '{CSV_PATH}' a cada {interval_seconds}s (Ctrl+C para parar).")
+    conn = open_connection()
+    last_seen = None
+    try:
+        while True:
+            try:
+                stat = os.stat(CSV_PATH)
+                current = (stat.st_size, stat.st_mtime_ns)
+                if current != last_seen:
+                    saved, complete = ingest_new_data(conn, verbose=False)
+                    if saved:
+                        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {saved} novas linhas salvas (versão {database.get_data_version(conn)}).")
+                    # Se um bloco falhou, tenta de novo no próximo intervalo, mesmo sem o CSV mudar.
+                    if complete:
+                        last_seen = current
+            except FileNotFoundError:
+                last_seen = None
+            except sqlite3.Error as e:
+                print(f"Erro no banco de dados: {e}")
+            time.sleep(interval_seconds)
+    except KeyboardInterrupt:
+        print("ETL contínuo finalizado.")
+    finally:
+        conn.close()
+
 if __name__ == '__main__':
-    process_log_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="ETL do CSV de medições para o banco do dashboard.")
+    parser.add_argument('--csv', default=CSV_PATH, help="Caminho do CSV de medições.")
+    parser.add_argument('--watch', action='store_true', help="Roda continuamente, ingerindo micro-lotes conforme o CSV cresce.")
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL_SECONDS, help="Intervalo entre verificações no modo --watch (segundos).")
+    parser.add_argument('--batch-bytes', type=int, default=CHUNK_BYTES, help="Tamanho máximo de cada lote/transação (bytes do CSV).")
+    args = parser.parse_args()
+    CSV_PATH = args.csv
+    CHUNK_BYTES = args.batch_bytes
+    if args.watch:
+        watch_log_data(args.interval)
+    else:
+        process_log_data()
@@ -0,0 +1,144 @@
+import argparse
+import datetime
+import os
+import sqlite3
+import pandas as pd
+import database
+import rollup
+
+# --- RETENÇÃO E ARQUIVO MENSAL ---
+# O banco principal guarda os pontos brutos só dos últimos RETENTION_DAYS dias. Dos mais
+# antigos ficam apenas os agregados por célula da grelha e hora (grid_rollup, com a grelha
+# e as regras de status de analysis.py), movidos para um arquivo SQLite por mês que as
+# consultas do rollup anexam quando o período pedido chega lá (rollup.ARCHIVE_DIR).
+# Mapa, gráfico e KPIs continuam a cobrir todo o histórico; os detalhes por ponto e a
+# exportação, só o período retido.
+#
+# Passos (cada um numa transação, e todos podem ser repetidos depois de uma falha):
+#   1. banco principal: agregados antigos vão para grid_rollup_outbox e os pontos são apagados;
+#   2. cada arquivo mensal recebe as linhas da fila ainda não gravadas nele;
+#   3. banco principal: a fila é esvaziada e o espaço livre devolvido (auto_vacuum incremental).
+RETENTION_DAYS = 90
+# PRAGMA auto_vacuum: 2 = INCREMENTAL.
+INCREMENTAL_AUTO_VACUUM = 2
+
+def first_kept_day(keep_days, today=None):
+    """Primeiro dia ('AAAA-MM-DD') cujos pontos brutos ficam no banco principal."""
+    today = today or datetime.date.today()
+    return (today - datetime.timedelta(days=keep_days)).isoformat()
+
+def move_to_outbox(conn, first_day):
+    """Passo 1: tira de grid_rollup os agregados anteriores a first_day e apaga os pontos
+    brutos correspondentes, numa única transação. Retorna (execução, pontos apagados)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Os agregados têm de cobrir todos os pontos antes de eles serem apagados.
+        if not rollup.is_current(conn):
+            rollup.rebuild(conn)
+        rollup.ensure_rollup_table(conn)
+        run = database.increment_counter(conn, 'retention_run')
+        columns = ', '.join(database.table_columns(conn, 'grid_rollup'))
+        moved = conn.execute(
+            f"INSERT INTO grid_rollup_outbox (retention_run, {columns}) SELECT ?, {columns} FROM grid_rollup WHERE day < ?",
+            (run, first_day)
+        ).rowcount
+        conn.execute("DELETE FROM grid_rollup WHERE day < ?", (first_day,))
+        deleted = conn.execute("DELETE FROM raw_points WHERE timestamp < ?", (database.to_epoch_seconds(first_day),)).rowcount
+        if deleted:
+            database.increment_counter(conn, database.RAW_POINTS_PURGES_KEY)
+        if moved or deleted:
+            database.bump_data_version(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return run, deleted
+
+def write_archives(conn):
+    """Passo 2: grava a fila nos arquivos mensais. Cada arquivo guarda a última execução já
+    gravada, por isso repetir o passo não soma nada duas vezes. Retorna {mês: execução}."""
+    months = [row[0] for row in conn.execute("SELECT DISTINCT substr(day, 1, 7) FROM grid_rollup_outbox ORDER BY 1")]
+    if months:
+        os.makedirs(rollup.ARCHIVE_DIR, exist_ok=True)
+    archived = {}
+    for month in months:
+        archive = sqlite3.connect(rollup.archive_path(month), timeout=database.BUSY_TIMEOUT_SECONDS)
+        try:
+            archive.execute(rollup.CREATE_ROLLUP_SQL)
+            database.ensure_metadata_table(archive)
+            applied = database.get_counter(archive, 'retention_run')
+            rows = pd.read_sql_query(
+                "SELECT * FROM grid_rollup_outbox WHERE substr(day, 1, 7) = ? AND retention_run > ?",
+                conn, params=[month, applied]
+            )
+            if not rows.empty:
+                run = int(rows['retention_run'].max())
+                with archive:
+                    # No arquivo, data_version guarda a execução da retenção que gravou a linha.
+                    rollup.upsert_summary(archive, rows, run)
+                    archive.execute(
+                        "INSERT INTO etl_metadata (key, value) VALUES ('retention_run', ?) "
+                        "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (run,)
+                    )
+                applied = run
+            archived[month] = applied
+        finally:
+            archive.close()
+    return archived
+
+def clear_outbox(conn, archived):
+    """Passo 3: apaga da fila as linhas já gravadas nos arquivos mensais."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cleared = 0
+        for month, run in archived.items():
+            cleared += conn.execute(
+                "DELETE FROM grid_rollup_outbox WHERE substr(day, 1, 7) = ? AND retention_run <= ?", (month, run)
+            ).rowcount
+        # Até aqui as linhas estavam na fila e no arquivo: a nova versão invalida o que foi
+        # calculado nesse intervalo.
+        if cleared:
+            database.bump_data_version(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return cleared
+
+def reclaim_space(conn):
+    """Devolve ao sistema de arquivos as páginas livres. Na primeira vez, ativa o auto_vacuum
+    incremental, o que exige um VACUUM completo."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL_AUTO_VACUUM:
+        print("Ativando o auto_vacuum incremental (VACUUM completo, uma única vez)...")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+    # As remoções também passam pelo WAL: o checkpoint devolve o arquivo -wal ao tamanho zero.
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+def file_size_mb(path):
+    return os.path.getsize(path) / 1024 / 1024 if os.path.exists(path) else 0.0
+
+def run_retention(keep_days=RETENTION_DAYS, today=None):
+    first_day = first_kept_day(keep_days, today)
+    size_before = file_size_mb(database.DB_PATH)
+    conn = database.get_db_connection()
+    try:
+        database.ensure_schema(conn)
+        run, deleted = move_to_outbox(conn, first_day)
+        archived = write_archives(conn)
+        cleared = clear_outbox(conn, archived)
+        reclaim_space(conn)
+    finally:
+        conn.close()
+    print(f"Retenção (execução {run}): {deleted} pontos anteriores a {first_day} apagados, "
+          f"{cleared} linhas de agregados gravadas em {len(archived)} arquivos mensais.")
+    print(f"Banco principal: {size_before:.1f} MB -> {file_size_mb(database.DB_PATH):.1f} MB.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apaga os pontos brutos antigos e arquiva os seus agregados por mês.")
+    parser.add_argument('--keep-days', type=int, default=RETENTION_DAYS, help="Dias de pontos brutos mantidos no banco principal.")
+    parser.add_argument('--today', type=datetime.date.fromisoformat, help="Data de referência (AAAA-MM-DD; padrão: hoje).")
+    args = parser.parse_args()
+    run_retention(args.keep_days, args.today)
@@ -0,0 +1,340 @@
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import analysis
+import database
+import metrics
+from config import MAPS_CONFIG, OPERATIONAL_SSID
+
+# --- TABELA DE AGREGADOS (ROLLUP) ---
+# Uma linha por (dia, hora, mapa, célula da grelha, status, classe de SSID, tablet),
+# mantida de forma incremental pelo ETL. Os endpoints de mapa, gráfico e KPIs somam
+# estas linhas em vez de varrer raw_points.
+ROLLUP_KEY = ['day', 'hour', 'map_mask', 'grid_lat', 'grid_lon', 'status', 'ssid_class', 'tablet_android_id']
+
+CREATE_ROLLUP_SQL = """
+CREATE TABLE IF NOT EXISTS grid_rollup (
+    day TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    map_mask INTEGER NOT NULL,
+    grid_lat INTEGER NOT NULL,
+    grid_lon INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    ssid_class TEXT NOT NULL,
+    tablet_android_id TEXT NOT NULL,
+    point_count INTEGER NOT NULL,
+    sum_lat REAL NOT NULL,
+    sum_lon REAL NOT NULL,
+    min_signal REAL,
+    max_signal REAL,
+    data_version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, hour, map_mask, grid_lat, grid_lon, status, ssid_class, tablet_android_id)
+)
+"""
+
+UPSERT_ROLLUP_SQL = f"""
+INSERT INTO grid_rollup ({', '.join(ROLLUP_KEY)}, point_count, sum_lat, sum_lon, min_signal, max_signal, data_version)
+VALUES ({', '.join('?' * (len(ROLLUP_KEY) + 6))})
+ON CONFLICT({', '.join(ROLLUP_KEY)}) DO UPDATE SET
+    point_count = point_count + excluded.point_count,
+    sum_lat = sum_lat + excluded.sum_lat,
+    sum_lon = sum_lon + excluded.sum_lon,
+    min_signal = MIN(COALESCE(min_signal, excluded.min_signal), COALESCE(excluded.min_signal, min_signal)),
+    max_signal = MAX(COALESCE(max_signal, excluded.max_signal), COALESCE(excluded.max_signal, max_signal)),
+    data_version = excluded.data_version
+"""
+
+# data_version guarda a última versão dos dados que alterou a linha: é o cursor das
+# atualizações incrementais do mapa (since_version).
+ROLLUP_INDEXES = {
+    'idx_grid_rollup_version': '(data_version)',
+    'idx_grid_rollup_cell': '(grid_lat, grid_lon, status)',
+}
+
+REBUILD_CHUNK_ROWS = 200_000
+
+# Cada mapa do MAPS_CONFIG ocupa um bit de map_mask (um ponto pode cair em mais de um).
+MAP_BITS = {name: 1 << i for i, name in enumerate(sorted(MAPS_CONFIG))}
+
+# Muda sempre que a grelha, as regras de status ou os mapas mudam: o rollup é então reconstruído.
+ROLLUP_SIGNATURE = hashlib.sha1(json.dumps({
+    'schema': 3,
+    'grid_size': analysis.GRID_SIZE_GPS,
+    'status_rules': analysis.STATUS_RULES,
+    'maps': MAPS_CONFIG,
+    'operational_ssid': OPERATIONAL_SSID,
+}, sort_keys=True).encode()).hexdigest()
+
+# Linhas já retiradas de grid_rollup pela retenção (retention.py) e ainda não gravadas no
+# arquivo mensal. Fica vazia fora de uma execução da retenção; as consultas também a leem.
+CREATE_OUTBOX_SQL = """
+CREATE TABLE IF NOT EXISTS grid_rollup_outbox AS
+SELECT CAST(NULL AS INTEGER) AS retention_run, * FROM grid_rollup WHERE 0
+"""
+
+def ensure_rollup_table(conn):
+    conn.execute(CREATE_ROLLUP_SQL)
+    for index_name, columns in ROLLUP_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON grid_rollup {columns}")
+    conn.execute(CREATE_OUTBOX_SQL)
+
+def classify_ssid(ssid):
+    """Classe do SSID, com o mesmo vocabulário do filtro ssid_filter do dashboard."""
+    ssid = pd.Series(ssid, dtype=object)
+    return np.select(
+        [(ssid == OPERATIONAL_SSID).to_numpy(), (ssid == 'disconnected').to_numpy()],
+        ['main_network', 'disconnected'], default='other_networks'
+    )
+
+def map_mask(lat, lon):
+    """Bitmask dos mapas do MAPS_CONFIG que contêm cada ponto."""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    mask = np.zeros(lat.shape, dtype=np.int64)
+    for name, bit in MAP_BITS.items():
+        bounds = MAPS_CONFIG[name]
+        inside = (lat >= bounds['lat_bottom']) & (lat <= bounds['lat_top']) & (lon >= bounds['lon_left']) & (lon <= bounds['lon_right'])
+        mask |= np.where(inside, bit, 0)
+    return mask
+
+def summarize_points(df):
+    """Agrega pontos brutos (timestamp já em datetime) nas chaves do rollup."""
+    df = df.dropna(subset=['timestamp'])
+    if df.empty:
+        return pd.DataFrame(columns=ROLLUP_KEY + ['point_count', 'sum_lat', 'sum_lon', 'min_signal', 'max_signal'])
+    grid_lat, grid_lon = analysis.grid_keys(df['latitude'], df['longitude'])
+    keyed = pd.DataFrame({
+        'hour_start': df['timestamp'].dt.floor('h').to_numpy(),
+        'map_mask': map_mask(df['latitude'], df['longitude']),
+        'grid_lat': grid_lat,
+        'grid_lon': grid_lon,
+        'status': np.asarray(analysis.classify_status_array(df['signal_dbm'], df['packet_loss_percent'])),
+        'ssid_class': classify_ssid(df['current_ssid']),
+        'tablet_android_id': df['tablet_android_id'].astype(object).fillna('').astype(str).to_numpy(),
+        'lat': df['latitude'].to_numpy(dtype=float),
+        'lon': df['longitude'].to_numpy(dtype=float),
+        'signal': pd.to_numeric(df['signal_dbm'], errors='coerce').to_numpy(dtype=float),
+    })
+    group_keys = ['hour_start'] + ROLLUP_KEY[2:]
+    summary = keyed.groupby(group_keys, sort=False).agg(
+        point_count=('lat', 'size'), sum_lat=('lat', 'sum'), sum_lon=('lon', 'sum'),
+        min_signal=('signal', 'min'), max_signal=('signal', 'max'),
+    ).reset_index()
+    summary.insert(0, 'day', summary['hour_start'].dt.strftime('%Y-%m-%d'))
+    summary.insert(1, 'hour', summary['hour_start'].dt.hour)
+    return summary.drop(columns=['hour_start'])
+
+def upsert_summary(conn, summary, version):
+    """Soma um lote já agregado ao rollup (sem commit: roda na transação do chamador)."""
+    if summary.empty: return
+    columns = ROLLUP_KEY + ['point_count', 'sum_lat', 'sum_lon', 'min_signal', 'max_signal']
+    summary = summary[columns].assign(data_version=version)
+    rows = summary.astype(object).where(summary.notna(), None).itertuples(index=False, name=None)
+    conn.executemany(UPSERT_ROLLUP_SQL, rows)
+
+def is_current(conn=None):
+    """True se o rollup existe e foi construído com a grelha/regras/mapas atuais."""
+    own_conn = conn is None
+    if own_conn:
+        conn = database.get_db_connection()
+    try:
+        if not database.table_exists(conn, 'grid_rollup') or not database.table_exists(conn, 'etl_metadata'):
+            return False
+        row = conn.execute("SELECT value FROM etl_metadata WHERE key = 'rollup_signature'").fetchone()
+        return row is not None and row[0] == ROLLUP_SIGNATURE
+    finally:
+        if own_conn:
+            conn.close()
+
+def rebuild(conn):
+    """Reconstrói o rollup inteiro a partir de raw_points (sem commit).
+
+    Cursores since_version anteriores à reconstrução deixam de valer (rollup_base_version).
+    """
+    conn.execute("DROP TABLE IF EXISTS grid_rollup")
+    ensure_rollup_table(conn)
+    database.ensure_metadata_table(conn)
+    version = database.get_data_version(conn)
+    if database.table_exists(conn, 'raw_points'):
+        for chunk in database.read_raw_points(conn, chunksize=REBUILD_CHUNK_ROWS):
+            upsert_summary(conn, summarize_points(chunk), version)
+    conn.executemany(
+        "INSERT INTO etl_metadata (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        [('rollup_signature', ROLLUP_SIGNATURE), ('rollup_base_version', version)]
+    )
+
+@metrics.timed('rollup.apply_batch')
+def apply_batch(conn, new_points_df, version):
+    """Atualiza o rollup com um lote novo; reconstrói tudo se estiver desatualizado."""
+    if is_current(conn):
+        upsert_summary(conn, summarize_points(new_points_df), version)
+    else:
+        rebuild(conn)
+
+def ensure_current(conn=None):
+    """Reconstrói o rollup (e faz commit) se ele não existir ou estiver desatualizado."""
+    own_conn = conn is None
+    if own_conn:
+        conn = database.get_db_connection()
+    try:
+        if not is_current(conn):
+            rebuild(conn)
+        else:
+            ensure_rollup_table(conn)
+        conn.commit()
+    finally:
+        if own_conn:
+            conn.close()
+
+# --- CONSULTAS ---
+def build_rollup_clause(map_name=None, start_date=None, end_date=None, ssid_filter=None, tablet_id=None, grid_bounds=None):
+    """Equivalente de database.build_filter_clause para a tabela grid_rollup. grid_bounds:
+    faixa de chaves da área visível do mapa (ver analysis.grid_view)."""
+    conditions = []
+    params = []
+    if grid_bounds:
+        conditions.append("grid_lat BETWEEN ? AND ? AND grid_lon BETWEEN ? AND ?")
+        params.extend(grid_bounds)
+    if tablet_id:
+        conditions.append("tablet_android_id = ?")
+        params.append(tablet_id)
+    if start_date and end_date:
+        conditions.append("day BETWEEN ? AND ?")
+        params.extend([pd.to_datetime(start_date).strftime('%Y-%m-%d'), pd.to_datetime(end_date).strftime('%Y-%m-%d')])
+    if ssid_filter in ('main_network', 'disconnected', 'other_networks'):
+        conditions.append("ssid_class = ?")
+        params.append(ssid_filter)
+    if map_name in MAP_BITS:
+        conditions.append("(map_mask & ?) != 0")
+        params.append(MAP_BITS[map_name])
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where_sql, params
+
+# --- ARQUIVO MENSAL ---
+# Os agregados de dias além da retenção ficam em db/archive/, um arquivo SQLite por mês
+# (tabela grid_rollup com o mesmo schema). O nome leva a assinatura do rollup: arquivos
+# gerados com outra grelha ou outras regras não podem ser reconstruídos e são ignorados.
+ARCHIVE_DIR = 'db/archive'
+# Arquivos anexados (ATTACH) por consulta: o SQLite aceita 10 por conexão.
+ARCHIVE_ATTACH_BATCH = 8
+# Tabelas do banco principal lidas junto com os arquivos.
+LIVE_SOURCES = ['main.grid_rollup', 'main.grid_rollup_outbox']
+
+def archive_path(month):
+    """Arquivo dos agregados do mês ('AAAA-MM')."""
+    return os.path.join(ARCHIVE_DIR, f'rollup_{month}_{ROLLUP_SIGNATURE[:12]}.db')
+
+def archive_paths(start_date=None, end_date=None):
+    """Arquivos mensais (da assinatura atual) que cobrem o intervalo de datas, em ordem."""
+    paths = sorted(glob.glob(os.path.join(ARCHIVE_DIR, f'rollup_*_{ROLLUP_SIGNATURE[:12]}.db')))
+    if start_date and end_date:
+        first, last = pd.to_datetime(start_date).strftime('%Y-%m'), pd.to_datetime(end_date).strftime('%Y-%m')
+        paths = [path for path in paths if first <= os.path.basename(path).split('_')[1] <= last]
+    return paths
+
+def read_rollup(sql, columns, where_sql, params, group_keys, start_date=None, end_date=None, head_params=(), order_by=None):
+    """Roda `sql` sobre as linhas do rollup que atendem a where_sql, do banco principal e dos
+    arquivos mensais do intervalo. `{rows}` no SQL é a união das linhas (só `columns`) de
+    todas as fontes. Com mais arquivos que ARCHIVE_ATTACH_BATCH, a consulta roda por lotes e
+    os resultados (somas) são somados de novo por group_keys e ordenados por order_by."""
+    paths = archive_paths(start_date, end_date)
+    batches = [paths[i:i + ARCHIVE_ATTACH_BATCH] for i in range(0, len(paths), ARCHIVE_ATTACH_BATCH)] or [[]]
+    conn = database.get_db_connection()
+    frames = []
+    try:
+        for batch_index, batch in enumerate(batches):
+            names = [f'archive_{i}' for i in range(len(batch))]
+            for name, path in zip(names, batch):
+                conn.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+            sources = (LIVE_SOURCES if batch_index == 0 else []) + [f'{name}.grid_rollup' for name in names]
+            rows_sql = ' UNION ALL '.join(f"SELECT {columns} FROM {source} {where_sql}" for source in sources)
+            frames.append(pd.read_sql_query(sql.format(rows=f'({rows_sql})'), conn, params=list(head_params) + list(params) * len(sources)))
+            for name in names:
+                conn.execute(f"DETACH DATABASE {name}")
+    finally:
+        conn.close()
+    if len(frames) == 1:
+        return frames[0]
+    combined = pd.concat(frames, ignore_index=True).groupby(group_keys, as_index=False, sort=False).sum()
+    return combined.sort_values(order_by, kind='stable', ignore_index=True) if order_by else combined
+
+CELL_KEYS = ['status', 'grid_lat', 'grid_lon']
+
+def cell_keys_sql(level=0):
+    """Chaves das células lidas do rollup, já no nível da pirâmide."""
+    if not level:
+        return 'status, grid_lat, grid_lon'
+    return f'status, grid_lat >> {int(level)} AS grid_lat, grid_lon >> {int(level)} AS grid_lon'
+
+def cell_columns(level=0):
+    return f'{cell_keys_sql(level)}, point_count, sum_lat, sum_lon'
+
+def view_args(view):
+    """(nível, faixa de chaves) de uma vista do mapa (analysis.grid_view); None = tudo, na base."""
+    return (view['level'], view['bounds']) if view else (0, None)
+
+@metrics.timed('rollup.grid_cells')
+def get_grid_cells(map_name=None, start_date=None, end_date=None, ssid_filter=None, tablet_id=None, view=None):
+    """Células da grelha por status, somadas no intervalo filtrado, para o mapa e o gráfico.
+    view (analysis.grid_view): só as células do nível e da área visível do mapa."""
+    level, grid_bounds = view_args(view)
+    where_sql, params = build_rollup_clause(map_name, start_date, end_date, ssid_filter, tablet_id, grid_bounds)
+    cells = read_rollup(
+        "SELECT status, grid_lat, grid_lon, SUM(point_count) AS point_count, SUM(sum_lat) AS sum_lat, SUM(sum_lon) AS sum_lon "
+        "FROM {rows} GROUP BY status, grid_lat, grid_lon ORDER BY grid_lat, grid_lon",
+        cell_columns(level), where_sql, params, CELL_KEYS, start_date, end_date, order_by=['grid_lat', 'grid_lon']
+    )
+    metrics.rows('rollup.grid_cells', len(cells))
+    return cells
+
+def accepts_cursor(since_version, conn=None):
+    """True se o rollup consegue responder só o que mudou desde `since_version`."""
+    own_conn = conn is None
+    if own_conn:
+        conn = database.get_db_connection()
+    try:
+        if not is_current(conn):
+            return False
+        row = conn.execute("SELECT value FROM etl_metadata WHERE key = 'rollup_base_version'").fetchone()
+        base_version = int(row[0]) if row else 0
+        return base_version <= since_version <= database.get_data_version(conn)
+    finally:
+        if own_conn:
+            conn.close()
+
+@metrics.timed('rollup.changed_grid_cells')
+def get_changed_grid_cells(since_version, map_name=None, start_date=None, end_date=None, ssid_filter=None, tablet_id=None, view=None):
+    """Como get_grid_cells, mas só as células (por status) alteradas depois de `since_version`.
+
+    As células alteradas são encontradas pelo índice de data_version (só o banco principal
+    recebe dados novos) e depois somadas no intervalo filtrado inteiro, arquivos incluídos,
+    para que contagem, raio e opacidade saiam completos.
+    """
+    level, grid_bounds = view_args(view)
+    where_sql, params = build_rollup_clause(map_name, start_date, end_date, ssid_filter, tablet_id, grid_bounds)
+    changed_sql = f"{where_sql} AND data_version > ?" if where_sql else "WHERE data_version > ?"
+    cells = read_rollup(
+        f"WITH changed AS (SELECT DISTINCT {cell_keys_sql(level)} FROM main.grid_rollup {changed_sql}) "
+        "SELECT r.status, r.grid_lat, r.grid_lon, SUM(r.point_count) AS point_count, SUM(r.sum_lat) AS sum_lat, SUM(r.sum_lon) AS sum_lon "
+        "FROM changed JOIN {rows} r ON r.grid_lat = changed.grid_lat AND r.grid_lon = changed.grid_lon AND r.status = changed.status "
+        "GROUP BY r.status, r.grid_lat, r.grid_lon ORDER BY r.grid_lat, r.grid_lon",
+        cell_columns(level), where_sql, params, CELL_KEYS, start_date, end_date,
+        head_params=list(params) + [since_version], order_by=['grid_lat', 'grid_lon']
+    )
+    metrics.rows('rollup.changed_grid_cells', len(cells))
+    return cells
+
+@metrics.timed('rollup.kpi_summary')
+def get_kpi_summary(map_name=None, start_date=None, end_date=None, ssid_filter=None, tablet_id=None):
+    """Contagens por status, classe de SSID e tablet para os KPIs."""
+    where_sql, params = build_rollup_clause(map_name, start_date, end_date, ssid_filter, tablet_id)
+    return read_rollup(
+        "SELECT status, ssid_class, tablet_android_id, SUM(point_count) AS point_count "
+        "FROM {rows} GROUP BY status, ssid_class, tablet_android_id",
+        'status, ssid_class, tablet_android_id, point_count', where_sql, params,
+        ['status', 'ssid_class', 'tablet_android_id'], start_date, end_date
+    )
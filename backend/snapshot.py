@@ -0,0 +1,97 @@
+import threading
+import numpy as np
+import pandas as pd
+import database
+
+# --- SNAPSHOT COLUNAR DE raw_points ---
+# Cópia em memória, compartilhada pelo processo, com colunas já tipadas.
+# É atualizada de forma incremental (apenas rowid > último carregado)
+# sempre que o ETL publica uma nova versão dos dados.
+_lock = threading.Lock()
+# 'purges' acompanha as remoções da retenção: linhas antigas apagadas obrigam a recarregar tudo.
+_snapshot = {'version': None, 'purges': 0, 'last_rowid': 0, 'frame': None}
+
+NUMERIC_COLUMNS = ['signal_dbm', 'packet_loss_percent', 'latency_ms']
+
+def _compact_numeric(series):
+    """Usa o menor inteiro que comporta a coluna; float32 se houver decimais ou nulos."""
+    values = pd.to_numeric(series, errors='coerce')
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_numeric(values, downcast='integer')
+    return values.astype('float32')
+
+def _to_columnar(df):
+    """Reduz as colunas numéricas dos pontos (já decodificados por database.read_raw_points)."""
+    df = df.drop(columns=['row_id'])
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = _compact_numeric(df[col])
+    return df.reset_index(drop=True)
+
+def _append(frame, new_rows):
+    """Anexa novas linhas ao snapshot unindo as categorias das colunas categóricas."""
+    if frame is None or frame.empty:
+        return new_rows
+    if new_rows.empty:
+        return frame
+    combined = {}
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pd.CategoricalDtype):
+            combined[col] = pd.api.types.union_categoricals([frame[col], new_rows[col].astype('category')])
+        else:
+            combined[col] = np.concatenate([frame[col].to_numpy(), new_rows[col].to_numpy()])
+    return pd.DataFrame(combined)
+
+def refresh():
+    """Sincroniza o snapshot com o banco se a versão dos dados mudou."""
+    conn = database.get_db_connection()
+    try:
+        version = database.get_data_version(conn)
+        if _snapshot['frame'] is not None and version == _snapshot['version']:
+            return _snapshot['frame']
+        with _lock:
+            if _snapshot['frame'] is not None and version == _snapshot['version']:
+                return _snapshot['frame']
+            frame = _snapshot['frame']
+            last_rowid = _snapshot['last_rowid']
+            max_rowid = database.get_max_rowid(conn)
+            purges = database.get_counter(conn, database.RAW_POINTS_PURGES_KEY)
+            # Linhas removidas ou tabela recriada: recarrega tudo.
+            if max_rowid < last_rowid or purges != _snapshot['purges']:
+                frame, last_rowid = None, 0
+            if max_rowid > last_rowid:
+                new_rows = database.get_raw_points_after(conn, last_rowid, max_rowid)
+                frame = _append(frame, _to_columnar(new_rows))
+            elif frame is None:
+                frame = pd.DataFrame()
+            _snapshot.update(version=version, purges=purges, last_rowid=max_rowid, frame=frame)
+            return frame
+    finally:
+        conn.close()
+
+def reset():
+    """Descarta o snapshot: a próxima chamada a refresh() relê tudo do banco."""
+    with _lock:
+        _snapshot.update(version=None, purges=0, last_rowid=0, frame=None)
+
+def filter_points(frame, bounds=None, start_date=None, end_date=None, ssid_filter=None, tablet_id=None, operational_ssid=None):
+    """Aplica os filtros do dashboard ao snapshot usando máscaras booleanas."""
+    if frame.empty:
+        return frame.copy()
+    mask = np.ones(len(frame), dtype=bool)
+    if tablet_id:
+        mask &= (frame['tablet_android_id'] == tablet_id).to_numpy()
+    if start_date and end_date:
+        start = pd.to_datetime(start_date)
+        end = pd.to_datetime(end_date).replace(hour=23, minute=59, second=59)
+        mask &= ((frame['timestamp'] >= start) & (frame['timestamp'] <= end)).to_numpy()
+    if ssid_filter:
+        ssid = frame['current_ssid']
+        if ssid_filter == 'main_network': mask &= (ssid == operational_ssid).to_numpy()
+        elif ssid_filter == 'disconnected': mask &= (ssid == 'disconnected').to_numpy()
+        elif ssid_filter == 'other_networks': mask &= (~ssid.isin([operational_ssid, 'disconnected'])).to_numpy()
+    if bounds:
+        lat = frame['latitude'].to_numpy()
+        lon = frame['longitude'].to_numpy()
+        mask &= (lat >= bounds['lat_bottom']) & (lat <= bounds['lat_top']) & (lon >= bounds['lon_left']) & (lon <= bounds['lon_right'])
+    return frame[mask].reset_index(drop=True)
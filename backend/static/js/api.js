@@ -1,4 +1,12 @@
-export async function fetchMapData(mapName, startDate, endDate, ssidFilter, tabletId) {
+// Zoom e área visível do mapa: o servidor devolve só as células do nível e da área pedidos.
+function appendViewport(params, viewport) {
+    if (viewport) {
+        params.append('zoom', viewport.zoom);
+        params.append('bbox', viewport.bbox.join(','));
+    }
+}
+
+export async function fetchMapData(mapName, startDate, endDate, ssidFilter, tabletId, viewport = null) {
     const params = new URLSearchParams({ map: mapName, ssid_filter: ssidFilter });
     if (startDate && endDate) {
         params.append('start_date', startDate);
@@ -7,6 +15,7 @@ export async function fetchMapData(mapName, startDate, endDate, ssidFilter, tabl
     if (tabletId) {
         params.append('tablet_id', tabletId);
     }
+    appendViewport(params, viewport);
     const response = await fetch(`/api/map_data?${params.toString()}`);
     if (!response.ok) throw new Error(`Falha na API de dados do mapa: ${response.status}`);
     return await response.json();
@@ -38,4 +47,36 @@ export async function fetchKpis(mapName, startDate, endDate, ssidFilter, tabletI
     const response = await fetch(`/api/kpis?${params.toString()}`);
     if (!response.ok) throw new Error(`Falha na API de KPIs: ${response.status}`);
     return await response.json();
-}
\ No newline at end of file
+}
+
+export async function fetchDashboard(mapName, startDate, endDate, ssidFilter, tabletId, sinceVersion = null, viewport = null) {
+    const params = new URLSearchParams({ map: mapName, ssid_filter: ssidFilter });
+    if (startDate && endDate) {
+        params.append('start_date', startDate);
+        params.append('end_date', endDate);
+    }
+    if (tabletId) {
+        params.append('tablet_id', tabletId);
+    }
+    if (sinceVersion !== null) {
+        params.append('since_version', sinceVersion);
+    }
+    appendViewport(params, viewport);
+    const response = await fetch(`/api/dashboard?${params.toString()}`);
+    if (!response.ok) throw new Error(`Falha na API do dashboard: ${response.status}`);
+    return await response.json();
+}
+
+export async function fetchZonePoints(filters, gridId, status, page = 1) {
+    const params = new URLSearchParams({ map: filters.mapName, ssid_filter: filters.ssidFilter, grid: gridId, status: status, page: page });
+    if (filters.startDate && filters.endDate) {
+        params.append('start_date', filters.startDate);
+        params.append('end_date', filters.endDate);
+    }
+    if (filters.tabletId) {
+        params.append('tablet_id', filters.tabletId);
+    }
+    const response = await fetch(`/api/zone_points?${params.toString()}`);
+    if (!response.ok) throw new Error(`Falha na API de pontos da zona: ${response.status}`);
+    return await response.json();
+}
@@ -1,11 +1,19 @@
-import { fetchMapData, fetchCriticalPoints, fetchKpis } from './api.js';
-import { initMap, drawMapData, setMapView, focusOnPoint } from './map-view.js';
+import { fetchDashboard, fetchMapData } from './api.js';
+import { initMap, drawMapData, patchMapData, setMapView, focusOnPoint, getViewport, viewportCovers, onViewportChange } from './map-view.js';
 import { drawProblemChart } from './chart-view.js';
 
+// Atualização periódica: só usada quando o canal de eventos (/api/stream) não está disponível.
 const AUTO_REFRESH_INTERVAL = 60000;
+// Intervalo entre consultas ao estado de uma exportação em andamento.
+const EXPORT_POLL_INTERVAL = 1000;
 
 let cachedMapData = null;
 let cachedChartData = null;
+let cachedFilters = null;
+// Zoom e área (com margem) das zonas carregadas: o mapa só é pedido de novo quando a vista sai dela.
+// requestedViewport é a do último pedido feito, ainda que em andamento.
+let loadedViewport = null;
+let requestedViewport = null;
 
 function showCopyFeedback(text) {
     const feedbackEl = document.createElement('div');
@@ -108,33 +116,69 @@ document.addEventListener('DOMContentLoaded', () => {
         
         updateStatusTexts(startDate, endDate, tabletId);
 
+        const filters = { mapName: currentMap, startDate, endDate, ssidFilter, tabletId };
+        // Na atualização automática com os mesmos filtros, pede só as zonas alteradas desde a última versão.
+        const sameFilters = cachedMapData && cachedFilters && Object.keys(filters).every(key => filters[key] === cachedFilters[key]);
+        const sinceVersion = isAutoRefresh && sameFilters ? cachedMapData.version : null;
+        // As alterações incrementais valem para a área já carregada.
+        const viewport = sinceVersion !== null && loadedViewport ? loadedViewport : getViewport();
+        requestedViewport = viewport;
+
         try {
-            const [kpiData, mapData, chartData] = await Promise.all([
-                fetchKpis(currentMap, startDate, endDate, ssidFilter, tabletId),
-                fetchMapData(currentMap, startDate, endDate, ssidFilter, tabletId),
-                fetchCriticalPoints(currentMap, startDate, endDate, ssidFilter, tabletId)
-            ]);
+            const dashboardData = await fetchDashboard(currentMap, startDate, endDate, ssidFilter, tabletId, sinceVersion, viewport);
 
-            cachedMapData = mapData;
-            cachedChartData = chartData;
+            cachedChartData = dashboardData.critical_points;
+            cachedFilters = filters;
+            loadedViewport = viewport;
+            updateKpis(dashboardData.kpis);
 
-            updateKpis(kpiData);
-            updateVisualizationsFromCache();
+            if (dashboardData.map_data.full) {
+                cachedMapData = dashboardData.map_data;
+                updateVisualizationsFromCache();
+            } else {
+                cachedMapData = patchMapData(dashboardData.map_data);
+                updateChartFromCache();
+            }
 
         } catch (error) {
             console.error("Falha ao atualizar o dashboard:", error);
             mapDateInfo.textContent = 'Erro ao carregar dados. Tente novamente.';
             cachedMapData = null;
             cachedChartData = null;
+            loadedViewport = null;
+            requestedViewport = null;
         } finally {
             if (!isAutoRefresh) loadingOverlay.classList.add('hidden');
         }
     }
+
+    // Zoom ou deslocamento (ex.: foco num ponto do gráfico): pede as zonas do novo nível da grelha e da nova área.
+    async function updateMapForViewport(viewport) {
+        if (!cachedMapData || !cachedFilters || viewportCovers(requestedViewport, viewport)) return;
+        const filters = cachedFilters;
+        requestedViewport = viewport;
+        try {
+            const mapData = await fetchMapData(filters.mapName, filters.startDate, filters.endDate, filters.ssidFilter, filters.tabletId, viewport);
+            // Descarta a resposta se outro pedido (novos filtros ou nova vista) começou entretanto.
+            if (filters !== cachedFilters || viewport !== requestedViewport) return;
+            cachedMapData = mapData;
+            loadedViewport = viewport;
+            drawMapData(cachedMapData, cachedFilters);
+        } catch (error) {
+            console.error("Falha ao atualizar o mapa:", error);
+            if (viewport === requestedViewport) requestedViewport = loadedViewport;
+        }
+    }
     
     function updateVisualizationsFromCache() {
         if (!cachedMapData || !cachedChartData) return;
 
-        drawMapData(cachedMapData);
+        drawMapData(cachedMapData, cachedFilters);
+        updateChartFromCache();
+    }
+
+    function updateChartFromCache() {
+        if (!cachedChartData) return;
 
         let filteredChartData = cachedChartData;
         if (!toggleCriticalLayer.checked) {
@@ -235,8 +279,8 @@ document.addEventListener('DOMContentLoaded', () => {
             if (tabletId) {
                 params.append('tablet_id', tabletId);
             }
-            const exportUrl = `/api/export?${params.toString()}`;
-            const response = await fetch(exportUrl);
+            // O relatório é gerado em segundo plano (job); o estado é consultado até o arquivo ficar pronto.
+            const response = await fetch(`/api/export/jobs?${params.toString()}`, { method: 'POST' });
             
             if (!response.ok) {
                 const errorMessage = await response.text();
@@ -244,24 +288,24 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
 
-            const blob = await response.blob();
-            const url = window.URL.createObjectURL(blob);
+            let job = await response.json();
+            while (job.status === 'queued' || job.status === 'running') {
+                await new Promise(resolve => setTimeout(resolve, EXPORT_POLL_INTERVAL));
+                const statusResponse = await fetch(`/api/export/jobs/${job.job_id}`);
+                if (!statusResponse.ok) throw new Error(`Falha ao consultar a exportação: ${statusResponse.status}`);
+                job = await statusResponse.json();
+            }
+            if (job.status !== 'done') {
+                alert(`Erro ao gerar o relatório: ${job.error}`);
+                return;
+            }
+
             const a = document.createElement('a');
             a.style.display = 'none';
-            a.href = url;
-            const disposition = response.headers.get('Content-Disposition');
-            let filename = `Relatorio_WiFi_${startDate}_a_${endDate}.xlsx`;
-            if (disposition && disposition.indexOf('attachment') !== -1) {
-                const filenameRegex = /filename[^;=\n]*=((['"]).*?\2|[^;\n]*)/;
-                const matches = filenameRegex.exec(disdisposition);
-                if (matches != null && matches[1]) {
-                    filename = matches[1].replace(/['"]/g, '');
-                }
-            }
-            a.download = filename;
+            a.href = job.download_url;
+            a.download = job.file_name;
             document.body.appendChild(a);
             a.click();
-            window.URL.revokeObjectURL(url);
             a.remove();
         } catch (error) {
             console.error('Erro ao exportar arquivo:', error);
@@ -271,10 +315,47 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    let refreshTimer = null;
+
+    function startPolling() {
+        if (refreshTimer) return;
+        refreshTimer = setInterval(() => {
+            console.log("Atualizando dados automaticamente...");
+            updateAllViews(true);
+        }, AUTO_REFRESH_INTERVAL);
+    }
+
+    function stopPolling() {
+        clearInterval(refreshTimer);
+        refreshTimer = null;
+    }
+
+    // O servidor avisa por server-sent events quando o ETL grava uma nova versão dos dados.
+    function connectEventStream() {
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
+        const source = new EventSource('/api/stream');
+        source.addEventListener('version', (event) => {
+            stopPolling();
+            const { version } = JSON.parse(event.data);
+            if (cachedMapData && version !== cachedMapData.version) {
+                console.log("Nova versão dos dados, atualizando...");
+                updateAllViews(true);
+            }
+        });
+        source.onerror = () => {
+            startPolling();
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(connectEventStream, AUTO_REFRESH_INTERVAL);
+            }
+        };
+    }
+
+    onViewportChange(updateMapForViewport);
+
     setDefaultDateToYesterday();
     updateAllViews();
-    setInterval(() => {
-        console.log("Atualizando dados automaticamente...");
-        updateAllViews(true);
-    }, AUTO_REFRESH_INTERVAL);
+    connectEventStream();
 });
\ No newline at end of file
@@ -1,3 +1,5 @@
+import { fetchZonePoints } from './api.js';
+
 const patioView = { center: [-38.811906, -3.549906], zoom: 16, bearing: 52, pitch: 0 };
 const tmutView = { center: [-38.797690, -3.525506], zoom: 15.5, bearing: 50, pitch: 0 };
 
@@ -9,8 +11,21 @@ const goodCountSpan = document.getElementById('good-count');
 const attentionCountSpan = document.getElementById('attention-count');
 const criticalCountSpan = document.getElementById('critical-count');
 
-const layerIds = ['good-zones-layer', 'attention-zones-layer', 'critical-zones-layer'];
-const sourceIds = ['good-zones', 'attention-zones', 'critical-zones'];
+const zoneLayers = [
+    { key: 'good_zones', sourceId: 'good-zones', layerId: 'good-zones-layer', color: 'lime', countSpan: goodCountSpan },
+    { key: 'attention_zones', sourceId: 'attention-zones', layerId: 'attention-zones-layer', color: 'yellow', countSpan: attentionCountSpan },
+    { key: 'critical_zones', sourceId: 'critical-zones', layerId: 'critical-zones-layer', color: 'red', countSpan: criticalCountSpan }
+];
+
+// Área pedida ao servidor: a vista atual mais esta margem (fração da largura/altura) de cada
+// lado, para que pequenos deslocamentos não exijam um novo pedido.
+const VIEWPORT_MARGIN = 0.25;
+// Espera o mapa parar (fim de um flyTo, por exemplo) antes de avisar a mudança de vista.
+const VIEWPORT_CHANGE_DELAY = 200;
+
+// Zonas desenhadas, por grid_id: as atualizações incrementais só substituem as que mudaram.
+const drawnZones = { good_zones: new Map(), attention_zones: new Map(), critical_zones: new Map() };
+let currentFilters = null;
 
 export function initMap() {
     map = new maplibregl.Map({
@@ -20,7 +35,7 @@ export function initMap() {
             sources: {
                 'raster-tiles': {
                     type: 'raster',
-                    tiles: ['/static/tiles/{z}/{x}/{y}.png'],
+                    tiles: ['/tiles/{z}/{x}/{y}.png'],
                     tileSize: 256,
                     attribution: 'APM Terminals Pecém',
                     maxzoom: 18 
@@ -61,6 +76,32 @@ export function setMapView(mapName) {
     map.jumpTo({ ...view });
 }
 
+export function getViewport() {
+    const bounds = map.getBounds();
+    const marginLng = (bounds.getEast() - bounds.getWest()) * VIEWPORT_MARGIN;
+    const marginLat = (bounds.getNorth() - bounds.getSouth()) * VIEWPORT_MARGIN;
+    const round = value => Math.round(value * 1e6) / 1e6;
+    return {
+        zoom: Math.round(map.getZoom() * 100) / 100,
+        bbox: [bounds.getWest() - marginLng, bounds.getSouth() - marginLat, bounds.getEast() + marginLng, bounds.getNorth() + marginLat].map(round)
+    };
+}
+
+// true se as zonas carregadas para `loaded` servem para `current` (mesmo zoom e área contida).
+export function viewportCovers(loaded, current) {
+    if (!loaded || !current || loaded.zoom !== current.zoom) return false;
+    const [west, south, east, north] = current.bbox;
+    return west >= loaded.bbox[0] && south >= loaded.bbox[1] && east <= loaded.bbox[2] && north <= loaded.bbox[3];
+}
+
+export function onViewportChange(callback) {
+    let timer = null;
+    map.on('moveend', () => {
+        clearTimeout(timer);
+        timer = setTimeout(() => callback(getViewport()), VIEWPORT_CHANGE_DELAY);
+    });
+}
+
 export function focusOnPoint(lat, lng) {
     map.flyTo({
         center: [lng, lat],
@@ -71,64 +112,39 @@ export function focusOnPoint(lat, lng) {
     });
 }
 
-export function drawMapData(data) {
-    return new Promise(resolve => {
-        goodCountSpan.textContent = data.good_zones.length;
-        attentionCountSpan.textContent = data.attention_zones.length;
-        criticalCountSpan.textContent = data.critical_zones.length;
-
-        const prepareData = (zones) => ({
-            type: 'FeatureCollection',
-            features: zones.map(z => ({...z, properties: {...z.properties, point_details: JSON.stringify(z.properties.point_details)}}))
-        });
+export function drawMapData(data, filters) {
+    currentFilters = filters;
+    zoneLayers.forEach(({ key }) => {
+        drawnZones[key] = new Map(data[key].map(zone => [zone.properties.grid_id, zone]));
+    });
+    return renderZones();
+}
 
-        const render = () => {
-            for (let i = 0; i < layerIds.length; i++) {
-                if (map.getLayer(layerIds[i])) map.removeLayer(layerIds[i]);
-                if (map.getSource(sourceIds[i])) map.removeSource(sourceIds[i]);
-            }
-            
-            addSourceAndLayer('good-zones', 'good-zones-layer', prepareData(data.good_zones), 'lime');
-            addSourceAndLayer('attention-zones', 'attention-zones-layer', prepareData(data.attention_zones), 'yellow');
-            addSourceAndLayer('critical-zones', 'critical-zones-layer', prepareData(data.critical_zones), 'red');
-            
-            resolve();
-        };
+export function patchMapData(delta) {
+    zoneLayers.forEach(({ key }) => {
+        delta[key].forEach(zone => drawnZones[key].set(zone.properties.grid_id, zone));
+    });
+    renderZones();
+    const mapData = { version: delta.version, full: true };
+    zoneLayers.forEach(({ key }) => { mapData[key] = Array.from(drawnZones[key].values()); });
+    return mapData;
+}
 
-        const addSourceAndLayer = (sourceId, layerId, geojsonData, color) => {
-            map.addSource(sourceId, { type: 'geojson', data: geojsonData });
-            map.addLayer({
-                id: layerId,
-                type: 'circle',
-                source: sourceId,
-                paint: {
-                    'circle-radius': ['get', 'radius'],
-                    'circle-color': color,
-                    'circle-opacity': ['get', 'opacity'],
-                    'circle-stroke-width': 1,
-                    'circle-stroke-color': color
-                }
-            });
-            
-            const checkbox = document.getElementById(`toggle-${layerId.split('-')[0]}-layer`);
-            if (checkbox) {
-                toggleLayerVisibility(layerId, checkbox.checked);
-            }
+function renderZones() {
+    return new Promise(resolve => {
+        zoneLayers.forEach(({ key, countSpan }) => { countSpan.textContent = drawnZones[key].size; });
 
-            map.on('click', layerId, (e) => {
-                const properties = e.features[0].properties;
-                const details = JSON.parse(properties.point_details);
-                let popupContent = `<div class="popup-content"><b>${properties.status === 'good' ? 'Zona de Rede Boa' : (properties.status === 'attention' ? 'Zona de Rede Média' : 'Zona de Rede Ruim')}</b><br>Medições Agrupadas: ${properties.point_count}<hr style="margin: 5px 0;">`;
-                if (details) {
-                    details.forEach(detail => {
-                        popupContent += `<div><span class="copy-id" title="Clique para copiar">${detail.id}</span>, ${detail.time}, <b>${detail.ssid}</b></div>`;
-                    });
+        const render = () => {
+            zoneLayers.forEach(({ key, sourceId, layerId, color }) => {
+                const geojsonData = { type: 'FeatureCollection', features: Array.from(drawnZones[key].values()) };
+                const source = map.getSource(sourceId);
+                if (source) {
+                    source.setData(geojsonData);
+                } else {
+                    addSourceAndLayer(sourceId, layerId, geojsonData, color);
                 }
-                popupContent += `</div>`;
-                new maplibregl.Popup().setLngLat(e.lngLat).setHTML(popupContent).addTo(map);
             });
-            map.on('mouseenter', layerId, () => { map.getCanvas().style.cursor = 'pointer'; });
-            map.on('mouseleave', layerId, () => { map.getCanvas().style.cursor = ''; });
+            resolve();
         };
 
         if (map.isStyleLoaded() && !map.isMoving()) {
@@ -137,4 +153,70 @@ export function drawMapData(data) {
             map.once('idle', render);
         }
     });
+}
+
+// Fonte, camada e eventos são criados uma única vez; depois só os dados da fonte são trocados.
+function addSourceAndLayer(sourceId, layerId, geojsonData, color) {
+    map.addSource(sourceId, { type: 'geojson', data: geojsonData });
+    map.addLayer({
+        id: layerId,
+        type: 'circle',
+        source: sourceId,
+        paint: {
+            'circle-radius': ['get', 'radius'],
+            'circle-color': color,
+            'circle-opacity': ['get', 'opacity'],
+            'circle-stroke-width': 1,
+            'circle-stroke-color': color
+        }
+    });
+
+    const checkbox = document.getElementById(`toggle-${layerId.split('-')[0]}-layer`);
+    if (checkbox) {
+        toggleLayerVisibility(layerId, checkbox.checked);
+    }
+
+    map.on('click', layerId, (e) => {
+        const properties = e.features[0].properties;
+        const popup = new maplibregl.Popup().setLngLat(e.lngLat).addTo(map);
+        showZonePoints(popup, properties, currentFilters);
+    });
+    map.on('mouseenter', layerId, () => { map.getCanvas().style.cursor = 'pointer'; });
+    map.on('mouseleave', layerId, () => { map.getCanvas().style.cursor = ''; });
+}
+
+function zonePopupHeader(properties) {
+    const title = properties.status === 'good' ? 'Zona de Rede Boa' : (properties.status === 'attention' ? 'Zona de Rede Média' : 'Zona de Rede Ruim');
+    return `<b>${title}</b><br>Medições Agrupadas: ${properties.point_count}<hr style="margin: 5px 0;">`;
+}
+
+async function showZonePoints(popup, properties, filters) {
+    let details = [];
+    let page = 1;
+    popup.setHTML(`<div class="popup-content">${zonePopupHeader(properties)}<div>Carregando...</div></div>`);
+
+    const loadPage = async () => {
+        try {
+            const zoneData = await fetchZonePoints(filters, properties.grid_id, properties.status, page);
+            details = details.concat(zoneData.points);
+            let popupContent = `<div class="popup-content">${zonePopupHeader(properties)}`;
+            details.forEach(detail => {
+                popupContent += `<div><span class="copy-id" title="Clique para copiar">${detail.id}</span>, ${detail.time}, <b>${detail.ssid}</b></div>`;
+            });
+            if (details.length < zoneData.total) {
+                popupContent += `<button class="load-more-points">Carregar mais (${details.length}/${zoneData.total})</button>`;
+            }
+            popupContent += `</div>`;
+            popup.setHTML(popupContent);
+            const loadMoreButton = popup.getElement() && popup.getElement().querySelector('.load-more-points');
+            if (loadMoreButton) {
+                loadMoreButton.addEventListener('click', () => { page += 1; loadPage(); });
+            }
+        } catch (error) {
+            console.error('Falha ao carregar os pontos da zona:', error);
+            popup.setHTML(`<div class="popup-content">${zonePopupHeader(properties)}<div>Erro ao carregar os pontos.</div></div>`);
+        }
+    };
+
+    await loadPage();
 }
\ No newline at end of file
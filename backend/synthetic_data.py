@@ -0,0 +1,183 @@
+import argparse
+import sqlite3
+import numpy as np
+import pandas as pd
+import database
+import process_data
+import rollup
+from config import MAPS_CONFIG, OPERATIONAL_SSID
+
+# --- GERADOR DE DADOS SINTÉTICOS ---
+# Medições realistas para testes de desempenho: cada tablet anda (passeio aleatório)
+# dentro da sua área (Pátio, TMUT ou arredores), o sinal piora perto de "zonas mortas"
+# fixas, e a perda de pacotes e a latência acompanham o sinal fraco.
+DEFAULT_START_DATE = '2025-01-01'
+DEFAULT_DAYS = 30
+DEFAULT_TABLETS = 40
+CHUNK_ROWS = 500_000
+
+# Área de cada tablet: (nome, probabilidade). 'outside' cobre os arredores das duas áreas.
+TABLET_AREAS = [('patio', 0.65), ('tmut', 0.30), ('outside', 0.05)]
+OUTSIDE_BOUNDS = {'lat_top': -3.510, 'lat_bottom': -3.570, 'lon_left': -38.830, 'lon_right': -38.780}
+# Passo médio (graus) entre duas medições seguidas do mesmo tablet.
+STEP_GPS = 0.00008
+DEAD_ZONES_PER_AREA = 6
+DEAD_ZONE_RADIUS_GPS = 0.0006
+
+SSID_MIX = [(OPERATIONAL_SSID, 0.85), ('disconnected', 0.06), ('APM_Guest', 0.04), ('TMUT_Ops', 0.03), ('Vodafone-5G', 0.02)]
+
+# 'HH:MM:SS' de cada segundo do dia: formatar por consulta é muito mais rápido que strftime.
+TIME_OF_DAY_LABELS = np.array([f'{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}' for s in range(86400)])
+
+def area_bounds(area):
+    return OUTSIDE_BOUNDS if area == 'outside' else MAPS_CONFIG[area]
+
+def random_point(rng, bounds, size):
+    lat = rng.uniform(bounds['lat_bottom'], bounds['lat_top'], size)
+    lon = rng.uniform(bounds['lon_left'], bounds['lon_right'], size)
+    return lat, lon
+
+def make_fleet(rng, n_tablets):
+    """Tablets com ID, área de trabalho e posição inicial."""
+    names = [name for name, _ in TABLET_AREAS]
+    areas = rng.choice(names, n_tablets, p=[p for _, p in TABLET_AREAS])
+    lat = np.empty(n_tablets)
+    lon = np.empty(n_tablets)
+    for area in names:
+        mask = areas == area
+        lat[mask], lon[mask] = random_point(rng, area_bounds(area), mask.sum())
+    ids = [f'{value:016x}' for value in rng.integers(0, 2 ** 63, n_tablets)]
+    return {'ids': np.array(ids), 'areas': areas, 'lat': lat, 'lon': lon}
+
+def make_dead_zones(rng):
+    centers = [random_point(rng, area_bounds(area), DEAD_ZONES_PER_AREA) for area in ('patio', 'tmut')]
+    return np.concatenate([c[0] for c in centers]), np.concatenate([c[1] for c in centers])
+
+def _walk(fleet, tablet, rng):
+    """Passeio aleatório de cada tablet (linhas já ordenadas por tablet e hora), preso à sua área."""
+    n = len(tablet)
+    step_lat = rng.normal(0, STEP_GPS, n)
+    step_lon = rng.normal(0, STEP_GPS, n)
+    lat = fleet['lat'][tablet] + pd.Series(step_lat).groupby(tablet).cumsum().to_numpy()
+    lon = fleet['lon'][tablet] + pd.Series(step_lon).groupby(tablet).cumsum().to_numpy()
+    for area in np.unique(fleet['areas']):
+        bounds = area_bounds(area)
+        mask = fleet['areas'][tablet] == area
+        lat[mask] = np.clip(lat[mask], bounds['lat_bottom'], bounds['lat_top'])
+        lon[mask] = np.clip(lon[mask], bounds['lon_left'], bounds['lon_right'])
+    # A última posição de cada tablet é o ponto de partida do próximo bloco.
+    last = np.flatnonzero(np.r_[tablet[1:] != tablet[:-1], True])
+    fleet['lat'][tablet[last]] = lat[last]
+    fleet['lon'][tablet[last]] = lon[last]
+    return lat, lon
+
+def _signal_quality(rng, lat, lon, dead_zones):
+    n = len(lat)
+    zone_lat, zone_lon = dead_zones
+    distance2 = (lat[:, None] - zone_lat[None, :]) ** 2 + (lon[:, None] - zone_lon[None, :]) ** 2
+    penalty = 35 * np.exp(-distance2 / DEAD_ZONE_RADIUS_GPS ** 2).max(axis=1)
+    signal = np.clip(np.round(rng.normal(-62, 8, n) - penalty), -110, -30).astype(int)
+    loss_probability = np.clip((-signal - 70) / 30, 0.02, 0.9)
+    loss_values = rng.choice([1, 2, 5, 10, 20, 50, 100], n, p=[0.3, 0.2, 0.2, 0.12, 0.1, 0.05, 0.03])
+    loss = np.where(rng.random(n) < loss_probability, loss_values, 0).astype(float)
+    latency = np.round(rng.lognormal(np.log(40), 0.6, n) * (1 + penalty / 20)).astype(int)
+    return signal, loss, latency
+
+def generate_chunks(total_rows, seed=0, start_date=DEFAULT_START_DATE, days=DEFAULT_DAYS, n_tablets=DEFAULT_TABLETS, chunk_rows=CHUNK_ROWS):
+    """Gera blocos de medições (colunas de process_data.FINAL_COLUMNS), em ordem de tempo."""
+    rng = np.random.default_rng(seed)
+    fleet = make_fleet(rng, n_tablets)
+    dead_zones = make_dead_zones(rng)
+    start = pd.Timestamp(start_date)
+    total_seconds = days * 86400
+    n_chunks = max(1, -(-total_rows // chunk_rows))
+    for i in range(n_chunks):
+        n = min(chunk_rows, total_rows - i * chunk_rows)
+        slice_start = total_seconds * i // n_chunks
+        slice_end = total_seconds * (i + 1) // n_chunks
+        seconds = rng.integers(slice_start, slice_end, n)
+        tablet = rng.integers(0, n_tablets, n)
+        order = np.lexsort((seconds, tablet))
+        seconds, tablet = seconds[order], tablet[order]
+        lat, lon = _walk(fleet, tablet, rng)
+        signal, loss, latency = _signal_quality(rng, lat, lon, dead_zones)
+        ssid = rng.choice([name for name, _ in SSID_MIX], n, p=[p for _, p in SSID_MIX])
+        chunk = pd.DataFrame({
+            'tablet_android_id': fleet['ids'][tablet],
+            'timestamp': start + pd.to_timedelta(seconds, unit='s'),
+            'signal_dbm': signal,
+            'packet_loss_percent': loss,
+            'latitude': lat.round(6),
+            'longitude': lon.round(6),
+            'current_ssid': ssid,
+            'latency_ms': latency,
+        })
+        yield chunk.sort_values('timestamp', kind='stable').reset_index(drop=True)[process_data.FINAL_COLUMNS]
+
+# --- GRAVAÇÃO ---
+def write_database(path, chunks):
+    """Cria um banco do dashboard com os blocos gerados (índices e rollup incluídos)."""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        database.ensure_schema(conn)
+        total = 0
+        for chunk in chunks:
+            with conn:
+                process_data.insert_rows(conn, chunk)
+            total += len(chunk)
+        database.ensure_indexes(conn)
+        with conn:
+            database.bump_data_version(conn)
+            rollup.rebuild(conn)
+        return total
+    finally:
+        conn.close()
+
+def to_csv_format(chunk):
+    """Converte um bloco para o formato do CSV do coletor (o inverso de process_data.transform_chunk)."""
+    day = chunk['timestamp'].dt.floor('D')
+    days, day_codes = np.unique(day.to_numpy(), return_inverse=True)
+    day_labels = pd.DatetimeIndex(days).strftime('%m-%d-%Y').to_numpy()
+    seconds = ((chunk['timestamp'] - day).dt.total_seconds()).to_numpy().astype(int)
+    return pd.DataFrame({
+        'tablet_android_id': chunk['tablet_android_id'],
+        'data': day_labels[day_codes],
+        'hora': TIME_OF_DAY_LABELS[seconds],
+        'sinal_avg_dbm': chunk['signal_dbm'],
+        'packet_loss_percent': chunk['packet_loss_percent'],
+        'latencia_avg_ms': chunk['latency_ms'],
+        'latitude': chunk['latitude'],
+        'longitude': chunk['longitude'],
+        # O coletor deixa o SSID vazio quando o tablet está desconectado.
+        'current_ssid': chunk['current_ssid'].where(chunk['current_ssid'] != 'disconnected', ''),
+    })
+
+def write_csv(path, chunks, append=False):
+    """Grava (ou acrescenta) os blocos no CSV do coletor. Retorna o nº de linhas."""
+    total = 0
+    for chunk in chunks:
+        to_csv_format(chunk).to_csv(path, index=False, mode='a' if append else 'w', header=not append)
+        append = True
+        total += len(chunk)
+    return total
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gera medições sintéticas para testes de desempenho.")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--db', help="Cria este banco SQLite (schema do dashboard, com índices e rollup).")
+    parser.add_argument('--csv', help="Grava no formato do CSV do coletor (entrada do ETL).")
+    parser.add_argument('--append', action='store_true', help="Acrescenta ao CSV em vez de recriá-lo.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start-date', default=DEFAULT_START_DATE)
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    parser.add_argument('--tablets', type=int, default=DEFAULT_TABLETS)
+    args = parser.parse_args()
+
+    if not args.db and not args.csv:
+        parser.error("Informe --db e/ou --csv.")
+    chunk_args = (args.rows, args.seed, args.start_date, args.days, args.tablets)
+    if args.db:
+        print(f"{write_database(args.db, generate_chunks(*chunk_args))} linhas gravadas em '{args.db}'.")
+    if args.csv:
+        print(f"{write_csv(args.csv, generate_chunks(*chunk_args), append=args.append)} linhas gravadas em '{args.csv}'.")
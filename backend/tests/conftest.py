@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os módulos do backend são importados pelo nome (import analysis), como ao rodar a partir de backend/.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,170 @@
+import math
+import numpy as np
+import pandas as pd
+import analysis
+
+# --- CLASSIFICAÇÃO ---
+def classify_point_status_original(row):
+    """Classificação linha a linha anterior à tabela de regras (referência)."""
+    if row['signal_dbm'] <= -85 or row['packet_loss_percent'] > 3:
+        return 'critical'
+    if row['signal_dbm'] <= -70:
+        return 'attention'
+    return 'good'
+
+def classification_fixture():
+    rng = np.random.default_rng(4)
+    # Valores nos limites das regras, NaN em cada coluna e nas duas, e uma amostra aleatória.
+    edge_signal = [-85, -85.0001, -84.9999, -70, -70.0001, -69.9999, -85, -70, -60, np.nan, np.nan, -90, -75, -60, np.nan]
+    edge_loss = [0, 0, 0, 0, 0, 0, 3, 3, 3, 0, 3.0001, np.nan, np.nan, np.nan, np.nan]
+    signal = np.concatenate([edge_signal, rng.integers(-110, -30, 5000).astype(float)])
+    loss = np.concatenate([edge_loss, rng.choice([0, 1, 2, 3, 3.5, 5, 100], 5000)])
+    return pd.DataFrame({'signal_dbm': signal, 'packet_loss_percent': loss})
+
+def test_classify_status_array_matches_row_wise():
+    df = classification_fixture()
+    expected = df.apply(classify_point_status_original, axis=1)
+    vectorized = analysis.classify_status_array(df['signal_dbm'], df['packet_loss_percent'])
+    assert list(vectorized) == expected.tolist()
+    assert list(vectorized) == df.apply(analysis.classify_point_status, axis=1).tolist()
+    assert vectorized.codes.dtype == np.int8
+
+def test_classify_status_array_edges():
+    signal = [-85, -70, -69, -69, np.nan, np.nan, -90]
+    loss = [0, 3, 3, 3.01, 0, 4, np.nan]
+    status = analysis.classify_status_array(signal, loss)
+    assert list(status) == ['critical', 'attention', 'good', 'critical', 'good', 'critical', 'critical']
+
+def test_classify_points_keeps_rows_and_columns():
+    df = classification_fixture()
+    classified = analysis.classify_points(df)
+    assert 'status' not in df.columns
+    assert classified['status'].tolist() == df.apply(classify_point_status_original, axis=1).tolist()
+    assert list(analysis.classify_points(df.iloc[:0])['status']) == []
+
+# --- MANCHAS DO GRÁFICO ---
+def top_problem_locations_bfs(df):
+    """Agrupamento por BFS anterior ao union-find (referência)."""
+    df_copy = analysis.classify_points(df)
+    problem_points = df_copy[df_copy['status'].isin(['critical', 'attention'])].copy()
+    if problem_points.empty: return []
+    problem_points['grid_lat'] = (problem_points['latitude'] // analysis.GRID_SIZE_GPS).astype(int)
+    problem_points['grid_lon'] = (problem_points['longitude'] // analysis.GRID_SIZE_GPS).astype(int)
+
+    counts = problem_points.groupby(['grid_lat', 'grid_lon', 'status'], observed=True).size().unstack(fill_value=0)
+    if 'critical' not in counts.columns: counts['critical'] = 0
+    if 'attention' not in counts.columns: counts['attention'] = 0
+    counts['total_problems'] = counts['critical'] + counts['attention']
+    counts.reset_index(inplace=True)
+
+    visited = set()
+    clusters = []
+    grid_coords = set(zip(counts['grid_lat'], counts['grid_lon']))
+    for _, grid in counts.iterrows():
+        lat, lon = grid['grid_lat'], grid['grid_lon']
+        if (lat, lon) in visited:
+            continue
+        current_cluster_coords = set()
+        q = [(lat, lon)]
+        visited.add((lat, lon))
+        while q:
+            current_lat, current_lon = q.pop(0)
+            current_cluster_coords.add((current_lat, current_lon))
+            for i in range(-1, 2):
+                for j in range(-1, 2):
+                    if i == 0 and j == 0: continue
+                    neighbor = (current_lat + i, current_lon + j)
+                    if neighbor in grid_coords and neighbor not in visited:
+                        visited.add(neighbor)
+                        q.append(neighbor)
+        clusters.append(current_cluster_coords)
+
+    clustered_data = []
+    for i, cluster_coords in enumerate(clusters):
+        cluster_df = counts[counts.set_index(['grid_lat', 'grid_lon']).index.isin(cluster_coords)]
+        critical_count = cluster_df['critical'].sum()
+        attention_count = cluster_df['attention'].sum()
+        cluster_points = problem_points[problem_points.set_index(['grid_lat', 'grid_lon']).index.isin(cluster_coords)]
+        clustered_data.append({
+            'grid_id': f'{i+1}',
+            'critical_count': int(critical_count),
+            'attention_count': int(attention_count),
+            'total_problems': int(critical_count + attention_count),
+            'lat': cluster_points['latitude'].mean(),
+            'lon': cluster_points['longitude'].mean()
+        })
+    return sorted(clustered_data, key=lambda x: x['total_problems'], reverse=True)[:10]
+
+# Origem da grelha perto do Pátio (coordenadas negativas, como no terminal).
+ORIGIN_LAT, ORIGIN_LON = -14200, -155250
+
+def points_in_cells(cells, rng=None):
+    """Pontos dentro das células (d_lat, d_lon, n_critical, n_attention, n_good) a partir de ORIGIN."""
+    rng = rng or np.random.default_rng(6)
+    rows = []
+    for d_lat, d_lon, *counts in cells:
+        for (signal, loss), n in zip([(-90, 0), (-75, 0), (-60, 0)], counts):
+            offset = rng.uniform(0.1, 0.9, (n, 2)) * analysis.GRID_SIZE_GPS
+            for off_lat, off_lon in offset:
+                rows.append({
+                    'latitude': (ORIGIN_LAT + d_lat) * analysis.GRID_SIZE_GPS + off_lat,
+                    'longitude': (ORIGIN_LON + d_lon) * analysis.GRID_SIZE_GPS + off_lon,
+                    'signal_dbm': signal, 'packet_loss_percent': loss,
+                })
+    return pd.DataFrame(rows)
+
+def assert_same_top(df):
+    expected = top_problem_locations_bfs(df)
+    result = analysis.get_top_problem_locations(df)
+    assert [r['grid_id'] for r in result] == [e['grid_id'] for e in expected]
+    for r, e in zip(result, expected):
+        for key in ('critical_count', 'attention_count', 'total_problems'):
+            assert r[key] == e[key]
+        assert math.isclose(r['lat'], e['lat'], abs_tol=1e-9) and math.isclose(r['lon'], e['lon'], abs_tol=1e-9)
+    return result
+
+def test_top_problems_diagonal_neighbours():
+    # Escada diagonal (uma mancha) e uma célula a duas de distância (outra mancha).
+    cells = [(0, 0, 2, 0, 1), (1, 1, 0, 3, 0), (2, 2, 1, 1, 0), (4, 2, 5, 0, 0), (-1, 1, 0, 1, 4)]
+    result = assert_same_top(points_in_cells(cells))
+    assert [r['total_problems'] for r in result] == [8, 5]
+
+def test_top_problems_bridge_through_one_cell():
+    # Dois braços de um "V" ligados só pela célula do vértice, que é a última na ordem das células,
+    # e um grupo em que (6, 4) e (6, 6) só se ligam através de (5, 5).
+    cells = [(0, 0, 1, 0, 0), (0, 4, 1, 0, 0), (1, 1, 0, 2, 0), (1, 3, 0, 2, 0), (2, 2, 3, 0, 0),
+             (5, 0, 1, 1, 0), (5, 1, 1, 0, 0), (5, 5, 0, 1, 0), (6, 4, 2, 0, 0), (6, 6, 0, 2, 0), (7, 7, 1, 0, 0)]
+    result = assert_same_top(points_in_cells(cells))
+    assert [r['total_problems'] for r in result] == [9, 6, 3]
+
+def test_top_problems_ties_keep_cluster_order():
+    # 14 manchas isoladas com o mesmo total: o top 10 segue a ordem das manchas na grelha.
+    cells = [(3 * i, 3 * (i % 4), 1, 1, 0) for i in range(14)] + [(40, 0, 0, 5, 2)]
+    result = assert_same_top(points_in_cells(cells))
+    assert result[0]['total_problems'] == 5
+    assert [r['total_problems'] for r in result[1:]] == [2] * 9
+
+def test_top_problems_bad_day_with_thousands_of_cells():
+    rng = np.random.default_rng(60)
+    # Cerca de 3000 células com problemas numa área de 120 x 120 células: muitas manchas e algumas grandes.
+    keys = rng.choice(120 * 120, 3000, replace=False)
+    counts = rng.integers(0, 4, (3000, 3))
+    counts[:, 0] += counts[:, 1] == 0
+    cells = [(k // 120, k % 120, *c) for k, c in zip(keys.tolist(), counts.tolist())]
+    df = points_in_cells(cells, rng)
+    problem_cells = analysis.aggregate_status_cells(analysis.classify_points(df).query("status != 'good'"))
+    assert problem_cells[['grid_lat', 'grid_lon']].drop_duplicates().shape[0] == 3000
+    assert_same_top(df)
+
+def test_top_problems_without_problems():
+    df = points_in_cells([(0, 0, 0, 0, 3)])
+    assert analysis.get_top_problem_locations(df) == top_problem_locations_bfs(df) == []
+
+# --- VISTA DO MAPA ---
+def test_grid_view_clips_bbox_to_area():
+    area = (-38.822, -3.556, -38.802, -3.543)
+    view = analysis.grid_view(16, area, area)
+    assert analysis.grid_view(16, (-38.9, -3.6, -38.7, -3.5), area) == view
+    # Sem interseção com a área, fica o bbox pedido.
+    outside = (-38.7, -3.4, -38.69, -3.39)
+    assert analysis.grid_view(16, outside, area) == analysis.grid_view(16, outside)
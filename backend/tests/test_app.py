@@ -0,0 +1,334 @@
+import datetime
+import math
+import sqlite3
+import pandas as pd
+import pytest
+import analysis
+import cache
+import database
+import metrics
+import process_data
+import retention
+import rollup
+import snapshot
+import synthetic_data
+from config import OPERATIONAL_SSID
+
+YESTERDAY = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+
+def open_app(tmp_path, monkeypatch, chunks):
+    """O app sobre um banco sintético (com rollup) em tmp_path, com cache e snapshot vazios."""
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'dashboard.db'))
+    monkeypatch.setattr(rollup, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    monkeypatch.setattr(metrics, 'SLOW_LOG_PATH', str(tmp_path / 'slow_requests.log'))
+    synthetic_data.write_database(database.DB_PATH, chunks)
+    import app
+    cache.clear()
+    snapshot.reset()
+    return app
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    """App sobre um banco sintético de ontem e hoje."""
+    yield open_app(tmp_path, monkeypatch, synthetic_data.generate_chunks(20000, start_date=YESTERDAY, days=2))
+    cache.clear()
+    snapshot.reset()
+
+@pytest.fixture(params=['rollup', 'snapshot'])
+def app(request, app_db, monkeypatch):
+    """app_db respondendo pelo rollup ou pelos pontos do snapshot."""
+    if request.param == 'snapshot':
+        monkeypatch.setattr(rollup, 'is_current', lambda conn=None: False)
+    return app_db
+
+def expanded(area, margin):
+    west, south, east, north = area
+    d_lon, d_lat = (east - west) * margin, (north - south) * margin
+    return f'{west - d_lon},{south - d_lat},{east + d_lon},{north + d_lat}'
+
+def get_json(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+def assert_same_map(a, b):
+    """Mesmas zonas; os centroides podem diferir no último dígito (ordem das somas no SQLite)."""
+    for status in ('good', 'attention', 'critical'):
+        zones_a = {zone['properties']['grid_id']: zone for zone in a[f'{status}_zones']}
+        zones_b = {zone['properties']['grid_id']: zone for zone in b[f'{status}_zones']}
+        assert zones_a.keys() == zones_b.keys()
+        for grid_id, zone in zones_a.items():
+            assert zone['properties'] == zones_b[grid_id]['properties']
+            for x, y in zip(zone['geometry']['coordinates'], zones_b[grid_id]['geometry']['coordinates']):
+                assert math.isclose(x, y, abs_tol=1e-9)
+
+def cached_kinds():
+    return {key[0] for key in cache._entries}
+
+def test_dashboard_with_view_does_not_build_full_map(app):
+    client = app.app.test_client()
+    west, south, east, north = app.map_area('patio')
+    small = f'{west},{south},{(west + east) / 2},{(south + north) / 2}'
+    filters = f'map=patio&start_date={YESTERDAY}&end_date={YESTERDAY}'
+
+    with_view = get_json(client, f'/api/dashboard?{filters}&zoom=16&bbox={small}')
+    assert 'dashboard' not in cached_kinds()
+    assert {'dashboard_summary', 'map_data'} <= cached_kinds()
+    assert with_view['map_data'] == get_json(client, f'/api/map_data?{filters}&zoom=16&bbox={small}')
+
+    full = get_json(client, f'/api/dashboard?{filters}')
+    assert with_view['kpis'] == full['kpis']
+    assert with_view['critical_points'] == full['critical_points']
+    zone_count = lambda map_data: sum(len(map_data[f'{status}_zones']) for status in ('good', 'attention', 'critical'))
+    assert 0 < zone_count(with_view['map_data']) < zone_count(full['map_data'])
+
+    # Uma vista que cobre a área inteira devolve o mesmo mapa que o pedido sem vista.
+    covering = get_json(client, f'/api/dashboard?{filters}&zoom=16&bbox={expanded(app.map_area("patio"), 0.5)}')
+    assert covering['kpis'] == full['kpis'] and covering['critical_points'] == full['critical_points']
+    assert_same_map(covering['map_data'], full['map_data'])
+
+def test_warmup_covers_default_frontend_view(app, monkeypatch):
+    app.warm_default_views()
+
+    def no_compute(*args, **kwargs):
+        raise AssertionError("vista padrão fora do cache")
+
+    monkeypatch.setattr(app.workers, 'run', no_compute)
+    client = app.app.test_client()
+    # Como getViewport() no frontend: a tela (maior que a área) mais a margem, em telas diferentes.
+    for map_name, zoom in app.WARMUP_ZOOM.items():
+        for margin in (0.3, 0.8):
+            bbox = expanded(app.map_area(map_name), margin)
+            data = get_json(client, f'/api/dashboard?map={map_name}&start_date={YESTERDAY}&end_date={YESTERDAY}&ssid_filter=main_network&zoom={zoom}&bbox={bbox}')
+            assert data['map_data']['full'] is True
+
+# --- CACHE HTTP (ETag) ---
+def bump_data_version():
+    conn = database.get_db_connection()
+    with conn:
+        database.bump_data_version(conn)
+    conn.close()
+
+@pytest.mark.parametrize('route', ['/api/kpis', '/api/map_data', '/api/dashboard', '/api/critical_points'])
+def test_conditional_get_returns_304_until_data_version_changes(app_db, route):
+    client = app_db.app.test_client()
+    url = f'{route}?map=patio&start_date={YESTERDAY}&end_date={YESTERDAY}'
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    repeated = client.get(url, headers={'If-None-Match': etag})
+    assert repeated.status_code == 304
+    assert repeated.get_data() == b''
+    assert repeated.headers['ETag'] == etag
+
+    # Outros filtros têm outro ETag.
+    other = client.get(url.replace('map=patio', 'map=tmut'), headers={'If-None-Match': etag})
+    assert other.status_code == 200 and other.headers['ETag'] != etag
+
+    # Nova versão dos dados (ETL): o ETag antigo deixa de valer.
+    bump_data_version()
+    changed = client.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.get_data() != b''
+    assert changed.headers['ETag'] != etag
+    assert client.get(url, headers={'If-None-Match': changed.headers['ETag']}).status_code == 304
+
+# --- ATUALIZAÇÃO INCREMENTAL DO MAPA (since_version) ---
+def ingest_batch(rows):
+    """Grava um lote como o ETL: pontos, nova versão dos dados e rollup na mesma transação."""
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        process_data.insert_chunk(conn, rows[process_data.FINAL_COLUMNS], 0, '', 0)
+    finally:
+        conn.close()
+
+def merge_delta(map_data, delta):
+    """O que o frontend faz em patchMapData: as zonas do delta substituem as de mesmo grid_id."""
+    merged = {'version': delta['version'], 'full': True}
+    for key in ('good_zones', 'attention_zones', 'critical_zones'):
+        zones = {zone['properties']['grid_id']: zone for zone in map_data[key]}
+        zones.update({zone['properties']['grid_id']: zone for zone in delta[key]})
+        merged[key] = list(zones.values())
+    return merged
+
+def test_since_version_delta_merges_into_full_map(app_db):
+    client = app_db.app.test_client()
+    url = f'/api/map_data?map=patio&start_date={YESTERDAY}&end_date={YESTERDAY}'
+    before = get_json(client, url)
+    version = before['version']
+
+    # Pontos críticos em zonas que só tinham pontos bons (a célula ganha uma zona crítica e
+    # a zona boa não muda) e medições novas espalhadas (zonas existentes e células novas).
+    critical_ids = {zone['properties']['grid_id'] for zone in before['critical_zones']}
+    good_only = [zone['properties']['grid_id'] for zone in before['good_zones'] if zone['properties']['grid_id'] not in critical_ids][:10]
+    assert len(good_only) == 10
+    keys = [analysis.parse_grid_id(grid_id) for grid_id in good_only]
+    new_critical = pd.DataFrame({
+        'tablet_android_id': 'abcdef0123456789',
+        'timestamp': pd.Timestamp(f'{YESTERDAY} 12:00:00'),
+        'signal_dbm': -95, 'packet_loss_percent': 0.0,
+        'latitude': [(lat + 0.5) * analysis.GRID_SIZE_GPS for lat, _, _ in keys],
+        'longitude': [(lon + 0.5) * analysis.GRID_SIZE_GPS for _, lon, _ in keys],
+        'current_ssid': OPERATIONAL_SSID, 'latency_ms': 40,
+    })
+    scattered = next(synthetic_data.generate_chunks(2000, seed=12, start_date=YESTERDAY, days=1))
+    ingest_batch(pd.concat([new_critical, scattered], ignore_index=True))
+
+    delta = get_json(client, f'{url}&since_version={version}')
+    assert delta['full'] is False and delta['version'] > version
+    delta_critical = {zone['properties']['grid_id'] for zone in delta['critical_zones']}
+    assert set(good_only) <= delta_critical
+    assert len(delta['good_zones']) < len(before['good_zones'])
+
+    after = get_json(client, url)
+    assert after['full'] is True and after['version'] == delta['version']
+    assert_same_map(merge_delta(before, delta), after)
+    assert set(good_only) <= {zone['properties']['grid_id'] for zone in after['critical_zones']}
+
+def test_unusable_since_version_falls_back_to_full(app_db):
+    client = app_db.app.test_client()
+    url = f'/api/map_data?map=patio&start_date={YESTERDAY}&end_date={YESTERDAY}'
+    full = get_json(client, url)
+    # Anterior à última reconstrução do rollup (rollup_base_version) ou ainda não publicada.
+    for since_version in (full['version'] - 1, full['version'] + 5):
+        data = get_json(client, f'{url}&since_version={since_version}')
+        assert data['full'] is True
+        assert_same_map(data, full)
+    assert client.get(f'{url}&since_version=abc').status_code == 400
+
+# --- ROLLUP INCREMENTAL ---
+def rollup_rows(conn):
+    """Linhas do grid_rollup, sem a versão, com as somas arredondadas (ordem das somas)."""
+    columns = ', '.join(rollup.ROLLUP_KEY)
+    return conn.execute(f"SELECT {columns}, point_count, round(sum_lat, 9), round(sum_lon, 9), min_signal, max_signal FROM grid_rollup ORDER BY {columns}").fetchall()
+
+def test_incremental_rollup_summarizes_stored_values(app_db, monkeypatch):
+    # Valores do CSV que mudam de classe ou de célula ao serem gravados: sinal -84.6 -> -85
+    # (crítico), perda 3.004 -> 3.00 (não crítico) e latitude -3.5500004 -> -3.55.
+    lon = (analysis.grid_keys([0], [-38.81])[1][0] + 0.5) * analysis.GRID_SIZE_GPS
+    edge = pd.DataFrame({
+        'tablet_android_id': 'abcdef0123456789',
+        'timestamp': pd.Timestamp(f'{YESTERDAY} 12:00:00'),
+        'signal_dbm': [-84.6, -60.0], 'packet_loss_percent': [0.0, 3.004],
+        'latitude': -3.5500004, 'longitude': lon,
+        'current_ssid': OPERATIONAL_SSID, 'latency_ms': 40,
+    })
+    assert analysis.grid_keys(edge['latitude'], edge['longitude'])[0][0] != analysis.grid_keys([-3.55], [lon])[0][0]
+    ingest_batch(next(synthetic_data.generate_chunks(2000, seed=21, start_date=YESTERDAY, days=1)))
+    ingest_batch(pd.concat([edge, next(synthetic_data.generate_chunks(2000, seed=22, start_date=YESTERDAY, days=1))], ignore_index=True))
+
+    client = app_db.app.test_client()
+    filters = f'map=patio&start_date={YESTERDAY}&end_date={YESTERDAY}'
+    from_rollup = [get_json(client, f'/api/{route}?{filters}') for route in ('map_data', 'kpis')]
+
+    # As rotas pelos pontos brutos (snapshot) devolvem o mesmo mapa e os mesmos KPIs.
+    cache.clear()
+    snapshot.reset()
+    monkeypatch.setattr(rollup, 'is_current', lambda conn=None: False)
+    from_raw = [get_json(client, f'/api/{route}?{filters}') for route in ('map_data', 'kpis')]
+    assert_same_map(from_rollup[0], from_raw[0])
+    assert from_rollup[1] == from_raw[1]
+    grid_lat, grid_lon = analysis.grid_keys([-3.55], [lon])
+    edge_id = analysis.format_grid_id(grid_lat[0], grid_lon[0])
+    assert edge_id in {zone['properties']['grid_id'] for zone in from_rollup[0]['critical_zones']}
+
+    # E o rollup incremental é igual ao reconstruído a partir de raw_points.
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        incremental = rollup_rows(conn)
+        rollup.rebuild(conn)
+        assert rollup_rows(conn) == incremental
+    finally:
+        conn.close()
+
+# --- RETENÇÃO ---
+RETENTION_KEEP_DAYS = 30
+
+@pytest.fixture
+def history_app(tmp_path, monkeypatch):
+    """App sobre quatro meses de dados, com poucos arquivos anexados por consulta."""
+    monkeypatch.setattr(rollup, 'ARCHIVE_ATTACH_BATCH', 2)
+    start = datetime.date.today() - datetime.timedelta(days=120)
+    yield open_app(tmp_path, monkeypatch, synthetic_data.generate_chunks(40000, start_date=start.isoformat(), days=121))
+    cache.clear()
+    snapshot.reset()
+
+def retention_views(client):
+    """Mapa e KPIs do histórico inteiro e de um mês arquivado, e os detalhes das zonas
+    críticas no período retido."""
+    today = datetime.date.today()
+    first_day = retention.first_kept_day(RETENTION_KEEP_DAYS)
+    old_month = (today - datetime.timedelta(days=90)).strftime('%Y-%m')
+    ranges = {
+        'all': f'start_date={today - datetime.timedelta(days=120)}&end_date={today}',
+        'archived': f'start_date={old_month}-01&end_date={old_month}-28',
+        'kept': f'start_date={first_day}&end_date={today}',
+    }
+    views = {}
+    for name, dates in ranges.items():
+        views[f'map_data {name}'] = get_json(client, f'/api/map_data?map=patio&{dates}')
+        views[f'kpis {name}'] = get_json(client, f'/api/kpis?map=patio&{dates}')
+    for zone in views['map_data kept']['critical_zones'][:5]:
+        grid_id = zone['properties']['grid_id']
+        views[f'zone_points {grid_id}'] = get_json(client, f"/api/zone_points?map=patio&{ranges['kept']}&grid={grid_id}&status=critical&page_size=500")
+    return views
+
+def assert_same_views(a, b):
+    assert a.keys() == b.keys()
+    for name, value in a.items():
+        if name.startswith('map_data'):
+            assert_same_map(value, b[name])
+        else:
+            assert value == b[name], name
+
+def archive_rows():
+    rows = {}
+    for path in rollup.archive_paths():
+        conn = sqlite3.connect(path)
+        try:
+            rows[path] = rollup_rows(conn)
+        finally:
+            conn.close()
+    return rows
+
+def test_retention_keeps_routes_and_is_idempotent(history_app):
+    client = history_app.app.test_client()
+    before = retention_views(client)
+    assert len(before) > 6 and before['kpis archived'] != before['kpis kept']
+    assert all(view['total'] > 0 for name, view in before.items() if name.startswith('zone_points'))
+
+    # Uma execução interrompida depois de gravar os arquivos, com a fila ainda cheia.
+    conn = database.get_db_connection()
+    try:
+        database.ensure_schema(conn)
+        retention.move_to_outbox(conn, retention.first_kept_day(RETENTION_KEEP_DAYS))
+        assert conn.execute("SELECT COUNT(*) FROM grid_rollup_outbox").fetchone()[0] > 0
+        retention.write_archives(conn)
+    finally:
+        conn.close()
+    assert len(rollup.archive_paths()) > rollup.ARCHIVE_ATTACH_BATCH
+
+    retention.run_retention(RETENTION_KEEP_DAYS)
+    conn = database.get_db_connection()
+    try:
+        first_epoch = database.to_epoch_seconds(retention.first_kept_day(RETENTION_KEEP_DAYS))
+        assert conn.execute("SELECT COUNT(*) FROM raw_points WHERE timestamp < ?", (first_epoch,)).fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM grid_rollup_outbox").fetchone()[0] == 0
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == retention.INCREMENTAL_AUTO_VACUUM
+        assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+        state = (database.get_data_version(conn), conn.execute("SELECT COUNT(*) FROM raw_points").fetchone()[0], rollup_rows(conn))
+    finally:
+        conn.close()
+    archived = archive_rows()
+    assert_same_views(retention_views(client), before)
+
+    # Repetir a retenção não muda nada: nem os dados, nem a versão, nem os arquivos.
+    retention.run_retention(RETENTION_KEEP_DAYS)
+    conn = database.get_db_connection()
+    try:
+        assert (database.get_data_version(conn), conn.execute("SELECT COUNT(*) FROM raw_points").fetchone()[0], rollup_rows(conn)) == state
+    finally:
+        conn.close()
+    assert archive_rows() == archived
+    assert_same_views(retention_views(client), before)
@@ -0,0 +1,44 @@
+from werkzeug.test import EnvironBuilder
+import database
+import events
+import synthetic_data
+
+def use_test_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'dashboard.db'))
+    synthetic_data.write_database(database.DB_PATH, synthetic_data.generate_chunks(100))
+
+def call_stream(app):
+    """Chama a aplicação WSGI como o servidor: devolve (status, iterável do corpo), sem percorrê-lo."""
+    status = []
+    body = app.app(EnvironBuilder(path='/api/stream').get_environ(), lambda s, headers, exc_info=None: status.append(s))
+    return status[0], body
+
+def test_stream_slot_released_when_body_never_read(tmp_path, monkeypatch):
+    use_test_database(tmp_path, monkeypatch)
+    import app
+    clients = events._state['clients']
+
+    # Clientes que saem antes do primeiro envio: o servidor fecha a resposta sem a percorrer.
+    for _ in range(events.MAX_CLIENTS + 1):
+        status, body = call_stream(app)
+        assert status.startswith('200')
+        assert events._state['clients'] == clients + 1
+        body.close()
+        assert events._state['clients'] == clients
+
+    # Lido até o primeiro evento, o stream também liberta a vaga ao fechar.
+    status, body = call_stream(app)
+    assert next(iter(body)).decode().startswith('retry:')
+    body.close()
+    assert events._state['clients'] == clients
+
+def test_stream_full_returns_503(tmp_path, monkeypatch):
+    use_test_database(tmp_path, monkeypatch)
+    import app
+    bodies = [call_stream(app)[1] for _ in range(events.MAX_CLIENTS - events._state['clients'])]
+    assert call_stream(app)[0].startswith('503')
+    for body in bodies:
+        body.close()
+    status, body = call_stream(app)
+    assert status.startswith('200')
+    body.close()
@@ -0,0 +1,24 @@
+import io
+import numpy as np
+import pandas as pd
+import database
+import export
+import synthetic_data
+
+def test_csv_keeps_pandas_sort_order_with_missing_ssid(tmp_path, monkeypatch):
+    chunk = next(synthetic_data.generate_chunks(3000, seed=10, start_date='2025-03-01', days=2))
+    # Pontos sem SSID (NULL em raw_points) misturados com os outros.
+    chunk.loc[chunk.index % 7 == 0, 'current_ssid'] = np.nan
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'dashboard.db'))
+    synthetic_data.write_database(database.DB_PATH, [chunk])
+
+    text = b''.join(export.iter_csv('2025-03-01', '2025-03-02', 'all')).decode('utf-8-sig')
+    exported = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False)
+    assert len(exported) == len(chunk)
+    assert (exported['Rede Wi-Fi Conectada'] == '').sum() == chunk['current_ssid'].isna().sum()
+
+    # Ordem do relatório antigo: por dia, sort_values por área, rede (vazios no fim) e hora.
+    exported['Rede'] = exported['Rede Wi-Fi Conectada'].replace('', np.nan)
+    for _, day in exported.groupby('Data', sort=False):
+        expected = day.sort_values(by=['Área', 'Rede', 'Hora'], kind='stable')
+        assert day[['Área', 'Rede Wi-Fi Conectada', 'Hora']].values.tolist() == expected[['Área', 'Rede Wi-Fi Conectada', 'Hora']].values.tolist()
@@ -0,0 +1,138 @@
+import os
+import pytest
+import metrics
+import process_data
+import synthetic_data
+
+# --- MODO CONTÍNUO ---
+class FakeConnection:
+    def close(self):
+        pass
+
+def run_watch(monkeypatch, tmp_path, results, cycles):
+    """Roda watch_log_data por `cycles` intervalos, com ingest_new_data devolvendo `results` em ordem."""
+    csv_path = tmp_path / 'raw_data.csv'
+    csv_path.write_text('tablet_android_id,data\n')
+    calls = []
+    sleeps = []
+
+    def fake_ingest(conn, verbose=True):
+        calls.append(verbose)
+        return results[min(len(calls), len(results)) - 1]
+
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) >= cycles:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(process_data, 'CSV_PATH', str(csv_path))
+    monkeypatch.setattr(process_data, 'open_connection', FakeConnection)
+    monkeypatch.setattr(process_data, 'ingest_new_data', fake_ingest)
+    monkeypatch.setattr(process_data.time, 'sleep', fake_sleep)
+    process_data.watch_log_data(interval_seconds=5)
+    return calls
+
+def test_watch_retries_failed_chunk_without_file_change(monkeypatch, tmp_path):
+    # 1ª passagem falha num bloco; a 2ª (CSV igual) tenta de novo e conclui; a 3ª não tem o que fazer.
+    calls = run_watch(monkeypatch, tmp_path, [(0, False), (0, True)], cycles=3)
+    assert len(calls) == 2
+
+def test_watch_skips_unchanged_file_after_success(monkeypatch, tmp_path):
+    calls = run_watch(monkeypatch, tmp_path, [(0, True)], cycles=3)
+    assert len(calls) == 1
+
+# --- RETOMADA POR OFFSET ---
+@pytest.fixture
+def etl(tmp_path, monkeypatch):
+    """ETL apontado para um CSV e um banco temporários; devolve uma função que ingere e
+    retorna (linhas salvas, total em raw_points, offset gravado)."""
+    monkeypatch.setattr(process_data, 'DB_PATH', str(tmp_path / 'dashboard.db'))
+    monkeypatch.setattr(process_data, 'CSV_PATH', str(tmp_path / 'raw_data.csv'))
+    monkeypatch.setattr(process_data, 'STATE_FILE_PATH', str(tmp_path / '.last_processed_line'))
+    monkeypatch.setattr(metrics, 'ETL_METRICS_PATH', str(tmp_path / 'etl_metrics.prom'))
+
+    def ingest():
+        conn = process_data.open_connection()
+        try:
+            saved, complete = process_data.ingest_new_data(conn, verbose=False)
+            assert complete
+            total = conn.execute("SELECT COUNT(*) FROM raw_points").fetchone()[0]
+            return saved, total, process_data.load_state(conn)[0]
+        finally:
+            conn.close()
+    return ingest
+
+def csv_text(rows, seed=0, start_date='2025-01-01'):
+    """Linhas do CSV do coletor (com cabeçalho), geradas por synthetic_data."""
+    chunk = next(synthetic_data.generate_chunks(rows, seed=seed, start_date=start_date, days=1))
+    return synthetic_data.to_csv_format(chunk).to_csv(index=False)
+
+def data_lines(text):
+    header, *lines = text.splitlines(keepends=True)
+    return header, lines
+
+def test_append_reads_only_new_lines(etl, monkeypatch):
+    # Blocos pequenos: as linhas atravessam o limite entre duas leituras.
+    monkeypatch.setattr(process_data, 'CHUNK_BYTES', 100)
+    header, lines = data_lines(csv_text(150))
+    with open(process_data.CSV_PATH, 'w', newline='') as f:
+        f.write(header + ''.join(lines[:100]))
+    assert etl()[:2] == (100, 100)
+    with open(process_data.CSV_PATH, 'a', newline='') as f:
+        f.write(''.join(lines[100:]))
+    saved, total, offset = etl()
+    assert (saved, total, offset) == (50, 150, os.path.getsize(process_data.CSV_PATH))
+    assert etl()[:2] == (0, 150)
+
+def test_truncated_file_restarts_from_beginning(etl):
+    header, lines = data_lines(csv_text(100))
+    with open(process_data.CSV_PATH, 'w', newline='') as f:
+        f.write(header + ''.join(lines))
+    etl()
+    # O coletor recomeça o arquivo: menor que o offset gravado.
+    with open(process_data.CSV_PATH, 'w', newline='') as f:
+        f.write(header + ''.join(lines[:30]))
+    assert etl() == (30, 130, os.path.getsize(process_data.CSV_PATH))
+
+def test_rotated_file_restarts_from_beginning(etl):
+    header, lines = data_lines(csv_text(100))
+    with open(process_data.CSV_PATH, 'w', newline='') as f:
+        f.write(header + ''.join(lines))
+    etl()
+    # Outro arquivo, maior que o offset gravado, mas com outro início (fingerprint diferente).
+    new_header, new_lines = data_lines(csv_text(200, seed=1, start_date='2025-01-02'))
+    with open(process_data.CSV_PATH, 'w', newline='') as f:
+        f.write(new_header + ''.join(new_lines))
+    assert etl() == (200, 300, os.path.getsize(process_data.CSV_PATH))
+
+def test_partial_last_line_waits_for_next_run(etl):
+    header, lines = data_lines(csv_text(20))
+    last = lines[-1]
+    cut = len(last) // 2
+    with open(process_data.CSV_PATH, 'w', newline='') as f:
+        f.write(header + ''.join(lines[:-1]) + last[:cut])
+    saved, total, offset = etl()
+    assert (saved, total) == (19, 19)
+    assert offset == os.path.getsize(process_data.CSV_PATH) - cut
+    # O coletor termina a linha: ela é lida inteira na execução seguinte.
+    with open(process_data.CSV_PATH, 'a', newline='') as f:
+        f.write(last[cut:])
+    assert etl() == (1, 20, os.path.getsize(process_data.CSV_PATH))
+    conn = process_data.open_connection()
+    signal = conn.execute("SELECT signal_dbm FROM raw_points ORDER BY rowid DESC LIMIT 1").fetchone()[0]
+    conn.close()
+    assert signal == int(last.split(',')[3])
+
+def test_legacy_line_state_migrates_to_byte_offset(etl):
+    header, lines = data_lines(csv_text(50))
+    with open(process_data.CSV_PATH, 'w', newline='') as f:
+        f.write(header + ''.join(lines))
+    with open(process_data.STATE_FILE_PATH, 'w') as f:
+        f.write('35\n')
+    conn = process_data.open_connection()
+    expected = len((header + ''.join(lines[:35])).encode('utf-8'))
+    assert process_data.resolve_start_offset(conn, process_data.CSV_PATH, os.path.getsize(process_data.CSV_PATH)) == expected
+    conn.close()
+    assert etl() == (15, 15, os.path.getsize(process_data.CSV_PATH))
+    # Depois da migração vale o offset gravado no banco, não o arquivo legado.
+    assert etl()[:2] == (0, 15)
@@ -0,0 +1,43 @@
+import threading
+import time
+import pytest
+import workers
+
+def test_abandoned_run_calls_on_abandon_after_fn_finishes():
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        release.wait(5)
+        calls.append('fn')
+
+    abandoned = threading.Event()
+    with pytest.raises(TimeoutError):
+        workers.run(slow, pool=workers.EXPORT_POOL, timeout=0.05,
+                    on_abandon=lambda: (calls.append('abandon'), abandoned.set()))
+    # O pedido desistiu, mas o worker ainda está a usar o recurso.
+    assert calls == []
+    release.set()
+    assert abandoned.wait(5)
+    assert calls == ['fn', 'abandon']
+
+def test_expiry_never_sees_terminal_status_without_finished(monkeypatch):
+    release = threading.Event()
+    job_id = workers.start_job(lambda path: release.wait(5), 'x.xlsx', 'application/octet-stream')
+    try:
+        # Um job em andamento não expira, mesmo com TTL zero.
+        monkeypatch.setattr(workers, 'JOB_TTL_SECONDS', -1)
+        workers._remove_expired_jobs()
+        assert workers.get_job(job_id) is not None
+    finally:
+        release.set()
+
+    # Uma leitura nunca encontra estado final sem 'finished'.
+    deadline = time.time() + 5
+    job = workers.get_job(job_id)
+    while job['status'] not in ('done', 'error') and time.time() < deadline:
+        time.sleep(0.01)
+        job = workers.get_job(job_id)
+    assert job['status'] == 'done' and job['finished'] is not None
+    workers._remove_expired_jobs()
+    assert workers.get_job(job_id) is None
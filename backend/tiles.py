@@ -0,0 +1,71 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# --- TILES DO MAPA (MBTILES) ---
+# Os tiles de satélite ficam num único arquivo MBTiles (gerado por tiles_download/).
+# A pasta antiga static/tiles/z/x/y.png ainda é lida para os tiles que faltarem nele.
+MBTILES_PATH = 'db/tiles.mbtiles'
+LEGACY_TILES_DIR = 'static/tiles'
+# Tiles mais pedidos mantidos em memória (um tile de satélite tem ~10-40 KB).
+CACHE_MAX_TILES = 4096
+# Os tiles não mudam: o navegador pode guardá-los por um ano sem revalidar.
+CACHE_MAX_AGE_SECONDS = 365 * 24 * 3600
+
+_local = threading.local()
+_cache_lock = threading.Lock()
+_cache = OrderedDict()  # (z, x, y) -> (dados, etag)
+
+def _connection():
+    """Conexão somente-leitura ao MBTiles, uma por thread (None se o arquivo não existir)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None and os.path.exists(MBTILES_PATH):
+        conn = sqlite3.connect(f'file:{MBTILES_PATH}?mode=ro', uri=True)
+        _local.conn = conn
+    return conn
+
+def tms_row(zoom, y):
+    """Converte o y do esquema XYZ (usado nas URLs) para o tile_row do MBTiles."""
+    return (1 << zoom) - 1 - y
+
+def _read_tile(z, x, y):
+    conn = _connection()
+    if conn is not None:
+        row = conn.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, tms_row(z, y))
+        ).fetchone()
+        if row:
+            return bytes(row[0])
+    path = os.path.join(LEGACY_TILES_DIR, str(z), str(x), f'{y}.png')
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    return None
+
+def get_tile(z, x, y):
+    """Retorna (dados, etag) do tile, ou None se ele não existir."""
+    key = (z, x, y)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    data = _read_tile(z, x, y)
+    if data is None:
+        return None
+    entry = (data, hashlib.sha1(data).hexdigest())
+    with _cache_lock:
+        _cache[key] = entry
+        while len(_cache) > CACHE_MAX_TILES:
+            _cache.popitem(last=False)
+    return entry
+
+def tile_mimetype(data):
+    """O Mapbox pode devolver JPEG mesmo com a extensão .png: usa a assinatura do arquivo."""
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/png'
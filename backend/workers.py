@@ -0,0 +1,126 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+
+# --- POOL DE TRABALHO ---
+# As análises (pandas/numpy/SQLite, que liberam o GIL nas partes pesadas) e as exportações
+# rodam em pools de threads separados, com fila limitada. Threads, e não processos, para
+# que o snapshot em memória continue a ser um só para o servidor inteiro.
+ANALYSIS_WORKERS = 4
+ANALYSIS_QUEUE = 8
+REQUEST_TIMEOUT_SECONDS = 60
+
+EXPORT_WORKERS = 2
+EXPORT_QUEUE = 4
+EXPORT_TIMEOUT_SECONDS = 300
+
+# Sugestão (Retry-After) enviada ao cliente quando a fila está cheia.
+RETRY_AFTER_SECONDS = 5
+
+# Arquivos das exportações assíncronas ficam disponíveis por este tempo.
+JOB_TTL_SECONDS = 3600
+
+class Saturated(Exception):
+    """Fila do pool cheia: o pedido deve ser repetido mais tarde."""
+
+def _bounded_pool(workers, queue_depth, name):
+    return {
+        'executor': ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name),
+        'slots': threading.BoundedSemaphore(workers + queue_depth),
+    }
+
+ANALYSIS_POOL = _bounded_pool(ANALYSIS_WORKERS, ANALYSIS_QUEUE, 'analysis')
+EXPORT_POOL = _bounded_pool(EXPORT_WORKERS, EXPORT_QUEUE, 'export')
+
+def submit(pool, fn, *args, **kwargs):
+    """Coloca fn na fila do pool. Levanta Saturated se não houver vaga."""
+    if not pool['slots'].acquire(blocking=False):
+        raise Saturated()
+    try:
+        future = pool['executor'].submit(fn, *args, **kwargs)
+    except Exception:
+        pool['slots'].release()
+        raise
+    future.add_done_callback(lambda _: pool['slots'].release())
+    return future
+
+def run(fn, *args, pool=ANALYSIS_POOL, timeout=None, on_abandon=None, **kwargs):
+    """Executa fn no pool e espera o resultado (TimeoutError se passar de `timeout`,
+    por padrão REQUEST_TIMEOUT_SECONDS). Se o pedido desistir por timeout, on_abandon()
+    é chamado quando fn terminar, para liberar o que ela ainda estava a usar."""
+    # As etapas medidas no pool (metrics.stage) contam no pedido que está à espera.
+    future = submit(pool, metrics.bind(fn), *args, **kwargs)
+    try:
+        return future.result(timeout=timeout or REQUEST_TIMEOUT_SECONDS)
+    except TimeoutError:
+        if on_abandon is not None:
+            future.add_done_callback(lambda _: on_abandon())
+        raise
+
+# --- EXPORTAÇÕES ASSÍNCRONAS ---
+_jobs_lock = threading.Lock()
+_jobs = {}
+_jobs_dir = {'path': None}
+
+def _job_path(job_id):
+    with _jobs_lock:
+        if _jobs_dir['path'] is None:
+            _jobs_dir['path'] = tempfile.mkdtemp(prefix='dashboard-export-')
+        return os.path.join(_jobs_dir['path'], job_id)
+
+def _remove_expired_jobs():
+    now = time.time()
+    with _jobs_lock:
+        # 'finished' é gravado antes do estado final; None é um job ainda em andamento.
+        expired = [job for job in _jobs.values() if job['finished'] is not None and now - job['finished'] > JOB_TTL_SECONDS]
+        for job in expired:
+            del _jobs[job['id']]
+    for job in expired:
+        if os.path.exists(job['path']):
+            os.remove(job['path'])
+
+def start_job(write_file, file_name, mimetype):
+    """Agenda write_file(caminho) no pool de exportação e retorna o id do job."""
+    _remove_expired_jobs()
+    job_id = uuid.uuid4().hex
+    job = {
+        'id': job_id, 'status': 'queued', 'file_name': file_name, 'mimetype': mimetype,
+        'path': _job_path(job_id), 'error': None, 'created': time.time(), 'finished': None,
+    }
+
+    def finish(status, error=None):
+        with _jobs_lock:
+            job['finished'] = time.time()
+            job['error'] = error
+            job['status'] = status
+
+    def task():
+        job['status'] = 'running'
+        try:
+            write_file(job['path'])
+        except Exception as e:
+            if os.path.exists(job['path']):
+                os.remove(job['path'])
+            finish('error', str(e))
+        else:
+            finish('done')
+
+    with _jobs_lock:
+        _jobs[job_id] = job
+    try:
+        submit(EXPORT_POOL, task)
+    except Saturated:
+        with _jobs_lock:
+            del _jobs[job_id]
+        raise
+    return job_id
+
+def get_job(job_id):
+    """Cópia do estado do job, ou None se não existir (ou já tiver expirado)."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
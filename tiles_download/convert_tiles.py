@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+import mbtiles
+
+# --- CONVERSOR: PASTA tiles/z/x/y.png -> ARQUIVO MBTILES ---
+DEFAULT_TILES_DIR = "tiles"
+DEFAULT_MBTILES_PATH = "tiles.mbtiles"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa uma pasta de tiles (z/x/y.png) para um arquivo MBTiles.")
+    parser.add_argument('tiles_dir', nargs='?', default=DEFAULT_TILES_DIR, help="Pasta de origem (z/x/y.png).")
+    parser.add_argument('mbtiles_path', nargs='?', default=DEFAULT_MBTILES_PATH, help="Arquivo MBTiles de destino (criado se não existir).")
+    parser.add_argument('--name', default="Mapa de satélite do terminal", help="Nome gravado nos metadados.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.tiles_dir):
+        print(f"ERRO: Pasta '{args.tiles_dir}' não encontrada.")
+        sys.exit(1)
+
+    print(f"Importando '{args.tiles_dir}' para '{args.mbtiles_path}'...")
+    conn = mbtiles.open_mbtiles(args.mbtiles_path, {'name': args.name, 'format': 'png', 'type': 'baselayer'})
+    try:
+        imported = mbtiles.import_directory(conn, args.tiles_dir)
+        min_zoom, max_zoom = mbtiles.zoom_range(conn)
+        if min_zoom is not None:
+            mbtiles.set_metadata(conn, {'minzoom': min_zoom, 'maxzoom': max_zoom})
+    finally:
+        conn.close()
+    print(f"Importação concluída: {imported} tiles.")
@@ -1,26 +1,47 @@
+import argparse
 import math
 import os
-import requests
+import random
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+import mbtiles
 
 load_dotenv()
 ACCESS_TOKEN = os.getenv("MAPBOX_ACCESS_TOKEN")
 
-if not ACCESS_TOKEN:
-    print("ERRO: A chave MAPBOX_ACCESS_TOKEN não foi encontrada no ficheiro .env!")
-    exit()
-
 LAT_MIN = -3.560
 LAT_MAX = -3.520
 LON_MIN = -38.825
 LON_MAX = -38.792
 
-ZOOM_LEVELS = range(15, 20) 
+ZOOM_LEVELS = range(15, 20)
 
 MAP_STYLE = "satellite-v9"
 
-OUTPUT_DIR = "tiles"
+# Placeholders: {z}, {x}, {y} e {token}. Pode apontar para um servidor de tiles local (testes).
+URL_TEMPLATE = f"https://api.mapbox.com/styles/v1/mapbox/{MAP_STYLE}/tiles/{{z}}/{{x}}/{{y}}?access_token={{token}}"
+
+# Arquivo MBTiles de saída (copie-o para backend/db/ no servidor).
+OUTPUT_MBTILES = "tiles.mbtiles"
+# Tiles gravados por transação.
+COMMIT_EVERY = 100
+
+# --- CONCORRÊNCIA, LIMITE DE TAXA E NOVAS TENTATIVAS ---
+WORKERS = 8
+# Pedidos por segundo (token bucket), com rajadas de até RATE_BURST pedidos.
+RATE_PER_SECOND = 20
+RATE_BURST = 10
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30
+REQUEST_TIMEOUT_SECONDS = 10
+# Respostas que valem nova tentativa; outros erros HTTP são definitivos (p. ex. 404, 401).
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
 TILES_EXTRA = [
     (16, 25706, 33411), (16, 25707, 33410), (16, 25706, 33409),
@@ -34,6 +55,21 @@ TILES_EXTRA = [
     (18, 102815, 133636), (18, 102816, 133637), (18, 102819, 133637),
 ]
 
+# --- MANIFESTO (no próprio MBTiles) ---
+# Guarda o resultado de cada tile: uma execução interrompida retoma sem refazer nada,
+# e os tiles que falharam ficam registrados com o último erro.
+CREATE_MANIFEST_SQL = """
+CREATE TABLE IF NOT EXISTS download_manifest (
+    zoom INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (zoom, x, y)
+)
+"""
 
 def deg_to_tile(lat_deg, lon_deg, zoom):
     lat_rad = math.radians(lat_deg)
@@ -42,62 +78,204 @@ def deg_to_tile(lat_deg, lon_deg, zoom):
     ytile = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
     return (xtile, ytile)
 
+def tiles_in_bbox(lat_min, lat_max, lon_min, lon_max, zoom_levels):
+    tiles = set()
+    for zoom in zoom_levels:
+        x_start, y_start = deg_to_tile(lat_max, lon_min, zoom)
+        x_end, y_end = deg_to_tile(lat_min, lon_max, zoom)
+        for x in range(x_start, x_end + 1):
+            for y in range(y_start, y_end + 1):
+                tiles.add((zoom, x, y))
+    return tiles
+
+def load_manifest(conn):
+    """Retorna (tiles concluídos, tiles que falharam) gravados no manifesto."""
+    conn.execute(CREATE_MANIFEST_SQL)
+    done, failed = set(), set()
+    for zoom, x, y, status in conn.execute("SELECT zoom, x, y, status FROM download_manifest").fetchall():
+        (done if status == 'done' else failed).add((zoom, x, y))
+    return done, failed
+
+def select_tiles(conn, tiles, skip_failed=False):
+    """Tiles ainda por baixar (ordenados): tira os já concluídos no manifesto ou no MBTiles e,
+    com skip_failed, os que falharam antes. Retorna (tiles, quantos deles já falharam)."""
+    done, failed = load_manifest(conn)
+    skipped = done | mbtiles.existing_tiles(conn)
+    if skip_failed:
+        skipped |= failed
+    pending = sorted(set(tiles) - skipped)
+    return pending, len(failed.intersection(pending))
+
+def record_result(conn, tile, status, attempts, error=None):
+    """Registra o resultado de um tile no manifesto (sem commit)."""
+    conn.execute(
+        "INSERT INTO download_manifest (zoom, x, y, status, attempts, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(zoom, x, y) DO UPDATE SET status = excluded.status, attempts = excluded.attempts, "
+        "error = excluded.error, updated_at = excluded.updated_at",
+        (*tile, status, attempts, error, time.time())
+    )
+
+# --- LIMITE DE TAXA (TOKEN BUCKET) ---
+def make_rate_limiter(rate_per_second, burst):
+    """Retorna uma função que bloqueia até haver uma "ficha" disponível (compartilhada pelas threads)."""
+    lock = threading.Lock()
+    bucket = {'tokens': float(burst), 'updated': time.monotonic()}
+
+    def acquire():
+        while True:
+            with lock:
+                now = time.monotonic()
+                bucket['tokens'] = min(burst, bucket['tokens'] + (now - bucket['updated']) * rate_per_second)
+                bucket['updated'] = now
+                if bucket['tokens'] >= 1:
+                    bucket['tokens'] -= 1
+                    return
+                wait_seconds = (1 - bucket['tokens']) / rate_per_second
+            time.sleep(wait_seconds)
+
+    return acquire
+
+# --- DOWNLOAD ---
+def make_session(workers):
+    """Session com pool de conexões do tamanho do pool de threads (keep-alive entre pedidos)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def backoff_seconds(attempt, retry_after=None):
+    """Espera exponencial com jitter; respeita o Retry-After do servidor quando houver."""
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_MAX_SECONDS)
+    return min(BACKOFF_BASE_SECONDS * (2 ** attempt), BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1.0)
+
+def fetch_tile(session, url_template, tile, acquire_token, max_retries):
+    """Baixa um tile com novas tentativas. Retorna (tile, dados, tentativas, erro)."""
+    zoom, x, y = tile
+    url = url_template.format(z=zoom, x=x, y=y, token=ACCESS_TOKEN)
+    error = None
+    for attempt in range(max_retries + 1):
+        acquire_token()
+        retry_after = None
+        try:
+            response = session.get(url, timeout=REQUEST_TIMEOUT_SECONDS)
+            if response.status_code == 200:
+                return tile, response.content, attempt + 1, None
+            error = f"HTTP {response.status_code}"
+            if response.status_code not in RETRY_STATUS:
+                return tile, None, attempt + 1, error
+            retry_after = response.headers.get('Retry-After')
+        except requests.exceptions.RequestException as e:
+            error = str(e)
+        if attempt < max_retries:
+            time.sleep(backoff_seconds(attempt, retry_after))
+    return tile, None, max_retries + 1, error
+
+def download_tiles(conn, tiles, url_template, workers, rate_per_second, max_retries):
+    """Baixa os tiles em paralelo; a gravação (tiles + manifesto) fica na thread principal.
+
+    Retorna (baixados, falhas).
+    """
+    session = make_session(workers)
+    acquire_token = make_rate_limiter(rate_per_second, RATE_BURST)
+    pending_tiles = iter(tiles)
+    total = len(tiles)
+    downloaded_count, failed_count, since_commit = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # No máximo 4 pedidos por thread em andamento: a memória não cresce com o total de tiles.
+        in_flight = set()
+        while True:
+            while len(in_flight) < workers * 4:
+                tile = next(pending_tiles, None)
+                if tile is None:
+                    break
+                in_flight.add(executor.submit(fetch_tile, session, url_template, tile, acquire_token, max_retries))
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                tile, data, attempts, error = future.result()
+                if data is not None:
+                    mbtiles.put_tile(conn, *tile, data)
+                    record_result(conn, tile, 'done', attempts)
+                    downloaded_count += 1
+                else:
+                    record_result(conn, tile, 'failed', attempts, error)
+                    failed_count += 1
+                    print(f"\nErro ao baixar o tile {tile[0]}/{tile[1]}/{tile[2]} após {attempts} tentativas: {error}")
+                since_commit += 1
+                if since_commit >= COMMIT_EVERY:
+                    conn.commit()
+                    since_commit = 0
+            progress = ((downloaded_count + failed_count) / total) * 100
+            print(f"Progresso: {progress:.2f}% ({downloaded_count + failed_count}/{total}, {failed_count} falhas)", end='\r')
+    conn.commit()
+    session.close()
+    return downloaded_count, failed_count
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Baixa os tiles de satélite da área do terminal para um arquivo MBTiles.")
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'),
+                        default=[LAT_MIN, LAT_MAX, LON_MIN, LON_MAX], help="Área a baixar.")
+    parser.add_argument('--min-zoom', type=int, default=min(ZOOM_LEVELS))
+    parser.add_argument('--max-zoom', type=int, default=max(ZOOM_LEVELS))
+    parser.add_argument('--no-extra-tiles', action='store_true', help="Não inclui a lista fixa TILES_EXTRA.")
+    parser.add_argument('--url-template', default=URL_TEMPLATE, help="URL dos tiles com {z}, {x}, {y} e, opcionalmente, {token}.")
+    parser.add_argument('--output', default=OUTPUT_MBTILES, help="Arquivo MBTiles de saída.")
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--rate', type=float, default=RATE_PER_SECOND, help="Máximo de pedidos por segundo.")
+    parser.add_argument('--retries', type=int, default=MAX_RETRIES)
+    parser.add_argument('--skip-failed', action='store_true', help="Não tenta de novo os tiles que falharam em execuções anteriores.")
+    parser.add_argument('--yes', action='store_true', help="Não pede confirmação.")
+    args = parser.parse_args()
+
+    if '{token}' in args.url_template and not ACCESS_TOKEN:
+        print("ERRO: A chave MAPBOX_ACCESS_TOKEN não foi encontrada no ficheiro .env!")
+        sys.exit(1)
+
     print("Iniciando o download dos tiles do mapa...")
-    
-    tiles_to_download_set = set()
 
+    lat_min, lat_max, lon_min, lon_max = args.bbox
+    zoom_levels = range(args.min_zoom, args.max_zoom + 1)
     print("Calculando tiles da área geográfica...")
-    for zoom in ZOOM_LEVELS:
-        top_left = deg_to_tile(LAT_MAX, LON_MIN, zoom)
-        bottom_right = deg_to_tile(LAT_MIN, LON_MAX, zoom)
-        x_start, y_start = top_left
-        x_end, y_end = bottom_right
-        
-        for x in range(x_start, x_end + 1):
-            for y in range(y_start, y_end + 1):
-                tiles_to_download_set.add((zoom, x, y))
+    tiles_to_download_set = tiles_in_bbox(lat_min, lat_max, lon_min, lon_max, zoom_levels)
 
-    print(f"Adicionando {len(TILES_EXTRA)} tiles específicos à lista.")
-    for tile in TILES_EXTRA:
-        tiles_to_download_set.add(tile)
+    if not args.no_extra_tiles:
+        print(f"Adicionando {len(TILES_EXTRA)} tiles específicos à lista.")
+        tiles_to_download_set.update(TILES_EXTRA)
 
-    tiles_to_process = [t for t in tiles_to_download_set if not os.path.exists(os.path.join(OUTPUT_DIR, str(t[0]), str(t[1]), f"{t[2]}.png"))]
+    conn = mbtiles.open_mbtiles(args.output, {
+        'name': f"Mapbox {MAP_STYLE}", 'format': 'png', 'type': 'baselayer',
+        'bounds': f"{lon_min},{lat_min},{lon_max},{lat_max}",
+        'minzoom': args.min_zoom, 'maxzoom': args.max_zoom,
+    })
+    tiles_to_process, retrying = select_tiles(conn, tiles_to_download_set, args.skip_failed)
     total_to_download = len(tiles_to_process)
 
     if total_to_download == 0:
-        print("Nenhum tile novo para baixar. A sua pasta 'tiles' já está completa.")
-        exit()
-
-    print(f"\nTotal de tiles a serem baixados: {total_to_download}")
-    confirm = input("Deseja continuar? (s/n): ")
-
-    if confirm.lower() != 's':
-        print("Download cancelado.")
-        exit()
-
-    downloaded_count = 0
-    for zoom, x, y in tiles_to_process:
-        tile_url = f"https://api.mapbox.com/styles/v1/mapbox/{MAP_STYLE}/tiles/{zoom}/{x}/{y}?access_token={ACCESS_TOKEN}"
-        output_path = os.path.join(OUTPUT_DIR, str(zoom), str(x), f"{y}.png")
-        
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
-        try:
-            response = requests.get(tile_url, stream=True, timeout=10)
-            response.raise_for_status()
-            
-            with open(output_path, 'wb') as f:
-                f.write(response.content)
-            
-            downloaded_count += 1
-            progress = (downloaded_count / total_to_download) * 100
-            print(f"Progresso: {progress:.2f}% ({downloaded_count}/{total_to_download})", end='\r')
-            
-            time.sleep(0.05)
+        print(f"Nenhum tile novo para baixar. O arquivo '{args.output}' já está completo.")
+        conn.close()
+        sys.exit()
 
-        except requests.exceptions.RequestException as e:
-            print(f"\nErro ao baixar o tile {zoom}/{x}/{y}: {e}")
+    print(f"\nTotal de tiles a serem baixados: {total_to_download}" + (f" ({retrying} que falharam antes)" if retrying else ""))
+    if not args.yes:
+        confirm = input("Deseja continuar? (s/n): ")
+        if confirm.lower() != 's':
+            print("Download cancelado.")
+            conn.close()
+            sys.exit()
+
+    try:
+        downloaded_count, failed_count = download_tiles(conn, tiles_to_process, args.url_template, args.workers, args.rate, args.retries)
+    except KeyboardInterrupt:
+        conn.commit()
+        print("\nDownload interrompido. Execute novamente para continuar de onde parou.")
+        sys.exit(1)
+    finally:
+        conn.close()
 
-    print("\nDownload concluído com sucesso!")
\ No newline at end of file
+    if failed_count:
+        print(f"\nDownload concluído: {downloaded_count} tiles baixados, {failed_count} falharam (serão tentados de novo na próxima execução).")
+    else:
+        print("\nDownload concluído com sucesso!")
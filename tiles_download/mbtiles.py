@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import sys
+
+# O servidor (backend/tiles.py) lê estes arquivos; a conversão de linhas fica num só lugar.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+from tiles import tms_row
+
+# --- ARMAZENAMENTO MBTILES ---
+# Todos os tiles num único arquivo SQLite (especificação MBTiles 1.3). As linhas
+# seguem o esquema TMS: tile_row é o y do XYZ invertido.
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+"""
+
+# Tiles gravados por transação na importação de pastas.
+IMPORT_BATCH_TILES = 500
+
+def open_mbtiles(path, metadata=None):
+    """Abre (criando se preciso) o arquivo MBTiles e grava os metadados informados."""
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA_SQL)
+    if metadata:
+        set_metadata(conn, metadata)
+    return conn
+
+def set_metadata(conn, metadata):
+    with conn:
+        conn.executemany(
+            "INSERT INTO metadata (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            [(name, str(value)) for name, value in metadata.items()]
+        )
+
+def put_tile(conn, zoom, x, y, data):
+    """Grava um tile (coordenadas XYZ). Sem commit: o chamador agrupa em transações."""
+    conn.execute(
+        "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+        (zoom, x, tms_row(zoom, y), sqlite3.Binary(data))
+    )
+
+def existing_tiles(conn):
+    """Conjunto de (zoom, x, y) XYZ já gravados, numa única consulta."""
+    rows = conn.execute("SELECT zoom_level, tile_column, tile_row FROM tiles").fetchall()
+    return {(zoom, x, tms_row(zoom, row)) for zoom, x, row in rows}
+
+def zoom_range(conn):
+    return conn.execute("SELECT MIN(zoom_level), MAX(zoom_level) FROM tiles").fetchone()
+
+def iter_directory_tiles(tiles_dir):
+    """Percorre uma pasta tiles/z/x/y.png e gera (zoom, x, y, caminho)."""
+    for zoom_name in os.listdir(tiles_dir):
+        zoom_dir = os.path.join(tiles_dir, zoom_name)
+        if not zoom_name.isdigit() or not os.path.isdir(zoom_dir):
+            continue
+        for x_name in os.listdir(zoom_dir):
+            x_dir = os.path.join(zoom_dir, x_name)
+            if not x_name.isdigit() or not os.path.isdir(x_dir):
+                continue
+            for file_name in os.listdir(x_dir):
+                y_name, extension = os.path.splitext(file_name)
+                if y_name.isdigit() and extension.lower() in ('.png', '.jpg', '.jpeg', '.webp'):
+                    yield int(zoom_name), int(x_name), int(y_name), os.path.join(x_dir, file_name)
+
+def import_directory(conn, tiles_dir):
+    """Importa uma pasta tiles/z/x/y.png para o MBTiles. Retorna o nº de tiles importados."""
+    imported = 0
+    batch = []
+    for zoom, x, y, path in iter_directory_tiles(tiles_dir):
+        with open(path, 'rb') as f:
+            batch.append((zoom, x, y, f.read()))
+        if len(batch) >= IMPORT_BATCH_TILES:
+            imported += _write_batch(conn, batch)
+            batch = []
+    if batch:
+        imported += _write_batch(conn, batch)
+    return imported
+
+def _write_batch(conn, batch):
+    with conn:
+        for zoom, x, y, data in batch:
+            put_tile(conn, zoom, x, y, data)
+    return len(batch)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os scripts de tiles_download/ importam-se pelo nome (import mbtiles), como ao rodar a partir da pasta.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,105 @@
+import collections
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import download_tiles
+import mbtiles
+
+# --- SERVIDOR DE TILES LOCAL ---
+OK, FLAKY, MISSING, DOWN = (16, 1, 1), (16, 1, 2), (16, 1, 3), (16, 1, 4)
+# Respostas por tile; a última repete-se. FLAKY falha duas vezes (503) antes de responder.
+RESPONSES = {OK: [200], FLAKY: [503, 503, 200], MISSING: [404], DOWN: [503]}
+
+def tile_bytes(tile):
+    return f"png {tile[0]}/{tile[1]}/{tile[2]}".encode()
+
+@pytest.fixture
+def tile_server():
+    """Servidor HTTP em localhost que conta os pedidos por tile. Devolve (URL dos tiles, contagens)."""
+    requests_per_tile = collections.Counter()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            tile = tuple(int(part) for part in self.path.split('?')[0].removesuffix('.png').strip('/').split('/'))
+            with lock:
+                requests_per_tile[tile] += 1
+                responses = RESPONSES.get(tile, [404])
+                status = responses[min(requests_per_tile[tile], len(responses)) - 1]
+            body = tile_bytes(tile) if status == 200 else b''
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/{{z}}/{{x}}/{{y}}.png", requests_per_tile
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """Regista as esperas pedidas entre tentativas (attempt, Retry-After) e encurta-as."""
+    calls = []
+    original = download_tiles.backoff_seconds
+
+    def fake_backoff(attempt, retry_after=None):
+        calls.append(attempt)
+        assert original(attempt, retry_after) >= download_tiles.BACKOFF_BASE_SECONDS * (2 ** attempt) * 0.5
+        return 0.01
+
+    monkeypatch.setattr(download_tiles, 'backoff_seconds', fake_backoff)
+    return calls
+
+def manifest(conn):
+    rows = conn.execute("SELECT zoom, x, y, status, attempts, error FROM download_manifest").fetchall()
+    return {row[:3]: row[3:] for row in rows}
+
+def run(conn, url, tiles, max_retries=3):
+    pending, _ = download_tiles.select_tiles(conn, tiles)
+    return download_tiles.download_tiles(conn, pending, url, workers=2, rate_per_second=1000, max_retries=max_retries)
+
+# --- TESTES ---
+def test_retries_backoff_and_manifest(tmp_path, tile_server, backoffs):
+    url, requests_per_tile = tile_server
+    conn = mbtiles.open_mbtiles(str(tmp_path / 'tiles.mbtiles'))
+    assert run(conn, url, [OK, FLAKY, MISSING, DOWN]) == (2, 2)
+
+    # 200 logo; 503 duas vezes e depois 200; 404 é definitivo; 503 sempre esgota as tentativas.
+    assert requests_per_tile == {OK: 1, FLAKY: 3, MISSING: 1, DOWN: 4}
+    assert sorted(backoffs) == [0, 0, 1, 1, 2]
+    assert manifest(conn) == {
+        OK: ('done', 1, None), FLAKY: ('done', 3, None),
+        MISSING: ('failed', 1, 'HTTP 404'), DOWN: ('failed', 4, 'HTTP 503'),
+    }
+    stored = conn.execute("SELECT tile_data FROM tiles").fetchall()
+    assert sorted(row[0] for row in stored) == sorted([tile_bytes(OK), tile_bytes(FLAKY)])
+    conn.close()
+
+def test_second_run_skips_done_tiles(tmp_path, tile_server, backoffs):
+    url, requests_per_tile = tile_server
+    path = str(tmp_path / 'tiles.mbtiles')
+    conn = mbtiles.open_mbtiles(path)
+    run(conn, url, [OK, FLAKY, MISSING])
+    conn.close()
+
+    conn = mbtiles.open_mbtiles(path)
+    assert download_tiles.select_tiles(conn, [OK, FLAKY, MISSING]) == ([MISSING], 1)
+    assert download_tiles.select_tiles(conn, [OK, FLAKY, MISSING], skip_failed=True) == ([], 0)
+    # Só o tile que falhou é pedido de novo.
+    assert run(conn, url, [OK, FLAKY, MISSING]) == (0, 1)
+    assert requests_per_tile == {OK: 1, FLAKY: 3, MISSING: 2}
+    assert manifest(conn)[MISSING] == ('failed', 1, 'HTTP 404')
+    conn.close()
+
+def test_backoff_seconds():
+    for attempt in range(4):
+        expected = download_tiles.BACKOFF_BASE_SECONDS * (2 ** attempt)
+        assert expected * 0.5 <= download_tiles.backoff_seconds(attempt) <= expected
+    assert download_tiles.backoff_seconds(10) <= download_tiles.BACKOFF_MAX_SECONDS
+    assert download_tiles.backoff_seconds(0, '7') == 7